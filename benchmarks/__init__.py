@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарки горячих путей агента без оборудования: поддельные GPIO/SPI,
+Modbus TCP сервер, MQTT брокер в процессе и канал LoRa на паре pty.
+
+    python -m benchmarks                      # прогон и сравнение с baseline.json
+    python -m benchmarks --quick              # короткий прогон
+    python -m benchmarks --save-baseline      # записать текущие результаты как эталон
+"""
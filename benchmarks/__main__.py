@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import os
+import sys
+
+from benchmarks.suite import BENCHMARKS, compare, load, run_suite, save
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки mega-agent без оборудования")
+    parser.add_argument('--quick', action='store_true', help="короткий прогон")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="только эти бенчмарки")
+    parser.add_argument('--output', help="записать результаты в JSON")
+    parser.add_argument('--baseline', default=BASELINE, help="эталон для сравнения")
+    parser.add_argument('--save-baseline', action='store_true', help="записать результаты как эталон")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    results = run_suite(quick=args.quick, only=args.only)
+    if args.output:
+        save(args.output, results)
+    if args.save_baseline:
+        save(args.baseline, results)
+        print(f"Эталон записан: {args.baseline}")
+
+    baseline = load(args.baseline) if os.path.exists(args.baseline) and not args.save_baseline else {}
+    report = {row['metric']: row for row in compare(results, baseline, args.tolerance)}
+    regressions = 0
+    for name, current in results['metrics'].items():
+        row = report.get(name)
+        line = f"{name:34} {current['value']:>14.3f} {current['unit']}"
+        if row is not None:
+            line += f"   {row['change'] * 100:+6.1f}% к эталону"
+            if row['regression']:
+                line += "   РЕГРЕССИЯ"
+                regressions += 1
+        print(line)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import socketserver
+import struct
+import threading
+import time
+import tty
+from typing import Dict, List, Optional
+
+from waveshare_epd.epd2in13b_v3 import DC_PIN
+
+
+class FakeGPIO:
+    """RPi.GPIO без платы: уровни пинов в словаре, BUSY всегда свободен."""
+
+    BCM = 11
+    OUT = 0
+    IN = 1
+
+    def __init__(self):
+        self.levels: Dict[int, int] = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode):
+        self.levels.setdefault(pin, 0)
+
+    def output(self, pin, value):
+        self.levels[pin] = value
+
+    def input(self, pin):
+        return 0
+
+    def cleanup(self):
+        pass
+
+
+class FakeSPI:
+    """spidev без шины: считает байты команд и данных и время передачи на частоте max_speed_hz."""
+
+    def __init__(self, gpio: FakeGPIO, max_speed_hz: int = 4000000):
+        self.gpio = gpio
+        self.max_speed_hz = max_speed_hz
+        self.data_bytes = 0
+        self.command_bytes = 0
+        self.transfers = 0
+
+    def writebytes(self, data):
+        self.writebytes2(data)
+
+    def writebytes2(self, data):
+        self.transfers += 1
+        if self.gpio.levels.get(DC_PIN, 0):
+            self.data_bytes += len(data)
+        else:
+            self.command_bytes += len(data)
+
+    def wire_time(self) -> float:
+        return (self.data_bytes + self.command_bytes) * 8 / self.max_speed_hz
+
+    def close(self):
+        pass
+
+
+class ModbusSimulator(socketserver.ThreadingTCPServer):
+    """Modbus TCP сервер в процессе: функции 0x03/0x04, регистры 0..size-1 заполнены счетчиком."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, size: int = 2000, latency: float = 0.0):
+        super().__init__(('127.0.0.1', 0), ModbusHandler)
+        self.registers = [i & 0xFFFF for i in range(size)]
+        self.latency = latency
+        self.requests = 0
+        threading.Thread(target=self.serve_forever, name='modbus-sim', daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class ModbusHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            header = self._recv(7)
+            if not header:
+                return
+            tid, _, length, unit = struct.unpack('>HHHB', header)
+            function, start, count = struct.unpack('>BHH', self._recv(length - 1)[:5])
+            server.requests += 1
+            if server.latency:
+                time.sleep(server.latency)
+            words = server.registers[start:start + count]
+            if count > 125 or len(words) != count:
+                reply = struct.pack('>BB', function | 0x80, 2)
+            else:
+                reply = struct.pack(f'>BB{count}H', function, count * 2, *words)
+            self.request.sendall(struct.pack('>HHHB', tid, 0, len(reply) + 1, unit) + reply)
+
+    def _recv(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return b''
+            data += chunk
+        return data
+
+
+class MqttBrokerStub:
+    """Брокер MQTT в процессе: клиенты получают подтверждения QoS1 из отдельного потока."""
+
+    def __init__(self):
+        self.received = 0
+        self.lock = threading.Lock()
+        self._acks: List = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        threading.Thread(target=self._ack_loop, name='mqtt-broker-stub', daemon=True).start()
+
+    def client(self, options=None) -> 'StubMqttClient':
+        return StubMqttClient(self)
+
+    def _ack_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(0.1)
+            self._wakeup.clear()
+            with self.lock:
+                acks, self._acks = self._acks, []
+            for client, mid in acks:
+                client.on_publish(client, None, mid, 0, None)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+
+
+class _Info:
+    def __init__(self, rc: int, mid: int):
+        self.rc = rc
+        self.mid = mid
+
+
+class StubMqttClient:
+    """Интерфейс paho.mqtt.client.Client (callback API v2), нужный MqttPublisher."""
+
+    def __init__(self, broker: MqttBrokerStub):
+        self.broker = broker
+        self.mid = 0
+        self.on_connect = self.on_disconnect = self.on_publish = None
+
+    def connect_async(self, host, port, keepalive):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def loop_start(self):
+        self.on_connect(self, None, {}, 0, None)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self.on_disconnect(self, None, {}, 0, None)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.mid += 1
+        broker = self.broker
+        with broker.lock:
+            broker.received += 1
+            if qos:
+                broker._acks.append((self, self.mid))
+        if qos:
+            broker._wakeup.set()
+        return _Info(0, self.mid)
+
+
+class PtyLink:
+    """Пара pty вместо радиомодуля: агент открывает slave, benchmark читает и пишет master."""
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        self.port = os.ttyname(self.slave)
+        self.received = 0
+        self._chunks: List[bytes] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reader: Optional[threading.Thread] = None
+
+    def start_reader(self) -> None:
+        self._reader = threading.Thread(target=self._read_loop, name='pty-reader', daemon=True)
+        self._reader.start()
+
+    def _read_loop(self) -> None:
+        import select
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if ready:
+                data = os.read(self.master, 65536)
+                with self._lock:
+                    self._chunks.append(data)
+                    self.received += len(data)
+
+    def take(self) -> bytes:
+        with self._lock:
+            data, self._chunks = b''.join(self._chunks), []
+        return data
+
+    def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.write(self.master, view)
+            view = view[written:]
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._reader is not None:
+            self._reader.join()
+        os.close(self.master)
+        os.close(self.slave)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import platform
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Callable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.simulators import FakeGPIO, FakeSPI, ModbusSimulator, MqttBrokerStub, PtyLink
+
+# Метрика: {'value': число, 'unit': единица, 'better': 'higher' | 'lower'}
+Metrics = Dict[str, Dict[str, Any]]
+
+
+def metric(value: float, unit: str, better: str) -> Dict[str, Any]:
+    return {'value': round(float(value), 6), 'unit': unit, 'better': better}
+
+
+def bench_epd(quick: bool) -> Metrics:
+    from waveshare_epd.epd2in13b_v3 import EPD
+    gpio = FakeGPIO()
+    spi = FakeSPI(gpio)
+    epd = EPD(gpio=gpio, spi=spi)
+    epd.module_init()
+    rng = np.random.default_rng(1)
+    frames = 20 if quick else 200
+    # Разные кадры: кэш буферов не срабатывает, меряется именно упаковка
+    images = [Image.fromarray(rng.integers(0, 256, (epd.height, epd.width), dtype=np.uint8), 'L')
+              for _ in range(frames)]
+    started = time.perf_counter()
+    buffers = [epd.getbuffer(image) for image in images]
+    pack = (time.perf_counter() - started) / frames
+    spi.data_bytes = spi.command_bytes = spi.transfers = 0
+    started = time.perf_counter()
+    for i in range(frames):
+        for _ in range(10):
+            epd.display_buffers(buffers[i], buffers[-1 - i])
+    transfer = (time.perf_counter() - started) / frames / 10
+    return {
+        'epd.pack_ms': metric(pack * 1000, 'ms/frame', 'lower'),
+        'epd.transfer_cpu_ms': metric(transfer * 1000, 'ms/frame', 'lower'),
+        'epd.spi_wire_ms': metric(spi.wire_time() / frames / 10 * 1000, 'ms/frame', 'lower'),
+        'epd.spi_transfers_per_frame': metric(spi.transfers / frames / 10, 'calls/frame', 'lower'),
+    }
+
+
+def bench_industrial(quick: bool) -> Metrics:
+    from modules.industrial_protocols import IndustrialProtocols
+    server = ModbusSimulator()
+    industrial = IndustrialProtocols({'industrial': {'enabled': True, 'protocols': ['modbus_tcp'], 'modbus_tcp': {
+        'host': '127.0.0.1', 'port': server.port, 'unit_id': 1}}})
+    points = [{'name': f"p{i}", 'address': i * 2, 'data_type': 'float32'} for i in range(100)]
+    try:
+        industrial.read_many('modbus_tcp', points)  # подключение
+        cycles = 50 if quick else 300
+        started = time.perf_counter()
+        for _ in range(cycles):
+            industrial.read_many('modbus_tcp', points)
+        elapsed = time.perf_counter() - started
+    finally:
+        industrial.stop()
+        server.close()
+    return {
+        'industrial.points_per_sec': metric(cycles * len(points) / elapsed, 'points/s', 'higher'),
+        'industrial.cycle_ms': metric(elapsed / cycles * 1000, 'ms/100 points', 'lower'),
+    }
+
+
+def bench_mqtt(quick: bool) -> Metrics:
+    from modules.mqtt_publisher import MqttPublisher
+    broker = MqttBrokerStub()
+    messages = 5000 if quick else 30000
+    with tempfile.TemporaryDirectory() as directory:
+        publisher = MqttPublisher({'spool_path': f"{directory}/spool.db", 'max_inflight': 100,
+                                   'queue_size': messages}, client_factory=broker.client)
+        publisher.start()
+        try:
+            started = time.perf_counter()
+            for i in range(messages):
+                publisher.publish(f"sensors/{i % 20}", {'value': i})
+            enqueue = time.perf_counter() - started
+            _wait(lambda: publisher.stats['acked'] >= messages, 60)
+            elapsed = time.perf_counter() - started
+        finally:
+            publisher.stop()
+            broker.close()
+    return {
+        'mqtt.publishes_per_sec': metric(messages / elapsed, 'msg/s', 'higher'),
+        'mqtt.publish_call_us': metric(enqueue / messages * 1e6, 'us/call', 'lower'),
+    }
+
+
+def bench_monitoring(quick: bool) -> Metrics:
+    from modules.monitoring import MonitoringAnalytics
+    analytics = MonitoringAnalytics({'monitoring': {'enabled': True, 'alerts': {'rules': [
+        {'data_type': 'sensor_*', 'type': 'threshold', 'above': 1e9}]}}})
+    samples = 50000 if quick else 300000
+    now = time.time()
+    started = time.perf_counter()
+    for i in range(samples):
+        analytics.collect_data(f"sensor_{i % 100}", 20.0 + i % 7, now + i * 0.01)
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    for i in range(100):
+        analytics.analyze_patterns(f"sensor_{i}")
+        analytics.predict_future(f"sensor_{i}", 24)
+    analysis = time.perf_counter() - started
+    return {
+        'monitoring.samples_per_sec': metric(samples / elapsed, 'samples/s', 'higher'),
+        'monitoring.analysis_ms': metric(analysis * 1000, 'ms/100 series', 'lower'),
+    }
+
+
+def bench_mesh(quick: bool) -> Metrics:
+    from modules.mesh_codec import FrameParser, ReadingCodec
+    from modules.mesh_network import MeshNetwork
+    link = PtyLink()
+    link.start_reader()
+    schema = {'id': 1, 'fields': {'temp': 0.01, 'humidity': 0.1}}
+    mesh = MeshNetwork({'mesh': {'enabled': True, 'protocols': ['lora'], 'lora': {
+        'port': link.port, 'batch_max_delay': 0.05, 'nodes': {'hub': 2}, 'schema': schema}}})
+    mesh.start()
+    messages = 2000 if quick else 10000
+    codec = ReadingCodec(1, schema['fields'].items())
+    parser = FrameParser()
+    received = 0
+    try:
+        started = time.perf_counter()
+        for i in range(messages):
+            mesh.send_message('lora', 'hub', {'temp': 20 + i % 50 * 0.01, 'humidity': 40.0})
+
+        def drained():
+            nonlocal received
+            received += sum(len(codec.decode(p)[2]) for p in parser.feed(link.take()))
+            return received >= 2 * messages
+
+        _wait(drained, 60)
+        elapsed = time.perf_counter() - started
+        stats = mesh.get_stats()['lora']
+    finally:
+        mesh.stop()
+        link.close()
+    return {
+        'mesh.readings_per_sec': metric(received / elapsed, 'readings/s', 'higher'),
+        'mesh.bytes_per_reading': metric(stats['bytes_per_reading'], 'B/reading', 'lower'),
+        'mesh.airtime_per_reading_ms': metric(stats['airtime_per_reading'] * 1000, 'ms/reading', 'lower'),
+    }
+
+
+def bench_poll_cycle(quick: bool) -> Metrics:
+    """Цикл опроса целиком: чтение Modbus, затем приемники monitoring, mqtt и mesh."""
+    from modules.industrial_protocols import IndustrialProtocols
+    from modules.monitoring import MonitoringAnalytics
+    from modules.mqtt_publisher import MqttPublisher
+    from modules.mesh_network import MeshNetwork
+    from modules.scheduler import PollScheduler
+
+    server = ModbusSimulator()
+    broker = MqttBrokerStub()
+    link = PtyLink()
+    link.start_reader()
+    directory = tempfile.TemporaryDirectory()
+    industrial = IndustrialProtocols({'industrial': {'enabled': True, 'protocols': ['modbus_tcp'], 'modbus_tcp': {
+        'host': '127.0.0.1', 'port': server.port, 'unit_id': 1}}})
+    monitoring = MonitoringAnalytics({'monitoring': {'enabled': True}})
+    mqtt = MqttPublisher({'spool_path': f"{directory.name}/spool.db"}, client_factory=broker.client)
+    mesh = MeshNetwork({'mesh': {'enabled': True, 'protocols': ['lora'], 'lora': {'port': link.port}}})
+    points = [{'name': f"sensor_{i}", 'key': 'temp', 'protocol': 'modbus_tcp', 'address': i * 2,
+               'data_type': 'float32', 'interval': 0.05, 'sinks': ['monitoring', 'mqtt', 'mesh']}
+              for i in range(20)]
+
+    cycle_started: Dict[int, float] = {}
+    cycle_done: Dict[float, float] = {}
+    lock = threading.Lock()
+
+    def reader(protocol, job_points):
+        cycle_started[id(job_points)] = started = time.perf_counter()
+        with lock:
+            cycle_done[started] = started
+        return industrial.read_many(protocol, job_points)
+
+    job_of = {}
+
+    def timed(sink):
+        def call(point, value, ts):
+            sink(point, value, ts)
+            started = cycle_started[job_of[point['name']]]
+            finished = time.perf_counter()
+            with lock:
+                if finished > cycle_done.get(started, 0):
+                    cycle_done[started] = finished
+        return call
+
+    sinks = {
+        'monitoring': timed(lambda point, value, ts: monitoring.collect_data(point['name'], value, ts)),
+        'mqtt': timed(lambda point, value, ts: mqtt.publish(f"sensors/{point['name']}", {point['key']: value})),
+        'mesh': timed(lambda point, value, ts: mesh.send_message('lora', 'hub', {point['key']: value})),
+    }
+    scheduler = PollScheduler({'polling': {'points': points}}, reader, sinks)
+    for job in scheduler.jobs.values():
+        for point in job.points:
+            job_of[point['name']] = id(job.points)
+    mqtt.start()
+    mesh.start()
+    try:
+        scheduler.start()
+        time.sleep(1.0 if quick else 3.0)
+        scheduler.stop()
+        stats = scheduler.get_stats()['jobs']
+    finally:
+        mesh.stop()
+        mqtt.stop()
+        industrial.stop()
+        broker.close()
+        link.close()
+        server.close()
+        directory.cleanup()
+    latencies = sorted(done - started for started, done in cycle_done.items() if done > started)
+    job = next(iter(stats.values()))
+    return {
+        'poll.cycle_latency_avg_ms': metric(statistics.mean(latencies) * 1000, 'ms', 'lower'),
+        'poll.cycle_latency_p95_ms': metric(latencies[int(len(latencies) * 0.95)] * 1000, 'ms', 'lower'),
+        'poll.overruns': metric(job['overruns'], 'cycles', 'lower'),
+    }
+
+
+def bench_metrics(quick: bool) -> Metrics:
+    """Цена одного наблюдения метрики и выгрузки /metrics на реестре размером с агент."""
+    from modules.metrics import MetricsRegistry, measure_overhead
+    overhead = measure_overhead(iterations=50000 if quick else 200000)
+    registry = MetricsRegistry()
+    for i in range(100):
+        registry.counter(f"bench_counter_{i}_total", 'counter', {'module': 'bench'}).inc(i)
+    for i in range(20):
+        registry.histogram('bench_seconds', 'histogram', {'job': str(i)}).observe(i * 0.001)
+    started = time.perf_counter()
+    for _ in range(10):
+        registry.render()
+    render = (time.perf_counter() - started) / 10
+    return {
+        'metrics.counter_inc_ns': metric(overhead['counter_inc_ns'], 'ns', 'lower'),
+        'metrics.histogram_observe_ns': metric(overhead['histogram_observe_ns'], 'ns', 'lower'),
+        'metrics.render_ms': metric(render * 1000, 'ms', 'lower'),
+    }
+
+
+BENCHMARKS: Dict[str, Callable[[bool], Metrics]] = {
+    'epd': bench_epd,
+    'industrial': bench_industrial,
+    'mqtt': bench_mqtt,
+    'monitoring': bench_monitoring,
+    'mesh': bench_mesh,
+    'poll': bench_poll_cycle,
+    'metrics': bench_metrics,
+}
+
+
+def run_suite(quick: bool = False, only: Optional[List[str]] = None, repeats: Optional[int] = None) -> Dict[str, Any]:
+    """Каждый бенчмарк прогоняется repeats раз, по каждой метрике берется лучший результат: шум только ухудшает."""
+    repeats = repeats or (1 if quick else 3)
+    metrics: Metrics = {}
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        for _ in range(repeats):
+            for key, current in bench(quick).items():
+                best = metrics.get(key)
+                if best is None or (current['value'] > best['value']) == (current['better'] == 'higher'):
+                    metrics[key] = current
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'processor': platform.machine()},
+        'quick': quick,
+        'metrics': metrics,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.25) -> List[Dict[str, Any]]:
+    """Сравнение с эталоном: регрессия - ухудшение больше чем на tolerance (доля)."""
+    report = []
+    for name, current in results['metrics'].items():
+        reference = baseline.get('metrics', {}).get(name)
+        if reference is None:
+            continue
+        base, value = reference['value'], current['value']
+        if current['better'] == 'higher':
+            change = (value - base) / base if base else 0.0
+        else:
+            change = (base - value) / base if base else (0.0 if value <= base else -1.0)
+        report.append({'metric': name, 'baseline': base, 'value': value, 'unit': current['unit'],
+                       'change': change, 'regression': change < -tolerance})
+    return report
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(path: str, results: Dict[str, Any]) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def _wait(condition: Callable[[], bool], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Бенчмарк не дождался завершения")
+        time.sleep(0.002)
@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sys
 import time
 import json
 import logging
-from modules.mesh_network import MeshNetwork
-from modules.industrial_protocols import IndustrialProtocols
-from modules.integrations import Integrations
-from modules.monitoring import MonitoringAnalytics
-from modules.business_integrations import BusinessIntegrations
+from modules.metrics import REGISTRY, MetricsServer
+from modules.runtime import ServiceStack, build_sinks, create_components
+from modules.scheduler import PollScheduler
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,51 +27,74 @@ def main():
     logger.info("=== ЗАПУСК MEGA-AGENT ===")
     config = load_config()
 
-    # Создание экземпляров модулей
-    mesh = MeshNetwork(config)
-    industrial = IndustrialProtocols(config)
-    integrations = Integrations(config)
-    monitoring = MonitoringAnalytics(config)
-    business = BusinessIntegrations(config)
+    if '--supervisor' in sys.argv[1:] or config.get('supervisor', {}).get('enabled', False):
+        # Группы модулей в отдельных процессах, отсчеты между ними - через общую память
+        from modules.supervisor import Supervisor
+        Supervisor(config).run()
+        logger.info("=== MEGA-AGENT ОСТАНОВЛЕН ===")
+        return
+
+    started = time.time()
+    REGISTRY.gauge('mega_agent_uptime_seconds', 'Время работы агента', function=lambda: time.time() - started)
+    # Модули останавливаются в обратном порядке запуска, ошибка одного не мешает остальным
+    services = ServiceStack()
+
+    # /metrics для Prometheus и профилировщик, включаемый на ходу (POST /profile/start)
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled', False):
+        metrics_server = MetricsServer.from_config(metrics_config)
+        try:
+            services.start('metrics', metrics_server)
+        except OSError as e:
+            logger.error(f"Не удалось открыть порт метрик: {e}")
+            metrics_server.stop()
+
+    # Создаются и импортируются только включенные в настройках модули
+    components = create_components(config)
+    api = None
+    if config.get('api', {}).get('enabled', False):
+        from modules.web_api import ApiService
+        # Дашборд читает готовые снимки: запросы не доходят до модулей и не мешают опросу
+        api = ApiService(config, components.get('monitoring'),
+                         {name: module for name, module in components.items() if hasattr(module, 'get_stats')})
+    if 'monitoring' in components and 'integrations' in components:
+        # Алерты правил мониторинга уходят через MQTT/Telegram интеграций
+        components['monitoring'].set_alert_sender(components['integrations'].send_alert)
 
     # Запуск модулей
     try:
-        mesh.start()
-        industrial.start()
-        integrations.start()
-        monitoring.start()
-        business.start()
-        logger.info("Все модули запущены.")
+        for name, module in components.items():
+            services.start(name, module)
+        logger.info(f"Запущены модули: {', '.join(components) or 'нет'}")
     except Exception as e:
         logger.error(f"Ошибка при запуске модулей: {e}")
+        services.stop_all()
         return
 
-    # Основной цикл агента
+    # Все точки группы читаются пакетно: соседние регистры - одним запросом
+    industrial = components.get('industrial')
+    reader = industrial.read_many if industrial is not None else (lambda protocol, points: {})
+    scheduler = PollScheduler(config, reader, build_sinks(components, api))
+    if api is not None:
+        api.add_source('polling', scheduler)
+
+    # Основной цикл агента: опрос идет в планировщике, здесь только статистика
     logger.info("Вход в основной цикл.")
     try:
+        services.start('scheduler', scheduler)
+        if api is not None:
+            services.start('api', api)
         while True:
-            # Имитация чтения данных
-            temperature = industrial.read_register('modbus_tcp', 100, data_type='float32')
-            if temperature is not None:
-                logger.info(f"[Modbus] Температура: {temperature:.2f} °C")
-                mesh.send_message('lora', 'node_sensor_hub', {'temp': temperature})
-                integrations.publish_mqtt('sensors/temp', {'temp': temperature})
-                monitoring.collect_data('temperature_kitchen', temperature)
-            time.sleep(10)
+            time.sleep(60)
+            for name, stats in scheduler.get_stats()['jobs'].items():
+                logger.info(f"[Опрос] {name}: {stats['runs']} опросов, "
+                            f"задержка {stats['avg_latency'] * 1000:.1f} мс (макс {stats['max_latency'] * 1000:.1f} мс), "
+                            f"пропусков {stats['overruns']}, нарушений срока {stats['deadline_misses']}")
     except KeyboardInterrupt:
         logger.info("Получен сигнал завершения (Ctrl+C).")
     finally:
         logger.info("Остановка модулей...")
-        try: mesh.stop()
-        except: pass
-        try: industrial.stop()
-        except: pass
-        try: integrations.stop()
-        except: pass
-        try: monitoring.stop()
-        except: pass
-        try: business.stop()
-        except: pass
+        services.stop_all()
         logger.info("=== MEGA-AGENT ОСТАНОВЛЕН ===")
 
 if __name__ == "__main__":
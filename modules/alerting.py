@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import logging
+import time
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+from modules.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+LEVELS = {'info': 0, 'warning': 1, 'critical': 2}
+
+
+class Alert:
+    __slots__ = ('rule', 'data_type', 'level', 'message', 'value', 'timestamp', 'firing', 'channels')
+
+    def __init__(self, rule: 'Rule', data_type: str, message: str, value: Optional[float],
+                 timestamp: float, firing: bool):
+        self.rule = rule.name
+        self.data_type = data_type
+        self.level = rule.level if firing else 'info'
+        self.message = message
+        self.value = value
+        self.timestamp = timestamp
+        self.firing = firing
+        self.channels = rule.channels
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Rule:
+    """Правило для одного ряда. Алерт выдается только при смене состояния: сработало или вернулось в норму."""
+
+    __slots__ = ('name', 'data_type', 'level', 'channels', 'active')
+
+    def __init__(self, options: Dict[str, Any], data_type: str, channels: List[str]):
+        self.name = options.get('name') or f"{options['type']}:{data_type}"
+        self.data_type = data_type
+        self.level = options.get('level', 'warning')
+        self.channels = tuple(options.get('channels', channels))
+        self.active = False
+
+    def check(self, timestamp: float, value: float) -> Optional[Alert]:
+        raise NotImplementedError
+
+    def _transition(self, firing: bool, timestamp: float, value: Optional[float], message: str) -> Alert:
+        self.active = firing
+        return Alert(self, self.data_type, message, value, timestamp, firing)
+
+
+class ThresholdRule(Rule):
+    """Выход за above/below; гистерезис: норма восстанавливается только за clear_below/clear_above."""
+
+    __slots__ = ('above', 'below', 'clear_above', 'clear_below')
+
+    def __init__(self, options: Dict[str, Any], data_type: str, channels: List[str]):
+        super().__init__(options, data_type, channels)
+        self.above = float(options.get('above', float('inf')))
+        self.below = float(options.get('below', float('-inf')))
+        self.clear_below = float(options.get('clear_below', self.above))
+        self.clear_above = float(options.get('clear_above', self.below))
+
+    def check(self, timestamp: float, value: float) -> Optional[Alert]:
+        if not self.active:
+            if value > self.above:
+                return self._transition(True, timestamp, value, f"{self.data_type} = {value:g} выше {self.above:g}")
+            if value < self.below:
+                return self._transition(True, timestamp, value, f"{self.data_type} = {value:g} ниже {self.below:g}")
+        elif self.clear_above <= value <= self.clear_below:
+            return self._transition(False, timestamp, value, f"{self.data_type} = {value:g} в норме")
+        return None
+
+
+class RateRule(Rule):
+    """Скорость изменения (единиц в секунду) по соседним отсчетам больше max_rate."""
+
+    __slots__ = ('max_rate', 'clear_rate', 'last_time', 'last_value')
+
+    def __init__(self, options: Dict[str, Any], data_type: str, channels: List[str]):
+        super().__init__(options, data_type, channels)
+        self.max_rate = float(options['max_rate'])
+        self.clear_rate = float(options.get('clear_rate', self.max_rate))
+        self.last_time: Optional[float] = None
+        self.last_value = 0.0
+
+    def check(self, timestamp: float, value: float) -> Optional[Alert]:
+        last_time, last_value = self.last_time, self.last_value
+        self.last_time, self.last_value = timestamp, value
+        if last_time is None or timestamp <= last_time:
+            return None
+        rate = abs(value - last_value) / (timestamp - last_time)
+        if not self.active and rate > self.max_rate:
+            return self._transition(True, timestamp, value,
+                                    f"{self.data_type} меняется со скоростью {rate:.3g}/с (порог {self.max_rate:g})")
+        if self.active and rate <= self.clear_rate:
+            return self._transition(False, timestamp, value, f"{self.data_type}: скорость изменения в норме")
+        return None
+
+
+class StaleRule(Rule):
+    """Нет отсчетов дольше max_age секунд; проверяется по таймеру в check_stale()."""
+
+    __slots__ = ('max_age', 'last_time')
+
+    def __init__(self, options: Dict[str, Any], data_type: str, channels: List[str]):
+        super().__init__(options, data_type, channels)
+        self.max_age = float(options['max_age'])
+        self.last_time: Optional[float] = None
+
+    def check(self, timestamp: float, value: float) -> Optional[Alert]:
+        self.last_time = timestamp
+        if self.active:
+            return self._transition(False, timestamp, value, f"{self.data_type}: данные снова поступают")
+        return None
+
+    def expire(self, now: float) -> Optional[Alert]:
+        if not self.active and self.last_time is not None and now - self.last_time > self.max_age:
+            return self._transition(True, now, None,
+                                    f"{self.data_type}: нет данных {now - self.last_time:.0f} с")
+        return None
+
+
+RULE_TYPES = {'threshold': ThresholdRule, 'rate': RateRule, 'stale': StaleRule}
+
+
+class RuleEngine:
+    """
+    Правила из настроек разбираются один раз и раскладываются по data_type: отсчет
+    проверяет только правила своего ряда, поэтому цена отсчета не зависит от общего
+    числа правил. Правила с шаблоном в data_type ("temperature_*") привязываются к
+    ряду при его первом отсчете.
+    """
+
+    def __init__(self, rules: Iterable[Dict[str, Any]] = (), channels: Iterable[str] = ('mqtt',),
+                 stale_check_interval: float = 1.0):
+        self.channels = list(channels)
+        self.index: Dict[str, Tuple[Rule, ...]] = {}
+        self.patterns: List[Dict[str, Any]] = []
+        self.stale: List[StaleRule] = []
+        self.stale_check_interval = stale_check_interval
+        self._next_stale_check = 0.0
+        self.rule_count = 0
+        for options in rules:
+            if options.get('type') not in RULE_TYPES:
+                raise ValueError(f"Неизвестный тип правила: {options.get('type')}")
+            data_type = options['data_type']
+            if any(char in data_type for char in '*?['):
+                self.patterns.append(options)
+            else:
+                self._bind(data_type, [options])
+
+    @classmethod
+    def from_config(cls, options: Dict[str, Any]) -> 'RuleEngine':
+        return cls(options.get('rules', []), options.get('default_channels', ['mqtt']),
+                   float(options.get('stale_check_interval', 1.0)))
+
+    def _bind(self, data_type: str, rules: List[Dict[str, Any]]) -> Tuple[Rule, ...]:
+        compiled = [RULE_TYPES[options['type']](options, data_type, self.channels) for options in rules]
+        self.stale.extend(rule for rule in compiled if isinstance(rule, StaleRule))
+        self.rule_count += len(compiled)
+        bound = self.index.get(data_type, ()) + tuple(compiled)
+        self.index[data_type] = bound
+        return bound
+
+    def evaluate(self, data_type: str, timestamp: float, value: float) -> List[Alert]:
+        rules = self.index.get(data_type)
+        if rules is None:
+            rules = self._bind(data_type, [options for options in self.patterns
+                                           if fnmatch.fnmatchcase(data_type, options['data_type'])])
+        alerts = []
+        for rule in rules:
+            alert = rule.check(timestamp, value)
+            if alert is not None:
+                alerts.append(alert)
+        if timestamp >= self._next_stale_check and self.stale:
+            alerts.extend(self.check_stale(timestamp))
+        return alerts
+
+    def check_stale(self, now: Optional[float] = None) -> List[Alert]:
+        now = time.time() if now is None else now
+        self._next_stale_check = now + self.stale_check_interval
+        alerts = []
+        for rule in self.stale:
+            alert = rule.expire(now)
+            if alert is not None:
+                alerts.append(alert)
+        return alerts
+
+    def active(self) -> List[str]:
+        return [rule.name for rules in self.index.values() for rule in rules if rule.active]
+
+
+class AlertNotifier:
+    """
+    Доставка алертов по каналам. Переход, повторяющий уже доставленное в канал
+    состояние правила, подавляется; переход, отменяющий еще не отправленный переход
+    моложе dedup_window (дребезг), снимает оба. Переход, меняющий доставленное
+    состояние, не теряется никогда. Алерты канала копятся group_window секунд
+    и уходят одним сообщением; если лимит канала исчерпан, они продолжают копиться
+    и уходят сводкой, когда лимит позволит.
+    """
+
+    def __init__(self, send: Callable[[str, str, str], Any], channels: Optional[Dict[str, Dict[str, Any]]] = None,
+                 group_window: float = 5.0, dedup_window: float = 300.0, max_group: int = 100):
+        self.send = send
+        self.channel_options = channels or {}
+        self.group_window = group_window
+        self.dedup_window = dedup_window
+        self.max_group = max_group
+        self.limits: Dict[str, TokenBucket] = {}
+        self._pending: Dict[str, List[Alert]] = {}
+        self._overflow: Dict[str, int] = {}
+        self._group_started: Dict[str, float] = {}
+        # (канал, правило, ряд) -> состояние, о котором знают получатели канала
+        self._state: Dict[Tuple[str, str, str], bool] = {}
+        self._queued: Dict[Tuple[str, str, str], Tuple[Alert, float]] = {}
+        self.stats: Dict[str, int] = {'alerts': 0, 'deduplicated': 0, 'messages': 0, 'rate_limited': 0,
+                                      'overflow': 0, 'errors': 0}
+
+    @classmethod
+    def from_config(cls, send: Callable[[str, str, str], Any], options: Dict[str, Any]) -> 'AlertNotifier':
+        return cls(send, options.get('channels', {}), float(options.get('group_window', 5.0)),
+                   float(options.get('dedup_window', 300.0)), int(options.get('max_group', 100)))
+
+    def _limit(self, channel: str) -> TokenBucket:
+        limit = self.limits.get(channel)
+        if limit is None:
+            options = self.channel_options.get(channel, {})
+            limit = self.limits[channel] = TokenBucket(float(options.get('rate', 0.2)),
+                                                       float(options.get('burst', 5)))
+        return limit
+
+    def submit(self, alerts: Iterable[Alert], now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        for alert in alerts:
+            self.stats['alerts'] += 1
+            for channel in alert.channels:
+                key = (channel, alert.rule, alert.data_type)
+                if self._state.get(key, False) == alert.firing:
+                    self.stats['deduplicated'] += 1
+                    continue
+                self._state[key] = alert.firing
+                pending = self._pending.setdefault(channel, [])
+                queued = self._queued.pop(key, None)
+                if queued is not None and now - queued[1] < self.dedup_window and \
+                        any(item is queued[0] for item in pending):
+                    # Дребезг: получатели так и не узнали о прошлом переходе - отменяем оба
+                    pending[:] = [item for item in pending if item is not queued[0]]
+                    self.stats['deduplicated'] += 2
+                    continue
+                self._queued[key] = (alert, now)
+                if not pending:
+                    self._group_started[channel] = now
+                if len(pending) < self.max_group:
+                    pending.append(alert)
+                else:
+                    self._overflow[channel] = self._overflow.get(channel, 0) + 1
+                    self.stats['overflow'] += 1
+        self.flush(now)
+
+    def flush(self, now: Optional[float] = None, force: bool = False) -> int:
+        now = time.monotonic() if now is None else now
+        sent = 0
+        for channel, pending in self._pending.items():
+            if not pending or (not force and now - self._group_started[channel] < self.group_window):
+                continue
+            if not self._limit(channel).try_acquire():
+                self.stats['rate_limited'] += 1
+                continue
+            message, level = self._compose(pending, self._overflow.pop(channel, 0))
+            self._pending[channel] = []
+            try:
+                self.send(message, level, channel)
+                self.stats['messages'] += 1
+                sent += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка отправки алерта через {channel}: {e}")
+        return sent
+
+    @staticmethod
+    def _compose(alerts: List[Alert], overflow: int) -> Tuple[str, str]:
+        level = max((alert.level for alert in alerts), key=lambda name: LEVELS.get(name, 0))
+        if len(alerts) == 1 and not overflow:
+            return alerts[0].message, level
+        total = len(alerts) + overflow
+        lines = [alert.message for alert in alerts[:10]]
+        if total > len(lines):
+            lines.append(f"... и еще {total - len(lines)}")
+        return f"Алертов: {total}\n" + "\n".join(lines), level
+
+    def pending(self) -> int:
+        return sum(len(alerts) for alerts in self._pending.values())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+
+def resolve_compression(compression: str) -> str:
+    if compression == 'zstd' and zstandard is None:
+        logger.warning("Пакет zstandard не установлен, резервные копии сжимаются gzip")
+        return 'gzip'
+    if compression not in EXTENSIONS:
+        logger.warning(f"Неизвестное сжатие {compression}, используется gzip")
+        return 'gzip'
+    return compression
+
+
+@contextmanager
+def atomic_write(path: str):
+    # Пишем во временный файл и переименовываем: недописанной копии на диске не бывает
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    f = open(tmp_path, 'wb')
+    try:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        f.close()
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def compressed_writer(raw, compression: str):
+    if compression == 'gzip':
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+            yield f
+    elif compression == 'zstd':
+        with zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False) as f:
+            yield f
+    else:
+        yield raw
+
+
+def open_compressed(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("Для чтения .zst нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def iter_records(data: Any) -> Tuple[str, Iterator[Any]]:
+    """Вид данных и поток записей: пары ключ-значение словаря, элементы итерируемого или одно значение."""
+    if isinstance(data, dict):
+        return 'dict', (list(item) for item in data.items())
+    if isinstance(data, (str, bytes)) or not hasattr(data, '__iter__'):
+        return 'value', iter([data])
+    return 'list', iter(data)
+
+
+def encode_lines(records: Iterator[Any]) -> Iterator[bytes]:
+    for record in records:
+        yield (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+
+class BackupEngine:
+    """
+    Потоковые резервные копии в JSON Lines. Полная копия - один сжатый файл;
+    инкрементальная - манифест со списком фрагментов в общем хранилище, где
+    каждый фрагмент лежит один раз (имя - хэш содержимого), поэтому новая копия
+    записывает только изменившиеся фрагменты.
+    """
+
+    def __init__(self, storage: str, compression: str = 'gzip', chunk_size: int = 1024 * 1024,
+                 average_chunk_records: int = 256):
+        self.storage = storage
+        self.compression = resolve_compression(compression)
+        self.chunk_size = chunk_size
+        # Границы фрагментов зависят от содержимого записей, а не от смещения: вставка
+        # записи меняет только свой фрагмент, а не все последующие
+        self.average_chunk_records = average_chunk_records
+        self.chunks_path = os.path.join(storage, 'chunks')
+        self.stats: Dict[str, int] = {'records': 0, 'bytes_in': 0, 'chunks_written': 0, 'chunks_reused': 0}
+
+    def create_full(self, data_source: str, data: Any, filename: str) -> str:
+        os.makedirs(self.storage, exist_ok=True)
+        path = os.path.join(self.storage, filename + '.jsonl' + EXTENSIONS[self.compression])
+        kind, records = iter_records(data)
+        header = {'source': data_source, 'timestamp': datetime.now().isoformat(), 'kind': kind}
+        with atomic_write(path) as raw, compressed_writer(raw, self.compression) as f:
+            f.write((json.dumps(header, ensure_ascii=False) + '\n').encode('utf-8'))
+            buffer = io.BytesIO()
+            for line in encode_lines(records):
+                buffer.write(line)
+                self.stats['records'] += 1
+                self.stats['bytes_in'] += len(line)
+                if buffer.tell() >= self.chunk_size:
+                    f.write(buffer.getvalue())
+                    buffer = io.BytesIO()
+            f.write(buffer.getvalue())
+        return path
+
+    def create_incremental(self, data_source: str, data: Any, filename: str) -> str:
+        os.makedirs(self.chunks_path, exist_ok=True)
+        kind, records = iter_records(data)
+        chunks: List[str] = []
+        count = 0
+        for chunk in self._chunks(encode_lines(records)):
+            chunks.append(self._store_chunk(chunk))
+            count += chunk.count(b'\n')
+        manifest = {'source': data_source, 'timestamp': datetime.now().isoformat(), 'kind': kind,
+                    'compression': self.compression, 'records': count, 'chunks': chunks}
+        path = os.path.join(self.storage, filename + '.manifest.json')
+        with atomic_write(path) as f:
+            f.write(json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+        return path
+
+    def _chunks(self, lines: Iterator[bytes]) -> Iterator[bytes]:
+        buffer = io.BytesIO()
+        min_size = self.chunk_size // 16
+        for line in lines:
+            buffer.write(line)
+            self.stats['records'] += 1
+            self.stats['bytes_in'] += len(line)
+            size = buffer.tell()
+            if size >= self.chunk_size or (
+                    size >= min_size and zlib.crc32(line) % self.average_chunk_records == 0):
+                yield buffer.getvalue()
+                buffer = io.BytesIO()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def _chunk_path(self, digest: str, compression: str) -> str:
+        return os.path.join(self.chunks_path, digest[:2], digest + EXTENSIONS[compression])
+
+    def _store_chunk(self, chunk: bytes) -> str:
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(digest, self.compression)
+        if os.path.exists(path):
+            self.stats['chunks_reused'] += 1
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as raw, compressed_writer(raw, self.compression) as f:
+            f.write(chunk)
+        self.stats['chunks_written'] += 1
+        return digest
+
+    def read_info(self, path: str) -> Dict[str, Any]:
+        if path.endswith('.manifest.json'):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        with open_compressed(path) as f:
+            return json.loads(io.BufferedReader(f).readline())
+
+    def iter_backup(self, path: str) -> Iterator[Any]:
+        """Записи копии по одной, без загрузки всей копии в память."""
+        if path.endswith('.manifest.json'):
+            info = self.read_info(path)
+            for digest in info['chunks']:
+                with open_compressed(self._chunk_path(digest, info['compression'])) as f:
+                    for line in io.BufferedReader(f):
+                        yield json.loads(line)
+            return
+        with open_compressed(path) as f:
+            reader = io.BufferedReader(f)
+            reader.readline()  # заголовок
+            for line in reader:
+                yield json.loads(line)
+
+    def restore(self, path: str) -> Any:
+        # Полное восстановление в исходный вид (для небольших данных)
+        kind = self.read_info(path)['kind']
+        records = self.iter_backup(path)
+        if kind == 'dict':
+            return {key: value for key, value in records}
+        if kind == 'value':
+            return next(records, None)
+        return list(records)
+
+    def prune_chunks(self) -> int:
+        """Удаляет фрагменты, на которые не ссылается ни один манифест."""
+        used = set()
+        for name in os.listdir(self.storage):
+            if name.endswith('.manifest.json'):
+                used.update(self.read_info(os.path.join(self.storage, name))['chunks'])
+        removed = 0
+        for directory, _, files in os.walk(self.chunks_path):
+            for name in files:
+                if name.split('.')[0] not in used:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        return removed
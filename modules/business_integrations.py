@@ -3,56 +3,124 @@
 
 import logging
 import json
-import os
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Iterator
+
+from modules.backup import BackupEngine
+from modules.cache import TTLCache
+from modules.metrics import REGISTRY
+from modules.sync_engine import SyncEngine
 
 logger = logging.getLogger(__name__)
 
+BACKUP_SECONDS = REGISTRY.histogram('mega_agent_backup_seconds', 'Длительность создания резервной копии',
+                                    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900))
+
 class BusinessIntegrations:
     def __init__(self, config: Dict[str, Any]):
         self.config = config.get('business', {})
         self.enabled = self.config.get('enabled', False)
         self.systems = self.config.get('systems', [])
         self.backup_storage = self.config.get('backup_storage', './backups')
+        self.backup_incremental = self.config.get('backup_incremental', True)
+        self.backups = BackupEngine(
+            self.backup_storage,
+            compression=self.config.get('backup_compression', 'gzip'),
+            chunk_size=int(self.config.get('backup_chunk_kb', 1024)) * 1024,
+        )
+        # Медленные запросы к CRM/ERP не повторяются, пока ответ свежий
+        cache_options = self.config.get('cache', {})
+        self.cache = TTLCache.from_config(cache_options)
+        self.status_ttl = float(cache_options.get('status_ttl', 30))
+        self.sync: SyncEngine = None
+        self.last_backup: Dict[str, Any] = {}
+        stats = self.backups.stats
+        for name in stats:
+            REGISTRY.counter(f'mega_agent_backup_{name}_total', f"Резервные копии: {name}",
+                             function=lambda name=name: stats[name])
+        REGISTRY.gauge('mega_agent_sync_outbox_depth', 'Записей в outbox синхронизации',
+                       function=lambda: len(self.sync.outbox) if self.sync is not None and self.sync.outbox else 0)
         logger.info("Инициализирован модуль BusinessIntegrations (заглушка)")
 
     def start(self) -> None:
         if self.enabled:
+            targets = {name: self.config.get(name, {}) for name in self.systems
+                       if self.config.get(name, {}).get('enabled', False)}
+            if targets:
+                self.sync = SyncEngine(self.config.get('sync', {}), targets)
+                self.sync.start()
             logger.info("Инициализация бизнес-интеграций (заглушка)")
         else:
             logger.info("Бизнес-интеграции отключены")
 
     def stop(self) -> None:
+        if self.sync is not None:
+            self.sync.stop()
+            self.sync = None
+        self.cache.close()
         logger.info("Бизнес-интеграции остановлены (заглушка)")
 
     def sync_data(self, system: str, data_type: str, data: Any) -> bool:
+        # Только постановка в очередь: пачки отправляет фоновый поток SyncEngine; data может быть списком записей
+        if self.sync is not None:
+            return self.sync.submit(system, data_type, data)
         logger.debug(f"Синхронизация данных {data_type} с {system} (заглушка)")
         return True
 
     def get_business_data(self, system: str, data_type: str, filters: Dict = None) -> Dict:
+        key = ('data', system, data_type, json.dumps(filters, sort_keys=True, default=str))
+        return self.cache.get(key, lambda: self._fetch_business_data(system, data_type, filters))
+
+    def _fetch_business_data(self, system: str, data_type: str, filters: Dict = None) -> Dict:
         logger.debug(f"Получение данных {data_type} из {system} (заглушка)")
         return {"data": f"sample_{data_type}_from_{system}", "filters": filters}
 
     def create_backup(self, data_source: str, data: Any, backup_name: str = None) -> str:
+        # data может быть генератором: записи кодируются и сжимаются по фрагментам,
+        # так что память не зависит от объема копии
+        started = time.perf_counter()
         try:
-            os.makedirs(self.backup_storage, exist_ok=True)
             if not backup_name:
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                backup_name = f"backup_{data_source}_{timestamp}.json"
-            filepath = os.path.join(self.backup_storage, backup_name)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'source': data_source,
-                    'timestamp': datetime.now().isoformat(),
-                    'data': data
-                }, f, indent=2, ensure_ascii=False)
-            logger.info(f"Резервная копия создана: {filepath} (заглушка)")
+                backup_name = f"backup_{data_source}_{timestamp}"
+            if self.backup_incremental:
+                filepath = self.backups.create_incremental(data_source, data, backup_name)
+            else:
+                filepath = self.backups.create_full(data_source, data, backup_name)
+            self.last_backup = {'path': filepath, 'timestamp': time.time(), 'error': ''}
+            logger.info(f"Резервная копия создана: {filepath}")
             return filepath
         except Exception as e:
-            logger.error(f"Ошибка создания резервной копии (заглушка): {e}")
+            self.last_backup = {'path': '', 'timestamp': time.time(), 'error': str(e)}
+            logger.error(f"Ошибка создания резервной копии: {e}")
             return ""
+        finally:
+            BACKUP_SECONDS.observe(time.perf_counter() - started)
+
+    def restore_backup(self, filepath: str) -> Iterator[Any]:
+        return self.backups.iter_backup(filepath)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'sync': self.sync.get_stats() if self.sync is not None else None,
+                'backups': dict(self.backups.stats), 'last_backup': self.last_backup}
 
     def get_system_status(self, system: str) -> Dict[str, Any]:
-        logger.debug(f"Получение статуса системы {system} (заглушка)")
-        return {'status': 'simulated', 'details': 'This is a stub'}
+        return self.cache.get(('status', system), lambda: self._fetch_system_status(system), ttl=self.status_ttl)
+
+    def _fetch_system_status(self, system: str) -> Dict[str, Any]:
+        """
+        Статус по фактическому обмену: unknown - системы нет в настройках, disabled,
+        stopped - синхронизация не запущена, idle - запросов еще не было, ok или
+        degraded - последняя отправка пачки прошла или нет.
+        """
+        options = self.config.get(system)
+        if system not in self.systems or not isinstance(options, dict):
+            return {'status': 'unknown', 'last_backup': self.last_backup}
+        if not (self.enabled and options.get('enabled', False)):
+            return {'status': 'disabled', 'last_backup': self.last_backup}
+        status = self.sync.target_status(system) if self.sync is not None else None
+        if status is None:
+            status = {'status': 'stopped'}
+        status['last_backup'] = self.last_backup
+        return status
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    __slots__ = ('value', 'inserted', 'expires', 'stale_until', 'size')
+
+    def __init__(self, value: Any, inserted: float, expires: float, stale_until: float, size: int):
+        self.value = value
+        self.inserted = inserted
+        self.expires = expires
+        self.stale_until = stale_until
+        self.size = size
+
+
+class TTLCache:
+    """
+    LRU-кэш с TTL на запись и ограничением по числу записей и памяти.
+    Одновременные промахи по одному ключу выполняют одну загрузку; просроченная
+    запись еще stale_ttl секунд отдается сразу, а обновляется в фоне. max_age в get()
+    ограничивает возраст значения для этого вызова: более старая запись - промах.
+    """
+
+    def __init__(self, max_entries: int = 1024, default_ttl: float = 300, stale_ttl: float = 0,
+                 memory_mb: float = 8):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.memory_budget = int(memory_mb * 1024 * 1024)
+        self._entries: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+        self._loading: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._refresher: Optional[ThreadPoolExecutor] = None
+        self.stats: Dict[str, int] = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0,
+                                      'refreshes': 0, 'evictions': 0, 'expirations': 0, 'errors': 0}
+
+    @classmethod
+    def from_config(cls, options: Dict[str, Any], default_ttl: float = 300) -> 'TTLCache':
+        return cls(max_entries=int(options.get('max_entries', 1024)),
+                   default_ttl=float(options.get('ttl', default_ttl)),
+                   stale_ttl=float(options.get('stale_ttl', 60)),
+                   memory_mb=float(options.get('memory_mb', 8)))
+
+    def get(self, key: Hashable, loader: Optional[Callable[[], Any]] = None, ttl: Optional[float] = None,
+            max_age: Optional[float] = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (max_age is None or now - entry.inserted <= max_age):
+                if now < entry.expires:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry.value
+                if now < entry.stale_until and loader is not None:
+                    self._entries.move_to_end(key)
+                    self.stats['stale_hits'] += 1
+                    if key not in self._loading:
+                        self._loading[key] = Future()
+                        self._background().submit(self._load, key, loader, ttl, self._loading[key], True)
+                    return entry.value
+            if entry is not None:
+                self._remove(key)
+                self.stats['expirations'] += 1
+            if loader is None:
+                self.stats['misses'] += 1
+                return None
+            future = self._loading.get(key)
+            if future is None:
+                future = self._loading[key] = Future()
+                owner = True
+                self.stats['misses'] += 1
+            else:
+                owner = False
+                self.stats['coalesced'] += 1
+        if owner:
+            self._load(key, loader, ttl, future)
+        return future.result()
+
+    def _load(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float], future: Future,
+              refresh: bool = False) -> None:
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self._loading.pop(key, None)
+                self.stats['errors'] += 1
+            future.set_exception(e)
+            return
+        self.set(key, value, ttl)
+        with self._lock:
+            self._loading.pop(key, None)
+            if refresh:
+                self.stats['refreshes'] += 1
+        future.set_result(value)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.monotonic()
+        entry = CacheEntry(value, now, now + ttl, now + ttl + self.stale_ttl, _estimate_size(value))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.memory_budget):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        self._bytes -= self._entries.pop(key).size
+
+    def _background(self) -> ThreadPoolExecutor:
+        if self._refresher is None:
+            self._refresher = ThreadPoolExecutor(2, thread_name_prefix='cache-refresh')
+        return self._refresher
+
+    def close(self) -> None:
+        if self._refresher is not None:
+            self._refresher.shutdown(wait=True)
+            self._refresher = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['memory_budget'] = self.memory_budget
+        return stats
+
+
+def _estimate_size(value: Any, depth: int = 0) -> int:
+    # Приблизительный размер: объект и его содержимое на несколько уровней вглубь
+    size = sys.getsizeof(value)
+    if depth >= 4:
+        return size
+    if isinstance(value, dict):
+        size += sum(_estimate_size(k, depth + 1) + _estimate_size(v, depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_estimate_size(item, depth + 1) for item in value)
+    return size
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def modbus_client_factory(kind: str, options: Dict[str, Any]):
+    from pymodbus.client import ModbusTcpClient, ModbusSerialClient
+    if kind == 'rtu':
+        return ModbusSerialClient(options['port'], baudrate=options.get('baudrate', 9600),
+                                  parity=options.get('parity', 'N'), stopbits=options.get('stopbits', 1),
+                                  timeout=options.get('timeout', 1))
+    return ModbusTcpClient(options.get('host', '127.0.0.1'), port=options.get('port', 502),
+                           timeout=options.get('timeout', 3))
+
+
+class PooledConnection:
+    """Одно физическое подключение (сокет или последовательный порт) и его блокировка."""
+
+    def __init__(self, key: Tuple, client):
+        self.key = key
+        self.client = client
+        # Один запрос за раз: ответы Modbus не мультиплексируются внутри сокета/порта
+        self.lock = threading.Lock()
+        self.connected = False
+        self.opened = 0
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class ModbusConnectionPool:
+    """
+    Долгоживущие подключения Modbus TCP/RTU. Ключ - адрес транспорта (host:port
+    или последовательный порт), поэтому разные unit_id используют один сокет.
+    """
+
+    def __init__(self, config: Dict[str, Any], client_factory: Callable = modbus_client_factory):
+        self.client_factory = client_factory
+        self.reconnect_delay = float(config.get('reconnect_delay', 0.5))
+        self.reconnect_delay_max = float(config.get('reconnect_delay_max', 30))
+        self._connections: Dict[Tuple, PooledConnection] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {'opened': 0, 'reused': 0, 'reconnects': 0, 'failures': 0, 'closed': 0}
+
+    @staticmethod
+    def transport_key(protocol_type: str, options: Dict[str, Any]) -> Tuple:
+        if protocol_type.startswith('modbus_rtu') or options.get('type') == 'rtu':
+            return ('rtu', options['port'])
+        return ('tcp', options.get('host', '127.0.0.1'), options.get('port', 502))
+
+    @contextmanager
+    def connection(self, protocol_type: str, options: Dict[str, Any]):
+        key = self.transport_key(protocol_type, options)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = self._connections[key] = PooledConnection(key, self.client_factory(key[0], options))
+        with conn.lock:
+            self._ensure_connected(conn)
+            try:
+                yield conn.client
+            except Exception:
+                # После ошибки ввода-вывода состояние протокола неизвестно - переподключаемся
+                self._mark_broken(conn)
+                raise
+
+    def _ensure_connected(self, conn: PooledConnection) -> None:
+        if conn.connected:
+            self._count('reused')
+            return
+        now = time.monotonic()
+        if now < conn.retry_at:
+            raise ConnectionError(f"{_describe(conn.key)}: повторное подключение через {conn.retry_at - now:.1f} с")
+        if conn.client.connect():
+            if conn.opened or conn.failures:
+                self._count('reconnects')
+            conn.connected = True
+            conn.opened += 1
+            conn.failures = 0
+            conn.retry_at = 0.0
+            self._count('opened')
+            logger.info(f"Подключение {_describe(conn.key)} открыто")
+            return
+        self._mark_broken(conn)
+        raise ConnectionError(f"Не удалось подключиться к {_describe(conn.key)}")
+
+    def _mark_broken(self, conn: PooledConnection) -> None:
+        self._count('failures')
+        conn.failures += 1
+        delay = min(self.reconnect_delay * 2 ** (conn.failures - 1), self.reconnect_delay_max)
+        conn.retry_at = time.monotonic() + delay
+        if conn.connected:
+            conn.connected = False
+            self._count('closed')
+        try:
+            conn.client.close()
+        except Exception:
+            pass
+        logger.warning(f"Подключение {_describe(conn.key)} потеряно, повтор через {delay:.1f} с")
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            with conn.lock:
+                if conn.connected:
+                    self._count('closed')
+                conn.connected = False
+                try:
+                    conn.client.close()
+                except Exception as e:
+                    logger.warning(f"Ошибка закрытия {_describe(conn.key)}: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['open'] = sum(1 for conn in self._connections.values() if conn.connected)
+        return stats
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+
+def _describe(key: Tuple) -> str:
+    return f"{key[1]}:{key[2]}" if key[0] == 'tcp' else key[1]
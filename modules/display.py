@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from modules.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = {kind: REGISTRY.histogram('mega_agent_epd_refresh_seconds', 'Длительность обновления панели',
+                                            {'kind': kind}, buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30))
+                   for kind in ('full', 'partial')}
+RENDER_SECONDS = REGISTRY.histogram('mega_agent_epd_render_seconds', 'Отрисовка и упаковка кадра')
+
+class DisplayManager:
+    """Дифференциальное обновление e-paper поверх EPD: помнит последний кадр."""
+
+    def __init__(self, epd, full_refresh_every: int = 10, partial_max_ratio: float = 0.5):
+        self.epd = epd
+        # После стольких частичных обновлений делаем полное (борьба с "призраками")
+        self.full_refresh_every = full_refresh_every
+        # Окно больше этой доли экрана выгоднее обновить целиком
+        self.partial_max_ratio = partial_max_ratio
+        self.last_black: Optional[bytes] = None
+        self.last_red: Optional[bytes] = None
+        self._partials_since_full = 0
+        self.stats: Dict[str, int] = {
+            'frames': 0,
+            'refreshes_skipped': 0,
+            'full_refreshes': 0,
+            'partial_refreshes': 0,
+            'bytes_sent': 0,
+            'bytes_saved': 0,
+        }
+        stats = self.stats
+        for name in stats:
+            REGISTRY.counter(f'mega_agent_epd_{name}_total', f"E-paper: {name}", function=lambda name=name: stats[name])
+
+    def invalidate(self) -> None:
+        # Содержимое панели неизвестно (Clear, сон, перезапуск) - следующий кадр целиком
+        self.last_black = None
+        self.last_red = None
+
+    def dirty_rows(self, old: bytes, new: bytes) -> Optional[Tuple[int, int]]:
+        changed = np.flatnonzero(np.frombuffer(old, dtype=np.uint8) != np.frombuffer(new, dtype=np.uint8))
+        if changed.size == 0:
+            return None
+        # Упаковка 2 бита на пиксель: байт i содержит пиксели 4*i..4*i+3 плоского кадра
+        width = self.epd.width
+        first = int(changed[0]) * 4 // width
+        last = min((int(changed[-1]) * 4 + 3) // width, self.epd.height - 1)
+        return first, last
+
+    def show(self, black_image, red_image) -> bool:
+        """Выводит кадр; возвращает False, если панель обновлять не пришлось."""
+        black = self.epd.getbuffer(black_image)
+        red = self.epd.getbuffer(red_image)
+        return self.show_buffers(black, red)
+
+    def show_buffers(self, black: bytes, red: bytes) -> bool:
+        self.stats['frames'] += 1
+        full_cost = len(black) + len(red)
+
+        window = None
+        if self.last_black is not None and self.last_red is not None:
+            black_rows = self.dirty_rows(self.last_black, black)
+            red_rows = self.dirty_rows(self.last_red, red)
+            if black_rows is None and red_rows is None:
+                self.stats['refreshes_skipped'] += 1
+                self.stats['bytes_saved'] += full_cost
+                logger.debug("Кадр не изменился, обновление дисплея пропущено")
+                return False
+            rows = [r for r in (black_rows, red_rows) if r is not None]
+            window = (min(r[0] for r in rows), max(r[1] for r in rows))
+
+        if (window is not None
+                and getattr(self.epd, 'supports_partial', False)
+                and self._partials_since_full < self.full_refresh_every
+                and window[1] - window[0] + 1 <= self.epd.height * self.partial_max_ratio):
+            started = time.perf_counter()
+            sent = self.epd.display_window(black, red, *window)
+            REFRESH_SECONDS['partial'].observe(time.perf_counter() - started)
+            self._partials_since_full += 1
+            self.stats['partial_refreshes'] += 1
+            logger.debug(f"Частичное обновление строк {window[0]}-{window[1]}")
+        else:
+            started = time.perf_counter()
+            self.epd.display_buffers(black, red)
+            REFRESH_SECONDS['full'].observe(time.perf_counter() - started)
+            sent = full_cost
+            self._partials_since_full = 0
+            self.stats['full_refreshes'] += 1
+
+        self.stats['bytes_sent'] += sent
+        self.stats['bytes_saved'] += full_cost - sent
+        self.last_black = black
+        self.last_red = red
+        return True
+
+
+class EpaperDisplay:
+    """Фоновый рендер e-paper: основной цикл только обновляет состояние кадра."""
+
+    def __init__(self, config: Dict[str, Any], epd=None):
+        self.config = config.get('display', {}).get('epaper', {})
+        self.enabled = self.config.get('enabled', False)
+        self.update_interval = float(self.config.get('update_interval', 60))
+        self.epd = epd
+        self.manager: Optional[DisplayManager] = None
+        self._state: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._pending = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {'updates': 0, 'renders': 0, 'errors': 0}
+        logger.info("Инициализирован модуль EpaperDisplay")
+
+    def start(self) -> None:
+        if not self.enabled:
+            logger.info("E-paper дисплей отключен")
+            return
+        if self.epd is None:
+            try:
+                from waveshare_epd.epd2in13b_v3 import EPD
+                self.epd = EPD()
+                if self.epd.init() != 0:
+                    raise RuntimeError("EPD.init() вернул ошибку")
+            except Exception as e:
+                logger.error(f"Не удалось инициализировать e-paper дисплей: {e}")
+                self.enabled = False
+                return
+        self.manager = DisplayManager(self.epd)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='epaper-render', daemon=True)
+        self._thread.start()
+        logger.info(f"E-paper дисплей запущен (интервал обновления {self.update_interval} с)")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._pending.set()
+        # Обновление панели может идти несколько секунд - ждём его завершения
+        self._thread.join(timeout=30)
+        self._thread = None
+        try:
+            self.epd.sleep()
+            self.epd.module_exit()
+        except Exception as e:
+            logger.warning(f"Ошибка при выключении e-paper дисплея: {e}")
+        logger.info("E-paper дисплей остановлен")
+
+    def update(self, **values: Any) -> None:
+        # Вызывается из основного цикла: последнее значение побеждает, без ожидания панели
+        with self._lock:
+            self._state.update(values)
+            self.stats['updates'] += 1
+        self._pending.set()
+
+    def _run(self) -> None:
+        last_render = None
+        while not self._stop_event.is_set():
+            self._pending.wait()
+            if self._stop_event.is_set():
+                break
+            # Копим обновления до конца интервала, затем рисуем только последнее состояние
+            if last_render is not None:
+                delay = last_render + self.update_interval - time.monotonic()
+                if delay > 0 and self._stop_event.wait(delay):
+                    break
+            with self._lock:
+                self._pending.clear()
+                state = dict(self._state)
+            last_render = time.monotonic()
+            try:
+                started = time.perf_counter()
+                black, red = self.render_frame(state)
+                black, red = self.epd.getbuffer(black), self.epd.getbuffer(red)
+                RENDER_SECONDS.observe(time.perf_counter() - started)
+                self.manager.show_buffers(black, red)
+                self.stats['renders'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка обновления e-paper дисплея: {e}")
+
+    def render_frame(self, state: Dict[str, Any]):
+        width, height = self.epd.width, self.epd.height
+        black_image = Image.new('1', (width, height), 255)
+        red_image = Image.new('1', (width, height), 255)
+        draw_black = ImageDraw.Draw(black_image)
+        draw_red = ImageDraw.Draw(red_image)
+        font = _load_font(14)
+
+        draw_red.rectangle((0, 0, width, 22), fill=0)
+        draw_red.text((4, 4), 'MEGA-AGENT', font=font, fill=255)
+        y = 30
+        for key in sorted(state):
+            value = state[key]
+            if isinstance(value, float):
+                value = f"{value:.1f}"
+            draw_black.text((4, y), f"{key}: {value}", font=font, fill=0)
+            y += 18
+            if y > height - 18:
+                break
+        return black_image, red_image
+
+
+_fonts: Dict[int, Any] = {}
+
+def _load_font(size: int):
+    if size not in _fonts:
+        try:
+            _fonts[size] = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', size)
+        except OSError:
+            _fonts[size] = ImageFont.load_default()
+    return _fonts[size]
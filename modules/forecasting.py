@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class HoltWintersBank:
+    """
+    Аддитивная модель Холта-Уинтерса с суточной сезонностью для многих рядов сразу.
+    Отсчеты копятся средним по интервалу period; при закрытии интервала состояние
+    всех рядов (уровень, тренд, сезонные поправки) обновляется одним векторным
+    шагом NumPy. Пропущенный интервал заменяется прогнозом модели. Первый сезон
+    идет без сезонной части; по его окончании из него строятся сезонные поправки.
+    """
+
+    def __init__(self, period: float = 3600.0, season: float = 86400.0, alpha: float = 0.3,
+                 beta: float = 0.05, gamma: float = 0.1, capacity: int = 64):
+        self.period = float(period)
+        self.m = max(1, int(round(season / self.period)))
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.rows: Dict[str, int] = {}
+        self.bucket: Optional[int] = None  # номер открытого интервала
+        self.version = 0
+        # Накопление открытого интервала - списки: добавление отсчета без обращений к NumPy
+        self._sums: List[float] = []
+        self._counts: List[int] = []
+        self._allocate(capacity)
+        self._forecast: Optional[np.ndarray] = None
+        self._forecast_version = -1
+        self._memo: Dict[str, Tuple[int, int, List[float]]] = {}
+
+    def _allocate(self, capacity: int) -> None:
+        def grow(old: Optional[np.ndarray], shape, fill) -> np.ndarray:
+            new = np.full(shape, fill, dtype=old.dtype if old is not None else np.float64)
+            if old is not None:
+                new[:len(old)] = old
+            return new
+
+        self.level = grow(getattr(self, 'level', None), capacity, 0.0)
+        self.trend = grow(getattr(self, 'trend', None), capacity, 0.0)
+        self.season = grow(getattr(self, 'season', None), (capacity, self.m), 0.0)
+        self.first = grow(getattr(self, 'first', None), (capacity, self.m), np.nan)
+        steps = getattr(self, 'steps', None)
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        if steps is not None:
+            self.steps[:len(steps)] = steps
+        self.capacity = capacity
+
+    def _row(self, key: str) -> int:
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.rows)
+            if row >= self.capacity:
+                self._allocate(self.capacity * 2)
+            self._sums.append(0.0)
+            self._counts.append(0)
+        return row
+
+    def add(self, key: str, timestamp: float, value: float) -> None:
+        if not (math.isfinite(value) and math.isfinite(timestamp)):
+            # NaN в сумме интервала сделал бы уровень и тренд ряда NaN навсегда
+            return
+        bucket = int(timestamp // self.period)
+        if self.bucket is None:
+            self.bucket = bucket
+        elif bucket > self.bucket:
+            self.advance(bucket)
+        # Запоздавший отсчет учитывается в открытом интервале
+        row = self._row(key)
+        self._sums[row] += value
+        self._counts[row] += 1
+        if not self.steps[row]:
+            # До первого шага прогноз - среднее открытого интервала: новый отсчет его меняет
+            self._memo.pop(key, None)
+
+    def advance(self, bucket: int) -> None:
+        """Закрывает интервалы до bucket; после пропуска длиннее сезона лишние шаги ничего не дают."""
+        # Открытый интервал закрывается в своей сезонной ячейке, затем пропуск сокращается до сезона
+        self._step(self.bucket)
+        for closed in range(max(self.bucket + 1, bucket - self.m), bucket):
+            self._step(closed)
+        self.bucket = bucket
+
+    def load(self, series: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> None:
+        """Разгон рядов по истории (после восстановления): средние по интервалам и векторные шаги."""
+        binned = {}
+        for key, (times, values) in series.items():
+            times, values = np.asarray(times, dtype=np.float64), np.asarray(values, dtype=np.float64)
+            finite = np.isfinite(times) & np.isfinite(values)
+            times, values = times[finite], values[finite]
+            buckets = (times // self.period).astype(np.int64)
+            if self.bucket is not None:
+                # Уже закрытые интервалы не пересчитываются
+                keep = buckets >= self.bucket
+                buckets, values = buckets[keep], np.asarray(values)[keep]
+            if len(buckets):
+                binned[self._row(key)] = (buckets, np.asarray(values, dtype=np.float64))
+        if not binned:
+            return
+        start = min(int(b[0].min()) for b in binned.values())
+        end = max(int(b[0].max()) for b in binned.values())
+        if self.bucket is not None:
+            start, end = self.bucket, max(end, self.bucket)
+        width = end - start + 1
+        sums = {row: np.bincount(b - start, weights=v, minlength=width) for row, (b, v) in binned.items()}
+        counts = {row: np.bincount(b - start, minlength=width) for row, (b, _) in binned.items()}
+        self.bucket = start
+        for offset in range(width):
+            for row in binned:
+                self._sums[row] += float(sums[row][offset])
+                self._counts[row] += int(counts[row][offset])
+            if offset < width - 1:
+                self._step(start + offset)
+        self.bucket = end
+
+    def _step(self, bucket: int) -> None:
+        n = len(self.rows)
+        if not n:
+            return
+        counts = np.array(self._counts, dtype=np.float64)
+        have = counts > 0
+        observed = np.array(self._sums) / np.maximum(counts, 1)
+        level, trend, steps = self.level[:n], self.trend[:n], self.steps[:n]
+        j = bucket % self.m
+        ready = steps >= self.m
+        active = have | (steps > 0)
+        new = have & (steps == 0)
+        s = np.where(ready, self.season[:n, j], 0.0)
+        x = np.where(have, observed, level + trend + s)
+
+        new_level = self.alpha * (x - s) + (1 - self.alpha) * (level + trend)
+        new_trend = self.beta * (new_level - level) + (1 - self.beta) * trend
+        self.season[:n, j] = np.where(ready, self.gamma * (x - new_level) + (1 - self.gamma) * s, s)
+        self.level[:n] = np.where(new, x, np.where(active, new_level, level))
+        self.trend[:n] = np.where(new | ~active, 0.0, new_trend)
+        warm = active & ~ready
+        self.first[:n, j] = np.where(warm, x, self.first[:n, j])
+        steps += active
+        done = active & (steps == self.m)
+        if done.any():
+            first = self.first[:n][done]
+            self.season[:n][done] = first - first.mean(axis=1, keepdims=True)
+
+        self._sums = [0.0] * n
+        self._counts = [0] * n
+        self.version += 1
+
+    def forecast(self, key: str, periods: int) -> List[float]:
+        """Прогноз на periods интервалов, начиная с открытого; запоминается до новых данных."""
+        row = self.rows.get(key)
+        if row is None or periods <= 0:
+            return []
+        memo = self._memo.get(key)
+        if memo is not None and memo[0] == self.version and memo[1] == periods:
+            return memo[2]
+        if self.steps[row] == 0:
+            # Модель еще не сделала ни одного шага: пока есть только среднее открытого интервала
+            if not self._counts[row]:
+                return []
+            result = [self._sums[row] / self._counts[row]] * periods
+        else:
+            matrix = self._matrix(periods)
+            result = matrix[row, :periods].tolist()
+        self._memo[key] = (self.version, periods, result)
+        return result
+
+    def _matrix(self, periods: int) -> np.ndarray:
+        # Прогноз считается сразу для всех рядов: один набор векторных операций на шаг модели
+        if self._forecast is None or self._forecast_version != self.version or self._forecast.shape[1] < periods:
+            n = len(self.rows)
+            horizon = np.arange(1, max(periods, self.m) + 1)
+            index = (self.bucket + horizon - 1) % self.m
+            ready = (self.steps[:n] >= self.m)[:, None]
+            self._forecast = (self.level[:n, None] + self.trend[:n, None] * horizon
+                              + np.where(ready, self.season[:n][:, index], 0.0))
+            self._forecast_version = self.version
+        return self._forecast
+
+    def forecast_all(self, periods: int) -> Dict[str, List[float]]:
+        return {key: self.forecast(key, periods) for key in self.rows}
@@ -1,17 +1,112 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import inspect
 import logging
-from typing import Dict, Any, Union
+import struct
+import time
+from functools import lru_cache
+from typing import Dict, Any, Union, Iterable, List, Tuple
+
+from modules.connection_pool import ModbusConnectionPool, modbus_client_factory
+from modules.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+# Тип данных -> (формат struct, число 16-битных регистров)
+DATA_TYPES = {
+    'uint16': ('H', 1),
+    'int16': ('h', 1),
+    'uint32': ('I', 2),
+    'int32': ('i', 2),
+    'float32': ('f', 2),
+    'uint64': ('Q', 4),
+    'int64': ('q', 4),
+    'float64': ('d', 4),
+}
+
+# Ограничение протокола Modbus на одно чтение регистров (функции 0x03/0x04)
+MAX_REGISTERS_PER_READ = 125
+
+REQUEST_SECONDS = REGISTRY.histogram('mega_agent_modbus_request_seconds', 'Длительность чтения блока регистров')
+
+
+class ReadBlock:
+    """Одно чтение непрерывного диапазона регистров и разбор всех значений в нем."""
+
+    def __init__(self, register_type: str, start: int, count: int, items: List[Tuple[Any, int, str]]):
+        self.register_type = register_type
+        self.start = start
+        self.count = count
+        self.items = items  # (ключ, смещение в регистрах, тип данных)
+        # Непересекающиеся значения разбираются одним вызовом struct, пропуски - байтами 'x'
+        fmt, keys, cursor, self.extra = '>', [], 0, []
+        for key, offset, data_type in items:
+            code, size = DATA_TYPES[data_type]
+            if offset < cursor:
+                self.extra.append((key, offset * 2, struct.Struct('>' + code)))
+                continue
+            if offset > cursor:
+                fmt += f"{(offset - cursor) * 2}x"
+            fmt += code
+            keys.append(key)
+            cursor = offset + size
+        self.keys = keys
+        self.struct = struct.Struct(fmt)
+
+    def decode(self, registers: List[int], word_order: str = 'big') -> Dict[Any, Any]:
+        raw = struct.pack(f">{self.count}H", *registers[:self.count])
+        if word_order == 'big':
+            values = dict(zip(self.keys, self.struct.unpack_from(raw)))
+            for key, offset, item_struct in self.extra:
+                values[key] = item_struct.unpack_from(raw, offset)[0]
+            return values
+        # Младшее слово первым: переставляем регистры каждого значения
+        values = {}
+        for key, offset, data_type in self.items:
+            code, size = DATA_TYPES[data_type]
+            words = registers[offset:offset + size][::-1]
+            values[key] = struct.unpack('>' + code, struct.pack(f">{size}H", *words))[0]
+        return values
+
+
+@lru_cache(maxsize=256)
+def build_read_plan(spec: Tuple[Tuple[str, int, str, Any], ...], max_gap: int = 0,
+                    max_count: int = MAX_REGISTERS_PER_READ) -> Tuple[ReadBlock, ...]:
+    """
+    spec - кортеж (тип регистров, адрес, тип данных, ключ). Соседние адреса одного
+    типа регистров объединяются в минимум чтений не длиннее max_count регистров;
+    пропуск до max_gap регистров дешевле отдельного запроса и тоже объединяется.
+    """
+    blocks = []
+    current = None
+    for register_type, address, data_type, key in sorted(spec, key=lambda s: (s[0], s[1])):
+        size = DATA_TYPES[data_type][1]
+        if (current is not None and register_type == current[0]
+                and address <= current[1] + current[2] + max_gap
+                and max(current[1] + current[2], address + size) - current[1] <= max_count):
+            current[2] = max(current[2], address + size - current[1])
+            current[3].append((key, address - current[1], data_type))
+            continue
+        if current is not None:
+            blocks.append(ReadBlock(*current))
+        current = [register_type, address, size, [(key, 0, data_type)]]
+    if current is not None:
+        blocks.append(ReadBlock(*current))
+    return tuple(blocks)
+
+
 class IndustrialProtocols:
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], client_factory=modbus_client_factory):
         self.config = config.get('industrial', {})
         self.enabled = self.config.get('enabled', False)
         self.protocols = self.config.get('protocols', [])
-        self.connections: Dict[str, Any] = {}
+        # Подключения живут между опросами; несколько unit_id делят один сокет
+        self.connections = ModbusConnectionPool(self.config, client_factory)
+        self.stats: Dict[str, int] = {'requests': 0, 'registers': 0, 'values': 0, 'errors': 0}
+        for name in self.stats:
+            REGISTRY.counter(f'mega_agent_modbus_{name}_total', f"Modbus: {name}",
+                             function=lambda name=name: self.stats[name])
         logger.info("Инициализирован модуль IndustrialProtocols (заглушка)")
 
     def start(self) -> None:
@@ -21,12 +116,17 @@ class IndustrialProtocols:
             logger.info("Поддержка промышленных протоколов отключена")
 
     def stop(self) -> None:
+        self.connections.close_all()
         logger.info("Закрытие подключений промышленных протоколов (заглушка)")
 
     def read_register(self, protocol_type: str, address: int, **kwargs) -> Union[int, float, list, None]:
         logger.debug(f"Чтение регистра {address} через {protocol_type} (заглушка)")
-        import random
         data_type = kwargs.get('data_type', 'uint16')
+        if self.enabled and protocol_type in self.config and data_type in DATA_TYPES:
+            point = {'address': address, 'data_type': data_type,
+                     'register_type': kwargs.get('register_type', 'holding')}
+            return self.read_many(protocol_type, [point]).get(address)
+        import random
         if 'int' in data_type:
             return random.randint(0, 100)
         elif 'float' in data_type:
@@ -34,6 +134,82 @@ class IndustrialProtocols:
         else:
             return [random.randint(0, 100) for _ in range(kwargs.get('count', 1))]
 
+    def read_many(self, protocol_type: str, points: Iterable[Any]) -> Dict[Any, Any]:
+        """
+        Чтение многих значений за минимум запросов. points - словари с 'address',
+        'data_type' (по умолчанию uint16), 'register_type' ('holding'/'input') и
+        необязательным 'name', либо пары (address, data_type). Ключ результата -
+        'name' точки, если он задан, иначе адрес.
+        """
+        spec = []
+        for point in points:
+            if isinstance(point, dict):
+                spec.append((point.get('register_type', 'holding'), point['address'],
+                             point.get('data_type', 'uint16'), point.get('name', point['address'])))
+            else:
+                address, data_type = point
+                spec.append(('holding', address, data_type, address))
+
+        if not (self.enabled and protocol_type in self.config):
+            import random
+            return {key: (random.uniform(0.0, 100.0) if 'float' in data_type else random.randint(0, 100))
+                    for _, _, data_type, key in spec}
+
+        protocol_config = self.config[protocol_type]
+        plan = build_read_plan(tuple(spec), protocol_config.get('max_gap', 0),
+                               min(protocol_config.get('max_registers', MAX_REGISTERS_PER_READ),
+                                   MAX_REGISTERS_PER_READ))
+        word_order = protocol_config.get('word_order', 'big')
+        unit_id = protocol_config.get('unit_id', 1)
+        values: Dict[Any, Any] = {}
+        for block in plan:
+            registers = self._read_block(protocol_type, block, unit_id)
+            if registers is None:
+                values.update((key, None) for key, _, _ in block.items)
+                continue
+            values.update(block.decode(registers, word_order))
+        self.stats['values'] += len(spec)
+        return values
+
+    def _read_block(self, protocol_type: str, block: ReadBlock, unit_id: int):
+        self.stats['requests'] += 1
+        self.stats['registers'] += block.count
+        started = time.perf_counter()
+        try:
+            with self.connections.connection(protocol_type, self.config[protocol_type]) as client:
+                if block.register_type == 'input':
+                    method = client.read_input_registers
+                else:
+                    method = client.read_holding_registers
+                response = method(block.start, count=block.count, **{_unit_keyword(method): unit_id})
+            # Ответ-исключение Modbus - ошибка адресации, а не связи: соединение остается
+            if response.isError():
+                raise IOError(str(response))
+            return response.registers
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Ошибка чтения регистров {block.start}..{block.start + block.count - 1} "
+                         f"через {protocol_type}: {e}")
+            return None
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        stats['connections'] = self.connections.get_stats()
+        return stats
+
     def write_register(self, protocol_type: str, address: int, value: Any, **kwargs) -> bool:
         logger.debug(f"Запись в регистр {address} через {protocol_type}: {value} (заглушка)")
         return True
+
+
+_unit_keywords: Dict[Any, str] = {}
+
+def _unit_keyword(method) -> str:
+    # Имя параметра адреса устройства менялось между версиями pymodbus
+    func = getattr(method, '__func__', method)
+    if func not in _unit_keywords:
+        params = inspect.signature(func).parameters
+        _unit_keywords[func] = next((name for name in ('device_id', 'slave', 'unit') if name in params), 'slave')
+    return _unit_keywords[func]
@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
+from typing import Dict, Any, Callable, Optional
+
+from modules.cache import TTLCache
+from modules.metrics import REGISTRY
+from modules.mqtt_publisher import MqttPublisher
 
 logger = logging.getLogger(__name__)
 
@@ -10,25 +16,65 @@ class Integrations:
         self.config = config.get('integrations', {})
         self.enabled = self.config.get('enabled', False)
         self.systems = self.config.get('systems', [])
+        self.mqtt: MqttPublisher = None
+        self.cache = TTLCache.from_config(self.config.get('cache', {}))
         logger.info("Инициализирован модуль Integrations (заглушка)")
 
     def start(self) -> None:
         if self.enabled:
+            broker = self.config.get('mqtt_broker', {})
+            if 'mqtt_broker' in self.systems and broker.get('enabled', False):
+                self.mqtt = MqttPublisher(broker)
+                self.mqtt.start()
+                self._mqtt_metrics(self.mqtt)
             logger.info("Инициализация интеграций (заглушка)")
         else:
             logger.info("Интеграции отключены")
 
+    def _mqtt_metrics(self, mqtt: MqttPublisher) -> None:
+        stats = mqtt.stats
+        for name in stats:
+            REGISTRY.counter(f'mega_agent_mqtt_{name}_total', f"MQTT: {name}", function=lambda name=name: stats[name])
+        REGISTRY.gauge('mega_agent_mqtt_queue_depth', 'Сообщений в очереди публикации',
+                       function=lambda: mqtt._queue.qsize())
+        REGISTRY.gauge('mega_agent_mqtt_inflight', 'Сообщений без подтверждения брокера',
+                       function=lambda: len(mqtt._inflight))
+        REGISTRY.gauge('mega_agent_mqtt_connected', 'Подключение к брокеру',
+                       function=lambda: mqtt._connected.is_set())
+
     def stop(self) -> None:
+        if self.mqtt is not None:
+            self.mqtt.stop()
+            self.mqtt = None
+        self.cache.close()
         logger.info("Остановка интеграций (заглушка)")
 
-    def publish_mqtt(self, topic: str, payload: Any, qos: int = 0, retain: bool = False) -> bool:
+    def publish_mqtt(self, topic: str, payload: Any, qos: Optional[int] = None, retain: bool = False) -> bool:
+        # qos=None - значение из настроек брокера. Только постановка в очередь: сеть обслуживает фоновый поток MqttPublisher
+        if self.mqtt is not None:
+            return self.mqtt.publish(topic, payload, qos, retain)
         logger.debug(f"Публикация MQTT {topic}: {payload} (заглушка)")
         return True
 
-    def get_cached_data(self, key: str, max_age: int = 300) -> Any:
-        logger.debug(f"Получение кэшированных данных для {key} (заглушка)")
-        import time
+    def get_cached_data(self, key: str, max_age: int = 300, loader: Optional[Callable[[], Any]] = None) -> Any:
+        # loader вызывается только при промахе; одновременные промахи по ключу ждут одну загрузку.
+        # Запись старше max_age этого вызова - промах, даже если ее загрузили с большим сроком
+        if loader is None:
+            loader = lambda: self._load_data(key)
+        return self.cache.get(key, loader, ttl=max_age, max_age=max_age)
+
+    def _load_data(self, key: str) -> Any:
+        logger.debug(f"Получение данных для {key} (заглушка)")
         return {"data": f"sample_data_for_{key}", "timestamp": time.time()}
 
+    def get_stats(self) -> Dict[str, Any]:
+        return {'mqtt': self.mqtt.get_stats() if self.mqtt is not None else None}
+
     def send_alert(self, message: str, level: str = 'info', method: str = 'mqtt') -> None:
+        REGISTRY.counter('mega_agent_alerts_sent_total', 'Отправленные алерты', {'level': level, 'method': method}).inc()
+        if method == 'mqtt' and self.mqtt is not None:
+            topic = f"{self.config.get('alert_topic', 'mega_agent/alerts')}/{level}"
+            self.publish_mqtt(topic, {'level': level, 'message': message, 'timestamp': time.time()})
+            return
         logger.info(f"Алерт [{level.upper()}]: {message} (метод: {method}, заглушка)")
+
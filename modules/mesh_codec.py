@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import zlib
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+# Показание: (ключ, значение, время unix)
+Reading = Tuple[str, float, float]
+
+SYNC = 0xA5
+RAW_SCHEMA_ID = 0          # полезная нагрузка - JSON, для сообщений, не укладывающихся в схему
+TIME_RESOLUTION = 0.1      # время в кадре - в десятых долях секунды
+DEFAULT_RESOLUTION = 0.01  # шаг фиксированной точки для ключей вне схемы
+FRAME_OVERHEAD = 4         # SYNC + длина + CRC16
+MAX_PAYLOAD = 255          # длина в кадре - один байт
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def node_address(name: str, nodes: Dict[str, int]) -> int:
+    # Имена узлов без адреса в настройках получают стабильный 16-битный адрес
+    if name in nodes:
+        return int(nodes[name])
+    return zlib.crc32(name.encode('utf-8')) & 0xFFFF
+
+
+class FrameBatch:
+    """Кадр, собираемый по одному показанию: размер известен до отправки."""
+
+    def __init__(self, codec: 'ReadingCodec', destination: int, source: int, base_ts: float):
+        self.codec = codec
+        self.header = bytearray([codec.schema_id])
+        encode_varint(destination, self.header)
+        encode_varint(source, self.header)
+        self.base_tick = int(base_ts / TIME_RESOLUTION)
+        encode_varint(self.base_tick, self.header)
+        self.body = bytearray()
+        self.count = 0
+        self._last_tick = self.base_tick
+        self._last_values: Dict[int, int] = {}
+
+    def size(self, count: Optional[int] = None, body: int = 0) -> int:
+        count = self.count if count is None else count
+        return len(self.header) + _varint_size(count) + len(self.body) + body
+
+    def add(self, key: str, value: float, ts: float, limit: int = 0) -> bool:
+        """Добавляет показание; False, если кадр превысил бы limit байт (0 - без ограничения)."""
+        field, resolution = self.codec.field(key)
+        tick = max(int(ts / TIME_RESOLUTION), 0)
+        fixed = int(round(value / resolution))
+        chunk = bytearray()
+        encode_varint(field, chunk)
+        if field == 0:
+            name = key.encode('utf-8')
+            encode_varint(len(name), chunk)
+            chunk += name
+        # Время и значение - разность с предыдущими: у частых показаний это 1-2 байта
+        encode_varint(zigzag(tick - self._last_tick), chunk)
+        encode_varint(zigzag(fixed - self._last_values.get(field, 0) if field else fixed), chunk)
+        if limit and self.size(self.count + 1, len(chunk)) > limit:
+            return False
+        self.body += chunk
+        self.count += 1
+        self._last_tick = tick
+        if field:
+            self._last_values[field] = fixed
+        return True
+
+    def payload(self) -> bytes:
+        out = bytearray(self.header)
+        encode_varint(self.count, out)
+        return bytes(out + self.body)
+
+
+class ReadingCodec:
+    """
+    Компактная двоичная кодировка показаний. Схема (ее id - первый байт кадра)
+    задает порядок ключей и шаг фиксированной точки: номер поля и значение
+    передаются как varint, время и значения - разностями с предыдущими.
+    """
+
+    def __init__(self, schema_id: int = 1, fields: Iterable[Tuple[str, float]] = ()):
+        if not 0 < schema_id < 256:
+            raise ValueError(f"Недопустимый id схемы: {schema_id}")
+        self.schema_id = schema_id
+        self.fields: List[Tuple[str, float]] = [(name, float(resolution)) for name, resolution in fields]
+        self._index = {name: (i + 1, resolution) for i, (name, resolution) in enumerate(self.fields)}
+
+    @classmethod
+    def from_config(cls, options: Dict[str, Any]) -> 'ReadingCodec':
+        schema = options.get('schema', {})
+        return cls(int(schema.get('id', 1)), schema.get('fields', {}).items())
+
+    def field(self, key: str) -> Tuple[int, float]:
+        return self._index.get(key, (0, DEFAULT_RESOLUTION))
+
+    def batch(self, destination: int, source: int, base_ts: float) -> FrameBatch:
+        return FrameBatch(self, destination, source, base_ts)
+
+    def encode(self, destination: int, source: int, readings: Iterable[Reading]) -> bytes:
+        readings = list(readings)
+        batch = self.batch(destination, source, readings[0][2] if readings else 0)
+        for key, value, ts in readings:
+            batch.add(key, value, ts)
+        return batch.payload()
+
+    def decode(self, payload: bytes) -> Tuple[int, int, List[Reading]]:
+        """(адрес назначения, адрес источника, показания) из полезной нагрузки кадра."""
+        if payload[0] == RAW_SCHEMA_ID:
+            return decode_raw(payload)
+        if payload[0] != self.schema_id:
+            raise ValueError(f"Неизвестная схема кадра: {payload[0]}")
+        destination, pos = decode_varint(payload, 1)
+        source, pos = decode_varint(payload, pos)
+        tick, pos = decode_varint(payload, pos)
+        count, pos = decode_varint(payload, pos)
+        last_values: Dict[int, int] = {}
+        readings = []
+        for _ in range(count):
+            field, pos = decode_varint(payload, pos)
+            if field == 0:
+                length, pos = decode_varint(payload, pos)
+                key = payload[pos:pos + length].decode('utf-8')
+                pos += length
+                resolution = DEFAULT_RESOLUTION
+            else:
+                key, resolution = self.fields[field - 1]
+            delta, pos = decode_varint(payload, pos)
+            tick += unzigzag(delta)
+            raw, pos = decode_varint(payload, pos)
+            fixed = unzigzag(raw)
+            if field:
+                fixed += last_values.get(field, 0)
+                last_values[field] = fixed
+            readings.append((key, _round(fixed * resolution, resolution), round(tick * TIME_RESOLUTION, 1)))
+        return destination, source, readings
+
+
+def encode_raw(destination: int, source: int, message: Any) -> bytes:
+    out = bytearray([RAW_SCHEMA_ID])
+    encode_varint(destination, out)
+    encode_varint(source, out)
+    return bytes(out) + json.dumps(message, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+
+
+def decode_raw(payload: bytes) -> Tuple[int, int, Any]:
+    destination, pos = decode_varint(payload, 1)
+    source, pos = decode_varint(payload, pos)
+    return destination, source, json.loads(payload[pos:].decode('utf-8'))
+
+
+def frame(payload: bytes) -> bytes:
+    """Кадр для последовательного канала: SYNC, длина, данные, CRC16."""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Кадр длиннее {MAX_PAYLOAD} байт: {len(payload)}")
+    crc = zlib.crc32(payload) & 0xFFFF
+    return bytes([SYNC, len(payload)]) + payload + crc.to_bytes(2, 'little')
+
+
+class FrameParser:
+    """Выделяет кадры из потока байт; мусор и кадры с неверной CRC пропускаются."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        while True:
+            start = buffer.find(SYNC)
+            if start < 0:
+                buffer.clear()
+                break
+            if start:
+                del buffer[:start]
+            if len(buffer) < 2:
+                break
+            end = 2 + buffer[1] + 2
+            if len(buffer) < end:
+                break
+            payload = bytes(buffer[2:end - 2])
+            if buffer[1] and zlib.crc32(payload) & 0xFFFF == int.from_bytes(buffer[end - 2:end], 'little'):
+                frames.append(payload)
+                del buffer[:end]
+            else:
+                # Ложный SYNC внутри данных: ищем следующий
+                self.errors += 1
+                del buffer[:1]
+        return frames
+
+
+def lora_airtime(payload_bytes: int, spreading_factor: int = 7, bandwidth: float = 125000,
+                 coding_rate: int = 1, preamble: int = 8, explicit_header: bool = True, crc: bool = True) -> float:
+    """Время в эфире пакета LoRa в секундах (Semtech AN1200.13); coding_rate 1..4 - это 4/5..4/8."""
+    symbol_time = (2 ** spreading_factor) / bandwidth
+    low_data_rate = 1 if symbol_time > 0.016 else 0
+    numerator = 8 * payload_bytes - 4 * spreading_factor + 28 + 16 * crc - 20 * (not explicit_header)
+    symbols = 8 + max(math.ceil(numerator / (4 * (spreading_factor - 2 * low_data_rate))) * (coding_rate + 4), 0)
+    return (preamble + 4.25 + symbols) * symbol_time
+
+
+def _varint_size(value: int) -> int:
+    return max(1, (value.bit_length() + 6) // 7)
+
+
+def _round(value: float, resolution: float) -> float:
+    digits = max(0, -math.floor(math.log10(resolution))) if resolution < 1 else 0
+    return round(value, digits)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from modules.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# (протокол, тип сообщения, адресат, отправитель, сообщение)
+Incoming = Tuple[str, str, str, str, Any]
+IndexKey = Tuple[str, Optional[str], Optional[str]]
+
+HANDLER_SECONDS = REGISTRY.histogram('mega_agent_mesh_handler_seconds', 'Длительность обработчика mesh')
+
+
+class HandlerEntry:
+    __slots__ = ('handler', 'slow')
+
+    def __init__(self, handler: Callable[[str, Any], None], slow: bool):
+        self.handler = handler
+        self.slow = slow
+
+
+class MessageDispatcher:
+    """
+    Раздача входящих сообщений mesh обработчикам. Потоки чтения портов только
+    кладут сообщение в ограниченную очередь (при переполнении вытесняется самое
+    старое) и сразу возвращаются к порту. Поток раздачи находит обработчики по
+    индексу (протокол, тип, адресат) и вызывает быстрые на месте, а медленные -
+    в пуле потоков. Обработчик, который хоть раз работал дольше slow_threshold,
+    дальше считается медленным.
+    """
+
+    def __init__(self, queue_size: int = 1024, workers: int = 2, max_pending: int = 256,
+                 slow_threshold: float = 0.005):
+        self.queue_size = queue_size
+        self.workers = workers
+        self.slow_threshold = slow_threshold
+        self._queue: deque = deque(maxlen=queue_size)
+        self._wakeup = threading.Event()
+        self._handlers: Dict[IndexKey, List[HandlerEntry]] = {}
+        self._routes: Dict[IndexKey, List[HandlerEntry]] = {}
+        self._register_lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {
+            'received': 0, 'dropped': 0, 'dispatched': 0, 'unhandled': 0, 'offloaded': 0,
+            'pool_dropped': 0, 'handler_errors': 0, 'max_depth': 0,
+        }
+
+    def register(self, protocol: str, handler: Callable[[str, Any], None], message_type: Optional[str] = None,
+                 destination: Optional[str] = None, slow: bool = False) -> None:
+        """None в message_type или destination - любое значение."""
+        with self._register_lock:
+            self._handlers.setdefault((protocol, message_type, destination), []).append(HandlerEntry(handler, slow))
+            # Маршруты собираются заново при следующих сообщениях
+            self._routes = {}
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop_event.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='mesh-handler')
+            self._thread = threading.Thread(target=self._run, name='mesh-dispatch', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    # --- поток чтения порта ---
+
+    def submit(self, protocol: str, message_type: str, destination: str, source: str, message: Any) -> bool:
+        depth = len(self._queue)
+        dropped = depth >= self.queue_size
+        self._queue.append((protocol, message_type, destination, source, message))
+        self.stats['received'] += 1
+        if dropped:
+            self.stats['dropped'] += 1
+        elif depth + 1 > self.stats['max_depth']:
+            self.stats['max_depth'] = depth + 1
+        self._wakeup.set()
+        return not dropped
+
+    # --- поток раздачи ---
+
+    def route(self, protocol: str, message_type: str, destination: str) -> List[HandlerEntry]:
+        key = (protocol, message_type, destination)
+        routes = self._routes
+        entries = routes.get(key)
+        if entries is None:
+            with self._register_lock:
+                handlers = self._handlers
+                entries = [entry for index in ((protocol, message_type, destination), (protocol, message_type, None),
+                                               (protocol, None, destination), (protocol, None, None))
+                           for entry in handlers.get(index, ())]
+                self._routes[key] = entries
+        return entries
+
+    def _run(self) -> None:
+        queue = self._queue
+        while not self._stop_event.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while queue:
+                self._dispatch(queue.popleft())
+        while queue:
+            self._dispatch(queue.popleft())
+
+    def _dispatch(self, item: Incoming) -> None:
+        protocol, message_type, destination, source, message = item
+        entries = self.route(protocol, message_type, destination)
+        if not entries:
+            self.stats['unhandled'] += 1
+            return
+        self.stats['dispatched'] += 1
+        for entry in entries:
+            if entry.slow:
+                if not self._pending.acquire(blocking=False):
+                    self.stats['pool_dropped'] += 1
+                    continue
+                self.stats['offloaded'] += 1
+                self._executor.submit(self._call_pooled, entry, source, message)
+            else:
+                started = time.perf_counter()
+                self._call(entry, source, message)
+                elapsed = time.perf_counter() - started
+                HANDLER_SECONDS.observe(elapsed)
+                if elapsed > self.slow_threshold:
+                    entry.slow = True
+                    logger.debug(f"Обработчик {entry.handler} переведен в пул потоков")
+
+    def _call_pooled(self, entry: HandlerEntry, source: str, message: Any) -> None:
+        started = time.perf_counter()
+        try:
+            self._call(entry, source, message)
+        finally:
+            self._pending.release()
+            HANDLER_SECONDS.observe(time.perf_counter() - started)
+
+    def _call(self, entry: HandlerEntry, source: str, message: Any) -> None:
+        try:
+            entry.handler(source, message)
+        except Exception as e:
+            self.stats['handler_errors'] += 1
+            logger.error(f"Ошибка обработчика mesh: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['queue_depth'] = len(self._queue)
+        return stats
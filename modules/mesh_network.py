@@ -2,7 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from typing import Dict, Callable, Any
+from typing import Dict, Callable, Any, Optional
+
+from modules.mesh_dispatch import MessageDispatcher
+from modules.mesh_transport import LoraLink
+from modules.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
@@ -13,23 +17,74 @@ class MeshNetwork:
         self.protocols = self.config.get('protocols', [])
         self.connections: Dict[str, Any] = {}
         self.message_handlers: Dict[str, list] = {}
+        dispatch = self.config.get('dispatch', {})
+        self.dispatcher = MessageDispatcher(
+            queue_size=int(dispatch.get('queue_size', 1024)),
+            workers=int(dispatch.get('workers', 2)),
+            max_pending=int(dispatch.get('max_pending', 256)),
+            slow_threshold=float(dispatch.get('slow_threshold', 0.005)),
+        )
+        stats = self.dispatcher.stats
+        for name in stats:
+            if name != 'max_depth':
+                REGISTRY.counter(f'mega_agent_mesh_dispatch_{name}_total', f"Раздача mesh: {name}",
+                                 function=lambda name=name: stats[name])
+        REGISTRY.gauge('mega_agent_mesh_dispatch_queue_depth', 'Сообщений в очереди раздачи',
+                       function=lambda: len(self.dispatcher._queue))
         logger.info("Инициализирован модуль MeshNetwork (заглушка)")
 
     def start(self) -> None:
         if self.enabled:
+            self.dispatcher.start()
+            if 'lora' in self.protocols:
+                try:
+                    link = LoraLink(self.config.get('lora', {}), on_message=self.dispatcher.submit)
+                    link.start()
+                    self.connections['lora'] = link
+                    self._link_metrics('lora', link)
+                except Exception as e:
+                    logger.error(f"Не удалось открыть канал LoRa: {e}")
             logger.info("Запуск Mesh-сетей (заглушка)")
         else:
             logger.info("Поддержка Mesh-сетей отключена")
 
+    def _link_metrics(self, protocol: str, link: LoraLink) -> None:
+        labels = {'protocol': protocol}
+        tx, rx = link.aggregator.stats, link.rx_stats
+        for name in tx:
+            metric = 'airtime_seconds' if name == 'airtime' else name
+            REGISTRY.counter(f'mega_agent_mesh_tx_{metric}_total', f"Передача mesh: {name}", labels,
+                             function=lambda name=name: tx[name])
+        for name in rx:
+            REGISTRY.counter(f'mega_agent_mesh_rx_{name}_total', f"Прием mesh: {name}", labels,
+                             function=lambda name=name: rx[name])
+
     def stop(self) -> None:
+        for link in self.connections.values():
+            link.stop()
+        self.connections.clear()
+        self.dispatcher.stop()
         logger.info("Остановка Mesh-сетей (заглушка)")
 
     def send_message(self, protocol: str, destination: str, message: Any) -> bool:
+        # Для LoRa сообщение только ставится в кадр адресата; в эфир кадр уходит по заполнении или по таймеру
+        link = self.connections.get(protocol)
+        if link is not None:
+            return link.send(destination, message)
         logger.debug(f"Отправка сообщения через {protocol} (заглушка): {message}")
         return True
 
-    def register_message_handler(self, protocol: str, handler: Callable[[str, Any], None]) -> None:
+    def register_message_handler(self, protocol: str, handler: Callable[[str, Any], None],
+                                 message_type: Optional[str] = None, destination: Optional[str] = None,
+                                 slow: bool = False) -> None:
+        # handler(отправитель, сообщение); slow=True - сразу в пул потоков, не задерживая разбор эфира
         if protocol not in self.message_handlers:
             self.message_handlers[protocol] = []
         self.message_handlers[protocol].append(handler)
+        self.dispatcher.register(protocol, handler, message_type, destination, slow)
         logger.debug(f"Зарегистрирован обработчик для {protocol}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {protocol: link.get_stats() for protocol, link in self.connections.items()}
+        stats['dispatch'] = self.dispatcher.get_stats()
+        return stats
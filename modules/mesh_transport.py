@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Callable, Iterable, Optional, Tuple
+
+from modules.mesh_codec import (FRAME_OVERHEAD, MAX_PAYLOAD, RAW_SCHEMA_ID, FrameBatch, FrameParser,
+                                ReadingCodec, encode_raw, frame, lora_airtime, node_address)
+
+logger = logging.getLogger(__name__)
+
+
+def serial_factory(options: Dict[str, Any]):
+    import serial
+    return serial.Serial(options.get('port', '/dev/ttyS0'), int(options.get('baudrate', 9600)),
+                         timeout=float(options.get('read_timeout', 0.1)))
+
+
+class FrameAggregator:
+    """
+    Собирает показания в кадры по адресатам: кадр уходит, когда следующее показание
+    в него не помещается (mtu) или когда первое показание ждет дольше max_delay.
+    Запись в канал делает только фоновый поток.
+    """
+
+    def __init__(self, codec: ReadingCodec, send: Callable[[bytes], Any], mtu: int = 240,
+                 max_delay: float = 2.0, source: int = 1, nodes: Optional[Dict[str, int]] = None,
+                 radio: Optional[Dict[str, Any]] = None):
+        self.codec = codec
+        self.send = send
+        if not FRAME_OVERHEAD < mtu <= MAX_PAYLOAD + FRAME_OVERHEAD:
+            raise ValueError(f"mtu должен быть от {FRAME_OVERHEAD + 1} до {MAX_PAYLOAD + FRAME_OVERHEAD}: {mtu}")
+        self.limit = mtu - FRAME_OVERHEAD
+        self.max_delay = max_delay
+        self.source = source
+        self.nodes = nodes or {}
+        self.radio = radio or {}
+        self._batches: Dict[int, Tuple[FrameBatch, float]] = {}
+        self._ready: deque = deque()
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, Any] = {'readings': 0, 'frames': 0, 'bytes': 0, 'airtime': 0.0,
+                                      'dropped': 0, 'errors': 0, 'non_finite': 0}
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='mesh-aggregator', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        self._write_ready()
+
+    def add(self, destination: str, readings: Iterable[Tuple[str, float]], ts: float) -> None:
+        address = node_address(destination, self.nodes)
+        non_finite = {}
+        with self._cond:
+            batch = None
+            for key, value in readings:
+                if not math.isfinite(value):
+                    # NaN/inf неисправного датчика не ложится в фиксированную точку - уходит JSON-кадром
+                    non_finite[key] = value
+                    continue
+                batch = self._batches.get(address, (None,))[0]
+                if batch is None or not batch.add(key, value, ts, self.limit):
+                    if batch is not None:
+                        self._close(address)
+                    batch = self.codec.batch(address, self.source, ts)
+                    if not batch.add(key, value, ts, self.limit):
+                        self.stats['dropped'] += 1
+                        continue
+                    self._batches[address] = (batch, time.monotonic() + self.max_delay)
+                self.stats['readings'] += 1
+            # Минимальное показание занимает 3 байта: если не влезет, ждать незачем
+            if batch is not None and self._batches.get(address, (None,))[0] is batch and batch.size() + 3 > self.limit:
+                self._close(address)
+            if non_finite:
+                self.stats['non_finite'] += len(non_finite)
+                self._push(encode_raw(address, self.source, non_finite))
+            self._cond.notify()
+
+    def enqueue(self, payload: bytes) -> None:
+        with self._cond:
+            self._push(payload)
+            self._cond.notify()
+
+    def _push(self, payload: bytes) -> None:
+        # Вызывается под _cond. Сообщение больше mtu в кадр не ложится: отбрасывается здесь, а не в потоке записи
+        if len(payload) > self.limit:
+            self.stats['dropped'] += 1
+            logger.warning(f"Сообщение mesh длиннее mtu ({len(payload)} > {self.limit} байт) отброшено")
+            return
+        self._ready.append(payload)
+
+    def send_raw(self, destination: str, message: Any) -> None:
+        self.enqueue(encode_raw(node_address(destination, self.nodes), self.source, message))
+
+    def flush(self) -> None:
+        with self._cond:
+            for address in list(self._batches):
+                self._close(address)
+            self._cond.notify()
+
+    def _close(self, address: int) -> None:
+        batch, _ = self._batches.pop(address)
+        self._ready.append(batch.payload())
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            with self._cond:
+                if not self._ready:
+                    deadline = min((d for _, d in self._batches.values()), default=None)
+                    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                    self._cond.wait(timeout)
+                now = time.monotonic()
+                for address, (_, deadline) in list(self._batches.items()):
+                    if deadline <= now:
+                        self._close(address)
+            self._write_ready()
+
+    def _write_ready(self) -> None:
+        while True:
+            with self._cond:
+                if not self._ready:
+                    return
+                payload = self._ready.popleft()
+            try:
+                data = frame(payload)
+                self.send(data)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка отправки кадра mesh: {e}")
+                continue
+            self.stats['frames'] += 1
+            self.stats['bytes'] += len(data)
+            self.stats['airtime'] += lora_airtime(len(data), **self.radio)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        readings = max(stats['readings'], 1)
+        stats['bytes_per_reading'] = stats['bytes'] / readings
+        stats['airtime_per_reading'] = stats['airtime'] / readings
+        stats['pending'] = sum(batch.count for batch, _ in self._batches.values())
+        return stats
+
+
+class LoraLink:
+    """
+    Радиомодуль LoRa с прозрачным UART: кадры пишутся в последовательный порт как есть.
+    Если задан on_message, отдельный поток читает порт и передает принятые кадры
+    в on_message(протокол, тип, адресат, отправитель, сообщение), не дожидаясь обработки.
+    """
+
+    def __init__(self, options: Dict[str, Any], serial_factory: Callable = serial_factory,
+                 on_message: Optional[Callable[[str, str, str, str, Any], Any]] = None):
+        self.options = options
+        self.serial_factory = serial_factory
+        self.on_message = on_message
+        self.port = None
+        self.node_id = int(options.get('node_id', 1))
+        nodes = options.get('nodes', {})
+        self._names = {int(address): name for name, address in nodes.items()}
+        self._names[self.node_id] = options.get('node_name', 'mega_agent')
+        self.codec = ReadingCodec.from_config(options)
+        self.parser = FrameParser()
+        radio = options.get('radio', {})
+        self.aggregator = FrameAggregator(
+            self.codec, self._write,
+            mtu=int(options.get('mtu', 240)),
+            max_delay=float(options.get('batch_max_delay', 2.0)),
+            source=self.node_id,
+            nodes=nodes,
+            radio={name: radio[name] for name in ('spreading_factor', 'bandwidth', 'coding_rate', 'preamble')
+                   if name in radio},
+        )
+        self._stop_event = threading.Event()
+        self._reader: Optional[threading.Thread] = None
+        self.rx_stats: Dict[str, int] = {'frames': 0, 'bytes': 0, 'decode_errors': 0, 'read_errors': 0}
+
+    def start(self) -> None:
+        self.port = self.serial_factory(self.options)
+        self.aggregator.start()
+        if self.on_message is not None:
+            self._stop_event.clear()
+            self._reader = threading.Thread(target=self._read_loop, name='lora-reader', daemon=True)
+            self._reader.start()
+
+    def stop(self) -> None:
+        self.aggregator.stop()
+        if self._reader is not None:
+            self._stop_event.set()
+            self._reader.join()
+            self._reader = None
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+    def send(self, destination: str, message: Any, ts: Optional[float] = None) -> bool:
+        # Числовые показания пакуются схемой, остальное уходит отдельным JSON-кадром
+        if isinstance(message, dict) and message and all(
+                isinstance(v, (int, float)) and not isinstance(v, bool) for v in message.values()):
+            self.aggregator.add(destination, message.items(), time.time() if ts is None else ts)
+        else:
+            self.aggregator.send_raw(destination, message)
+        return True
+
+    def _write(self, data: bytes) -> None:
+        self.port.write(data)
+
+    def _read_loop(self) -> None:
+        port = self.port
+        while not self._stop_event.is_set():
+            try:
+                # Ждем первый байт не дольше таймаута порта, затем забираем все накопленное
+                data = port.read(port.in_waiting or 1)
+            except Exception as e:
+                self.rx_stats['read_errors'] += 1
+                logger.error(f"Ошибка чтения порта LoRa: {e}")
+                self._stop_event.wait(1.0)
+                continue
+            if data:
+                self.rx_stats['bytes'] += len(data)
+                for payload in self.parser.feed(data):
+                    self._receive(payload)
+
+    def _receive(self, payload: bytes) -> None:
+        try:
+            destination, source, message = self.codec.decode(payload)
+        except Exception:
+            self.rx_stats['decode_errors'] += 1
+            return
+        self.rx_stats['frames'] += 1
+        if payload[0] == RAW_SCHEMA_ID:
+            message_type = message.get('type', 'json') if isinstance(message, dict) else 'json'
+        else:
+            message_type = 'readings'
+        self.on_message('lora', message_type, self._name(destination), self._name(source), message)
+
+    def _name(self, address: int) -> str:
+        return self._names.get(address) or f"node_{address}"
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.aggregator.get_stats()
+        stats['rx'] = dict(self.rx_stats, crc_errors=self.parser.errors)
+        return stats
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter as Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Callable, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Границы по умолчанию для длительностей в секундах: от 50 мкс до 10 с
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """Монотонный счетчик: одна ячейка общего массива реестра."""
+
+    __slots__ = ('_values', '_index', 'labels', 'function')
+
+    def __init__(self, values: array, index: int, labels: str):
+        self._values = values
+        self._index = index
+        self.labels = labels
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._values[self._index] += amount
+
+    @property
+    def value(self) -> float:
+        if self.function is not None:
+            return float(self.function())
+        return self._values[self._index]
+
+    def samples(self, name: str) -> Iterator[Tuple[str, float]]:
+        yield name + self.labels, self.value
+
+
+class Gauge(Counter):
+    """Текущее значение; с function значение читается только при выгрузке."""
+
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self._values[self._index] = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._values[self._index] -= amount
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами: счетчики корзин и сумма лежат подряд
+    в массиве реестра, наблюдение - бинарный поиск и два сложения на месте.
+    """
+
+    __slots__ = ('_values', '_base', '_sum', 'bounds', 'labels', '_bucket_labels')
+
+    def __init__(self, values: array, base: int, bounds: Tuple[float, ...], labels: Dict[str, str]):
+        self._values = values
+        self._base = base
+        self._sum = base + len(bounds) + 1
+        self.bounds = bounds
+        self.labels = _format_labels(labels)
+        self._bucket_labels = [_format_labels(dict(labels, le=_format_value(bound)))
+                               for bound in bounds + (float('inf'),)]
+
+    def observe(self, value: float) -> None:
+        values = self._values
+        values[self._base + bisect_left(self.bounds, value)] += 1
+        values[self._sum] += value
+
+    @property
+    def count(self) -> int:
+        return int(sum(self._values[self._base:self._sum]))
+
+    @property
+    def sum(self) -> float:
+        return self._values[self._sum]
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по корзинам (верхняя граница корзины); 0, если наблюдений нет."""
+        counts = self._values[self._base:self._sum]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank, seen = q * total, 0.0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self, name: str) -> Iterator[Tuple[str, float]]:
+        cumulative = 0.0
+        for labels, count in zip(self._bucket_labels, self._values[self._base:self._sum]):
+            cumulative += count
+            yield f"{name}_bucket{labels}", cumulative
+        yield f"{name}_sum{self.labels}", self.sum
+        yield f"{name}_count{self.labels}", cumulative
+
+
+class MetricFamily:
+    __slots__ = ('name', 'kind', 'help', 'metrics')
+
+    def __init__(self, name: str, kind: str, help: str):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.metrics: Dict[str, Any] = {}
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик. Все значения хранятся в одном array('d'): ячейки выделяются при
+    регистрации, наблюдение только меняет число на месте - без словарей, блокировок
+    и новых объектов. Под GIL при гонке двух потоков на одной ячейке возможна
+    потеря отдельного приращения, для телеметрии это допустимо. Повторная
+    регистрация с тем же именем и метками возвращает ту же метрику.
+    """
+
+    def __init__(self):
+        self._values = array('d')
+        self._families: Dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name: str, kind: str, help: str, labels: Optional[Dict[str, str]], create):
+        labels = dict(labels or {})
+        key = _format_labels(labels)
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = MetricFamily(name, kind, help)
+            elif family.kind != kind:
+                raise ValueError(f"Метрика {name} уже зарегистрирована как {family.kind}")
+            metric = family.metrics.get(key)
+            if metric is None:
+                metric = family.metrics[key] = create(labels, key)
+            return metric
+
+    def _allocate(self, size: int) -> int:
+        index = len(self._values)
+        self._values.extend([0.0] * size)
+        return index
+
+    def counter(self, name: str, help: str = '', labels: Optional[Dict[str, str]] = None,
+                function: Optional[Callable[[], float]] = None) -> Counter:
+        """
+        function - значение берется из существующего счетчика модуля при выгрузке;
+        повторная регистрация заменяет функцию (метрики отдает последний экземпляр).
+        """
+        metric = self._register(name, 'counter', help, labels,
+                                lambda _, key: Counter(self._values, self._allocate(1), key))
+        if function is not None:
+            metric.function = function
+        return metric
+
+    def gauge(self, name: str, help: str = '', labels: Optional[Dict[str, str]] = None,
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        metric = self._register(name, 'gauge', help, labels,
+                                lambda _, key: Gauge(self._values, self._allocate(1), key))
+        if function is not None:
+            metric.function = function
+        return metric
+
+    def histogram(self, name: str, help: str = '', labels: Optional[Dict[str, str]] = None,
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        bounds = tuple(sorted(float(bound) for bound in buckets if bound != float('inf')))
+        return self._register(name, 'histogram', help, labels,
+                              lambda labels, _: Histogram(self._values, self._allocate(len(bounds) + 2),
+                                                          bounds, labels))
+
+    def get(self, name: str, labels: Optional[Dict[str, str]] = None):
+        family = self._families.get(name)
+        return family.metrics.get(_format_labels(dict(labels or {}))) if family else None
+
+    def samples(self) -> Iterator[Tuple[MetricFamily, str, float]]:
+        with self._lock:
+            families = [(family, list(family.metrics.values())) for family in self._families.values()]
+        for family, metrics in families:
+            for metric in metrics:
+                try:
+                    for sample, value in metric.samples(family.name):
+                        yield family, sample, value
+                except Exception as e:
+                    logger.debug(f"Метрика {family.name} недоступна: {e}")
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus 0.0.4."""
+        lines: List[str] = []
+        current = None
+        for family, sample, value in self.samples():
+            if family is not current:
+                current = family
+                if family.help:
+                    lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.append(f"{sample} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self, prefix: str = '') -> Dict[str, float]:
+        """Плоский словарь {метрика{метки}: значение} - для статусов и тестов."""
+        return {sample: value for family, sample, value in self.samples() if family.name.startswith(prefix)}
+
+
+# Общий реестр процесса: модули регистрируют метрики в нем
+REGISTRY = MetricsRegistry()
+
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик: фоновый поток раз в interval снимает стеки всех
+    потоков через sys._current_frames() и считает одинаковые стеки. Код агента
+    не меняется и не замедляется, пока профилировщик выключен; включается и
+    выключается на ходу. Результат - свернутые стеки для flamegraph.pl/speedscope.
+    """
+
+    def __init__(self, interval: float = 0.01, depth: int = 32, max_stacks: int = 5000,
+                 registry: MetricsRegistry = REGISTRY):
+        self.interval = interval
+        self.depth = depth
+        self.max_stacks = max_stacks
+        self.stacks: Tally = Tally()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._samples = registry.counter('mega_agent_profiler_samples_total', 'Снятые выборки стеков')
+        registry.gauge('mega_agent_profiler_running', 'Профилировщик включен', function=lambda: self.running)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: Optional[float] = None) -> None:
+        if interval is not None:
+            self.interval = max(float(interval), 0.001)
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"Профилировщик включен, интервал {self.interval * 1000:.0f} мс")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        logger.info("Профилировщик выключен")
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stacks.clear()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        sampled = []
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            sampled.append(';'.join(reversed(stack)))
+        del frames
+        with self._lock:
+            for stack in sampled:
+                if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    stack = '[other]'
+                self.stacks[stack] += 1
+        self._samples.inc(len(sampled))
+
+    def collapsed(self) -> str:
+        """Строки "поток;файл:функция;... число" от корня стека к вершине."""
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = 20) -> List[Tuple[str, int]]:
+        """Функции, чаще всего бывшие на вершине стека."""
+        tops: Tally = Tally()
+        with self._lock:
+            for stack, count in self.stacks.items():
+                tops[stack.rsplit(';', 1)[-1]] += count
+        return tops.most_common(limit)
+
+
+class MetricsServer:
+    """
+    Локальный HTTP: GET /metrics - метрики для Prometheus, GET /profile - свернутые
+    стеки; POST /profile/start?interval=0.01, /profile/stop и /profile/reset
+    управляют профилировщиком.
+    """
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, profiler: Optional[SamplingProfiler] = None,
+                 host: str = '127.0.0.1', port: int = 9108):
+        self.registry = registry
+        self.profiler = profiler
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, options: Dict[str, Any], registry: MetricsRegistry = REGISTRY) -> 'MetricsServer':
+        profiling = options.get('profiler', {})
+        profiler = SamplingProfiler(interval=float(profiling.get('interval', 0.01)),
+                                    depth=int(profiling.get('depth', 32)),
+                                    max_stacks=int(profiling.get('max_stacks', 5000)),
+                                    registry=registry)
+        if profiling.get('enabled', False):
+            profiler.start()
+        return cls(registry, profiler, options.get('host', '127.0.0.1'), int(options.get('port', 9108)))
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2] if self._server is not None else (self.host, self.port)
+
+    def start(self) -> None:
+        if self._server is not None:
+            return
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        logger.info(f"Метрики доступны на http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def stop(self) -> None:
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+
+    def _handler(self):
+        registry, profiler = self.registry, self.profiler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path == '/metrics':
+                    self._reply(200, registry.render(), 'text/plain; version=0.0.4; charset=utf-8')
+                elif path == '/profile' and profiler is not None:
+                    self._reply(200, profiler.collapsed())
+                else:
+                    self._reply(404, 'not found\n')
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                if profiler is None or not url.path.startswith('/profile/'):
+                    self._reply(404, 'not found\n')
+                    return
+                action = url.path[len('/profile/'):]
+                if action == 'start':
+                    interval = parse_qs(url.query).get('interval')
+                    profiler.start(float(interval[0]) if interval else None)
+                elif action == 'stop':
+                    profiler.stop()
+                elif action == 'reset':
+                    profiler.reset()
+                else:
+                    self._reply(404, 'not found\n')
+                    return
+                self._reply(200, f"running={int(profiler.running)}\n")
+
+            def _reply(self, status: int, body: str, content_type: str = 'text/plain; charset=utf-8'):
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def measure_overhead(iterations: int = 100000, repeats: int = 5) -> Dict[str, float]:
+    """Стоимость одного наблюдения в наносекундах (лучшее из repeats) на отдельном реестре."""
+    registry = MetricsRegistry()
+    counter = registry.counter('overhead_counter_total')
+    gauge = registry.gauge('overhead_gauge')
+    histogram = registry.histogram('overhead_seconds')
+    loop = range(iterations)
+    result = {}
+    for name, call, arg in (('counter_inc_ns', counter.inc, 1.0), ('gauge_set_ns', gauge.set, 1.0),
+                            ('histogram_observe_ns', histogram.observe, 0.003)):
+        best = float('inf')
+        for _ in range(repeats):
+            started = time.perf_counter()
+            for _ in loop:
+                call(arg)
+            best = min(best, time.perf_counter() - started)
+        result[name] = best / iterations * 1e9
+    return result
@@ -2,58 +2,281 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import math
+import threading
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List, Tuple
+
+from modules.alerting import Alert, AlertNotifier, RuleEngine
+from modules.forecasting import HoltWintersBank
+from modules.metrics import REGISTRY
+from modules.rolling_stats import RollingWindow
+from modules.rollups import RollupStore
+from modules.storage import SegmentLog
+from modules.timeseries import TimeSeriesStore
 
 logger = logging.getLogger(__name__)
 
+COLLECT_SECONDS = REGISTRY.histogram('mega_agent_monitoring_collect_seconds', 'Длительность приема отсчета')
+REJECTED = REGISTRY.counter('mega_agent_monitoring_rejected_total', 'Отброшенные нечисловые отсчеты, NaN и бесконечности')
+ALERTS = REGISTRY.counter('mega_agent_monitoring_alerts_total', 'Алерты правил мониторинга')
+
 class MonitoringAnalytics:
     def __init__(self, config: Dict[str, Any]):
         self.config = config.get('monitoring', {})
         self.enabled = self.config.get('enabled', False)
         self.data_storage = self.config.get('data_storage', 'memory')
-        self.data_history = {}
+        # Кольцевой буфер на каждый data_type: время и значение в array('d'), без словарей на отсчет
+        self.data_history = TimeSeriesStore(
+            retention_samples=int(self.config.get('retention_samples', 8640)),
+            memory_limit_mb=float(self.config.get('memory_limit_mb', 64)))
+        # Окна статистики обновляются при каждом отсчете, чтение - O(1)
+        self.stats_windows = [int(w) for w in self.config.get('stats_windows', [100])]
+        self.trend_threshold = float(self.config.get('trend_threshold', 0.5))
+        self.rolling: Dict[str, Dict[int, RollingWindow]] = {}
+        # Состояние Холта-Уинтерса обновляется в collect_data, прогноз не требует переобучения
+        forecast = self.config.get('forecast', {})
+        self.forecaster = HoltWintersBank(
+            period=float(forecast.get('period', 3600)),
+            alpha=float(forecast.get('alpha', 0.3)),
+            beta=float(forecast.get('beta', 0.05)),
+            gamma=float(forecast.get('gamma', 0.1)))
+        # Сводки по 5 минутам, часам и суткам для отчетов и экспорта
+        self.rollups = RollupStore.from_config(self.config.get('rollups', {}))
+        # Правила алертов проверяются на каждом отсчете; доставка - с группировкой и лимитами каналов
+        alerts = self.config.get('alerts', {})
+        self.rules = RuleEngine.from_config(alerts)
+        self.notifier = AlertNotifier.from_config(self._send_alert, alerts)
+        self.alert_sender: Callable[[str, str, str], Any] = None
+        self._alert_lock = threading.Lock()
+        self._alert_stop = threading.Event()
+        self._alert_thread: threading.Thread = None
+        self._lock = threading.Lock()
+        # Режим "disk": журнал на SD-карте в дополнение к буферам в памяти
+        self.storage = None
+        if self.data_storage == 'disk':
+            self.storage = SegmentLog(
+                self.config.get('storage_path', './monitoring_data'),
+                segment_size_mb=float(self.config.get('segment_size_mb', 16)),
+                fsync_interval=float(self.config.get('fsync_interval', 5)),
+                retention_days=float(self.config.get('retention_days', 0)))
+        REGISTRY.gauge('mega_agent_monitoring_series', 'Число рядов в памяти', function=lambda: len(self.rolling))
         logger.info("Инициализирован модуль MonitoringAnalytics (заглушка)")
 
     def start(self) -> None:
         if self.enabled:
+            if self.storage is not None:
+                self.storage.open()
+                self._recover()
+            if self.rules.rule_count or self.rules.patterns:
+                # Отсутствие данных и отложенные группы алертов проверяются по таймеру
+                self._alert_stop.clear()
+                self._alert_thread = threading.Thread(target=self._alert_loop, name='alert-timer', daemon=True)
+                self._alert_thread.start()
             logger.info("Модуль мониторинга и аналитики запущен (заглушка)")
         else:
             logger.info("Модуль мониторинга отключен")
 
     def stop(self) -> None:
+        if self._alert_thread is not None:
+            self._alert_stop.set()
+            self._alert_thread.join()
+            self._alert_thread = None
+        with self._alert_lock:
+            self.notifier.flush(force=True)
+        if self.storage is not None and self.storage.is_open:
+            self.storage.close()
         logger.info("Модуль мониторинга остановлен (заглушка)")
 
+    def _recover(self) -> None:
+        started = time.monotonic()
+        recovered = self.storage.recover(int(self.config.get('recovery_segments', 8)))
+        with self._lock:
+            for data_type, (times, values) in recovered.items():
+                self.data_history.extend(data_type, times, values)
+                self.rolling.pop(data_type, None)
+                self._windows(data_type)
+                self.rollups.load(data_type, times, values)
+            self.forecaster.load(recovered)
+        logger.info(f"Восстановлено {self.storage.stats['recovered']} отсчетов {len(recovered)} рядов "
+                    f"за {time.monotonic() - started:.2f} с")
+
     def collect_data(self, data_type: str, data: Any, timestamp: float = None) -> None:
+        started = time.perf_counter()
         if timestamp is None:
             timestamp = time.time()
-        logger.debug(f"Собраны данные {data_type}: {data} (заглушка)")
+        try:
+            value = float(data)
+        except (TypeError, ValueError):
+            REJECTED.inc()
+            logger.warning(f"Нечисловые данные {data_type} не сохранены: {data!r}")
+            return
+        if not math.isfinite(value):
+            # Один NaN навсегда испортил бы скользящие суммы окон и состояние прогноза
+            REJECTED.inc()
+            logger.warning(f"Нефинитное значение {data_type} не сохранено: {value}")
+            return
+        with self._lock:
+            windows = self.rolling.get(data_type) or self._windows(data_type)
+            self.data_history.append(data_type, timestamp, value)
+            for window in windows.values():
+                window.add(timestamp, value)
+            self.forecaster.add(data_type, timestamp, value)
+            self.rollups.add(data_type, timestamp, value)
+            alerts = self.rules.evaluate(data_type, timestamp, value)
+            if self.storage is not None and self.storage.is_open:
+                self.storage.append(self.storage.series_id(data_type), timestamp, value)
+        if alerts:
+            self._raise_alerts(alerts)
+        COLLECT_SECONDS.observe(time.perf_counter() - started)
+
+    def _windows(self, data_type: str) -> Dict[int, RollingWindow]:
+        windows = self.rolling.setdefault(data_type, {})
+        for size in self.stats_windows:
+            if size not in windows:
+                windows[size] = self._new_window(data_type, size)
+        return windows
+
+    def _new_window(self, data_type: str, size: int) -> RollingWindow:
+        # Новое окно разово заполняется из истории, дальше оно ведется в collect_data
+        window = RollingWindow(size, self.trend_threshold)
+        times, values = self.data_history.window(data_type, size)
+        for timestamp, value in zip(times.tolist(), values.tolist()):
+            window.add(timestamp, value)
+        return window
 
     def analyze_patterns(self, data_type: str, window_size: int = 100) -> Dict[str, Any]:
-        logger.debug(f"Анализ паттернов для {data_type} (заглушка)")
-        import random
-        return {
-            'count': random.randint(10, window_size),
-            'mean': random.uniform(20.0, 30.0),
-            'std': random.uniform(1.0, 5.0),
-            'min': random.uniform(15.0, 25.0),
-            'max': random.uniform(35.0, 45.0),
-            'trend': random.choice(['increasing', 'decreasing', 'stable'])
-        }
+        with self._lock:
+            windows = self.rolling.get(data_type) or self._windows(data_type)
+            window = windows.get(window_size)
+            if window is None:
+                window = windows[window_size] = self._new_window(data_type, window_size)
+                logger.debug(f"Зарегистрировано окно статистики {window_size} для {data_type}")
+            return window.summary()
+
+    def query_range(self, data_type: str, start: float, end: float):
+        """Отсчеты ряда за [start, end]: с диска в режиме "disk", иначе из буфера в памяти."""
+        if self.storage is not None and self.storage.is_open:
+            return self.storage.query(data_type, start, end)
+        times, values = self.data_history.since(data_type, start, end)
+        return times.copy(), values.copy()
 
     def predict_future(self, data_type: str, periods: int = 24) -> list:
-        logger.debug(f"Прогнозирование для {data_type} на {periods} периодов (заглушка)")
-        import random
-        return [random.uniform(20.0, 35.0) for _ in range(periods)]
+        """Прогноз средних значений на periods интервалов forecast.period; пустой список, если данных нет."""
+        with self._lock:
+            return self.forecaster.forecast(data_type, periods)
+
+    def set_alert_sender(self, sender: Callable[[str, str, str], Any]) -> None:
+        """sender(сообщение, уровень, канал) - например, Integrations.send_alert."""
+        self.alert_sender = sender
+
+    def _send_alert(self, message: str, level: str, channel: str) -> None:
+        if self.alert_sender is not None:
+            self.alert_sender(message, level, channel)
+        else:
+            logger.info(f"Алерт [{level.upper()}] ({channel}): {message}")
+
+    def _raise_alerts(self, alerts: List[Alert]) -> None:
+        ALERTS.inc(len(alerts))
+        with self._lock:
+            for alert in alerts:
+                if alert.firing:
+                    self.rollups.count_alert(alert.data_type, alert.timestamp)
+        for alert in alerts:
+            logger.info(f"Алерт [{alert.level.upper()}] {alert.rule}: {alert.message}")
+        with self._alert_lock:
+            self.notifier.submit(alerts)
+
+    def check_alerts(self, now: float = None) -> None:
+        """Проверка отсутствия данных и отправка накопленных групп алертов."""
+        with self._lock:
+            alerts = self.rules.check_stale(now)
+        if alerts:
+            self._raise_alerts(alerts)
+        with self._alert_lock:
+            self.notifier.flush()
+
+    def _alert_loop(self) -> None:
+        while not self._alert_stop.wait(self.rules.stale_check_interval):
+            try:
+                self.check_alerts()
+            except Exception as e:
+                logger.error(f"Ошибка проверки алертов: {e}")
+
+    def add_alert(self, alert_type: str, message: str, level: str = 'info', data_type: str = None) -> None:
+        logger.info(f"Алерт [{level.upper()}] {alert_type}: {message}")
+        with self._lock:
+            self.rollups.count_alert(data_type or alert_type, time.time())
 
-    def add_alert(self, alert_type: str, message: str, level: str = 'info') -> None:
-        logger.info(f"Алерт [{level.upper()}] {alert_type}: {message} (заглушка)")
+    def _aligned_widths(self, start: float, end: float) -> List[int]:
+        # Ярусы, интервалы которых укладываются в [start, end) целиком: при ярусах, не делящих сутки,
+        # суточный ярус не подходит и сводка берется с более мелкого
+        return [width for width, _ in self.rollups.tiers
+                if self.rollups.aligned(width, start) and self.rollups.aligned(width, end)]
 
-    def get_daily_report(self) -> Dict[str, Any]:
-        logger.debug("Генерация ежедневного отчета (заглушка)")
+    @property
+    def data_version(self) -> int:
+        """Меняется с каждым отсчетом и алертом, попавшим в сводки отчета."""
+        return self.rollups.version
+
+    @staticmethod
+    def report_date(timestamp: float = None) -> str:
+        # Сутки отчета - местные, как и границы в get_daily_report
+        return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+    def get_daily_report(self, date: str = None) -> Dict[str, Any]:
+        """Отчет за сутки (по умолчанию - сегодня) из готовых сводок: отсчеты не перебираются."""
+        date = date or self.report_date()
+        day_start, day_end = _day_bounds(date, 0)
+        previous_start, _ = _day_bounds(date, -1)
+        widths = self._aligned_widths(day_start, day_end)
+        day_width = max(widths) if widths else self.rollups.tiers[0][0]
+        previous_widths = self._aligned_widths(previous_start, day_start)
+        previous_width = max(previous_widths) if previous_widths else self.rollups.tiers[0][0]
+        day_end -= 1e-6
+        analytics: Dict[str, Any] = {}
+        insights = []
+        total_points = total_alerts = 0
+        with self._lock:
+            for data_type in sorted(self.rollups.series):
+                summary = self.rollups.total(data_type, day_width, day_start, day_end)
+                if not summary['count'] and not summary['alerts']:
+                    continue
+                total_points += summary['count']
+                total_alerts += summary['alerts']
+                if not summary['count']:
+                    continue
+                if 3600 in widths:
+                    # Со смещением: в день перевода часов назад час 02:00 встречается дважды
+                    summary['hourly'] = {time.strftime('%H:00%z', time.localtime(ts)): row['mean']
+                                         for ts, row in self.rollups.query(data_type, 3600, day_start, day_end)}
+                analytics[data_type] = summary
+                previous = self.rollups.total(data_type, previous_width, previous_start, day_start - 1e-6)
+                if previous['count'] and abs(summary['mean'] - previous['mean']) > max(2 * previous['std'], 1e-9):
+                    insights.append(f"{data_type}: среднее {summary['mean']:.2f} против "
+                                    f"{previous['mean']:.2f} накануне")
+                if summary['alerts']:
+                    insights.append(f"{data_type}: алертов за день - {summary['alerts']}")
         return {
-            'date': time.strftime('%Y-%m-%d'),
-            'summary': {'total_data_points': 'N/A', 'total_alerts': 0},
-            'analytics': {},
-            'insights': []
+            'date': date,
+            'summary': {'total_data_points': total_points, 'total_alerts': total_alerts,
+                        'data_types': len(analytics)},
+            'analytics': analytics,
+            'insights': insights
         }
+
+    def export_data(self, path: str, fmt: str = 'csv', width: int = 3600, start: float = None,
+                    end: float = None, data_types: list = None) -> int:
+        """Экспорт сводок яруса width в CSV или Parquet потоком; возвращает число строк."""
+        with self._lock:
+            # Запись файла идет по снимку сводок, без блокировки приема
+            snapshot = self.rollups.snapshot(width, data_types)
+        return snapshot.export(path, width, fmt, start=start, end=end)
+
+
+def _day_bounds(date: str, shift: int) -> Tuple[float, float]:
+    """Начало и конец местных суток date + shift дней; mktime учитывает переход на летнее время."""
+    day = time.strptime(date, '%Y-%m-%d')
+    start = time.mktime((day.tm_year, day.tm_mon, day.tm_mday + shift, 0, 0, 0, 0, 0, -1))
+    end = time.mktime((day.tm_year, day.tm_mon, day.tm_mday + shift + 1, 0, 0, 0, 0, 0, -1))
+    return start, end
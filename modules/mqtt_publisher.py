@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from modules.ratelimit import TokenBucket
+from modules.spool import DiskQueue
+
+logger = logging.getLogger(__name__)
+
+# (topic, payload, qos, retain)
+Message = Tuple[str, bytes, int, bool]
+
+# paho.mqtt.client.MQTT_ERR_NO_CONN: QoS1/2 при этом коде остается в очереди paho и уйдет после переподключения
+MQTT_ERR_NO_CONN = 4
+
+
+def paho_client_factory(options: Dict[str, Any]):
+    import paho.mqtt.client as mqtt
+    client_id = options.get('client_id', 'mega-agent')
+    if hasattr(mqtt, 'CallbackAPIVersion'):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, clean_session=True)
+    else:
+        client = mqtt.Client(client_id=client_id, clean_session=True)
+    if options.get('username'):
+        client.username_pw_set(options['username'], options.get('password'))
+    client.reconnect_delay_set(min_delay=1, max_delay=int(options.get('reconnect_delay_max', 60)))
+    return client
+
+
+class MqttPublisher:
+    """
+    Публикация MQTT в фоне: publish() только кладет сообщение в ограниченную очередь.
+    Фоновый поток держит подключение, ограничивает число неподтвержденных QoS1,
+    при отсутствии брокера складывает сообщения на диск и потом отправляет их с
+    ограничением скорости.
+    """
+
+    def __init__(self, options: Dict[str, Any], client_factory: Optional[Callable] = None):
+        self.options = options
+        self.client_factory = client_factory or paho_client_factory
+        self.host = options.get('host', 'localhost')
+        self.port = int(options.get('port', 1883))
+        self.default_qos = int(options.get('qos', 1))
+        self.max_inflight = int(options.get('max_inflight', 20))
+        self.batch_max_items = int(options.get('batch_max_items', 1))
+        self.batch_max_delay = float(options.get('batch_max_delay', 1.0))
+        self.spool_path = options.get('spool_path', './mqtt_spool/spool.db')
+        self.drain = TokenBucket(float(options.get('drain_rate', 50)), float(options.get('drain_burst', 20)))
+        self._queue: queue.Queue = queue.Queue(maxsize=int(options.get('queue_size', 10000)))
+        self._batches: Dict[Tuple[str, int, bool], List[Any]] = {}
+        self._batch_started: Dict[Tuple[str, int, bool], float] = {}
+        self._inflight: Dict[int, Message] = {}
+        # Сообщения из очереди на диске: строка удаляется только после подтверждения брокера
+        self._inflight_rows: Dict[int, int] = {}
+        self._sending_rows = set()
+        self._acked_rows: List[int] = []
+        # mid, подтвержденные раньше, чем publish() вернул управление, и mid сообщений QoS0
+        self._early_acks = set()
+        self._untracked = set()
+        self._inflight_lock = threading.Lock()
+        self._window = threading.Semaphore(self.max_inflight)
+        self._connected = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.client = None
+        self.spool: Optional[DiskQueue] = None
+        self._started_at = time.monotonic()
+        self.stats: Dict[str, int] = {
+            'enqueued': 0, 'dropped': 0, 'published': 0, 'acked': 0, 'batches': 0,
+            'spooled': 0, 'drained': 0, 'errors': 0, 'connects': 0, 'disconnects': 0,
+        }
+
+    # --- горячий путь вызывающего ---
+
+    def publish(self, topic: str, payload: Any, qos: Optional[int] = None, retain: bool = False) -> bool:
+        try:
+            self._queue.put_nowait((topic, payload, self.default_qos if qos is None else qos, retain))
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['enqueued'] += 1
+        return True
+
+    # --- жизненный цикл ---
+
+    def start(self) -> None:
+        self.spool = DiskQueue(self.spool_path, table='mqtt_spool')
+        self.client = self.client_factory(self.options)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        # Окно paho по умолчанию - 20 сообщений; без этого большее max_inflight не действует
+        self.client.max_inflight_messages_set(self.max_inflight)
+        self.client.connect_async(self.host, self.port, int(self.options.get('keepalive', 60)))
+        self.client.loop_start()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='mqtt-publisher', daemon=True)
+        self._thread.start()
+        logger.info(f"MQTT публикация запущена: {self.host}:{self.port}, в очереди на диске {len(self.spool)}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # Все, что не подтверждено брокером, остается на диске до следующего запуска
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for item in pending:
+            self._add_to_batch(item, time.monotonic())
+        self._spool_messages(self._take_batches(force=True))
+        deadline = time.monotonic() + timeout
+        while self._inflight and self._connected.is_set() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self._inflight_lock:
+            unacked = self._forget_inflight()
+        self._spool_messages(unacked)
+        self._delete_acked_rows()
+        if self.client is not None:
+            self.client.disconnect()
+            self.client.loop_stop()
+        # Очередь paho уходит вместе с клиентом: окно снова свободно
+        self._window = threading.Semaphore(self.max_inflight)
+        if self.spool is not None:
+            self.spool.close()
+        logger.info("MQTT публикация остановлена")
+
+    # --- фоновый поток ---
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                item = self._queue.get(timeout=min(self.batch_max_delay, 0.1))
+            except queue.Empty:
+                item = None
+            now = time.monotonic()
+            if item is not None:
+                self._add_to_batch(item, now)
+                # Забираем все накопившееся без ожидания
+                for _ in range(1000):
+                    try:
+                        self._add_to_batch(self._queue.get_nowait(), now)
+                    except queue.Empty:
+                        break
+            ready = self._take_batches()
+            try:
+                if not self._connected.is_set() or len(self.spool):
+                    # Порядок сохраняется: пока есть очередь на диске, новые сообщения идут за ней
+                    self._spool_messages(ready)
+                    if self._connected.is_set():
+                        self._drain_spool()
+                else:
+                    for index, message in enumerate(ready):
+                        if not self._send(message):
+                            self._spool_messages(ready[index:])
+                            break
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Ошибка публикации MQTT: {e}")
+                self._spool_messages(ready)
+
+    def _add_to_batch(self, item, now: float) -> None:
+        topic, payload, qos, retain = item
+        key = (topic, qos, retain)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            self._batch_started[key] = now
+        batch.append(payload)
+
+    def _take_batches(self, force: bool = False) -> List[Message]:
+        now = time.monotonic()
+        ready = []
+        for key in list(self._batches):
+            batch = self._batches[key]
+            if (force or self.batch_max_items <= 1 or len(batch) >= self.batch_max_items
+                    or now - self._batch_started[key] >= self.batch_max_delay):
+                del self._batches[key]
+                del self._batch_started[key]
+                topic, qos, retain = key
+                if self.batch_max_items <= 1:
+                    ready.extend((topic, _encode(payload), qos, retain) for payload in batch)
+                else:
+                    # Несколько показаний одного топика - одно сообщение с JSON-массивом
+                    for start in range(0, len(batch), self.batch_max_items):
+                        chunk = batch[start:start + self.batch_max_items]
+                        ready.append((topic, json.dumps(chunk, ensure_ascii=False).encode('utf-8'), qos, retain))
+                        self.stats['batches'] += 1
+        return ready
+
+    def _send(self, message: Message, row_id: Optional[int] = None) -> bool:
+        topic, payload, qos, retain = message
+        # Окно неподтвержденных сообщений: ждет только фоновый поток, не вызывающий
+        while not self._window.acquire(timeout=0.1):
+            if self._stop_event.is_set() or not self._connected.is_set():
+                return False
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc != 0 and not (info.rc == MQTT_ERR_NO_CONN and qos > 0):
+            self._window.release()
+            self.stats['errors'] += 1
+            return False
+        self.stats['published'] += 1
+        with self._inflight_lock:
+            if info.mid in self._early_acks:
+                self._early_acks.discard(info.mid)
+                acked = True
+            else:
+                acked = False
+                if qos == 0:
+                    self._untracked.add(info.mid)
+                else:
+                    self._inflight[info.mid] = message
+                    if row_id is not None:
+                        self._inflight_rows[info.mid] = row_id
+            if row_id is not None:
+                if qos == 0 or acked:
+                    self._acked_rows.append(row_id)
+                else:
+                    self._sending_rows.add(row_id)
+        if qos == 0 or acked:
+            self._window.release()
+            self.stats['acked'] += qos > 0
+        return True
+
+    def _spool_messages(self, messages: List[Message]) -> None:
+        if messages:
+            self.spool.put_many((topic, payload, f"{qos}:{int(retain)}") for topic, payload, qos, retain in messages)
+            self.stats['spooled'] += len(messages)
+
+    def _drain_spool(self) -> None:
+        self._delete_acked_rows()
+        limit = self.drain.available()
+        if not limit:
+            return
+        with self._inflight_lock:
+            sending = set(self._sending_rows)
+        sent = 0
+        for row_id, topic, payload, meta in self.spool.peek(limit + len(sending)):
+            if row_id in sending:
+                continue
+            qos, retain = meta.split(':')
+            if not self.drain.try_acquire() or \
+                    not self._send((topic, bytes(payload), int(qos), retain == '1'), row_id):
+                break
+            sent += 1
+        self.stats['drained'] += sent
+
+    def _delete_acked_rows(self) -> None:
+        with self._inflight_lock:
+            rows, self._acked_rows = self._acked_rows, []
+        self.spool.delete(rows)
+
+    def _forget_inflight(self) -> List[Message]:
+        # Вызывается под _inflight_lock. Строки с диска остаются там и уйдут заново; возвращает остальные
+        unacked = [message for mid, message in self._inflight.items() if mid not in self._inflight_rows]
+        self._inflight.clear()
+        self._inflight_rows.clear()
+        self._sending_rows.clear()
+        self._early_acks.clear()
+        self._untracked.clear()
+        return unacked
+
+    # --- обратные вызовы клиента (поток сети paho) ---
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None) -> None:
+        if getattr(rc, 'value', rc) == 0:
+            self.stats['connects'] += 1
+            self._connected.set()
+            logger.info(f"Подключено к MQTT брокеру {self.host}:{self.port}")
+        else:
+            logger.warning(f"MQTT брокер отклонил подключение: {rc}")
+
+    def _on_disconnect(self, client, userdata, *args) -> None:
+        # paho 1.x: (rc); paho 2.x: (flags, reason_code, properties)
+        rc = args[0] if len(args) == 1 else args[1]
+        self._connected.clear()
+        self.stats['disconnects'] += 1
+        # Неподтвержденные QoS1 paho хранит у себя и после переподключения отправит сам (с флагом DUP)
+        # с теми же mid: они остаются в окне, а повторная отправка с диска дала бы дубли у брокера
+        logger.warning(f"Потеряно подключение к MQTT брокеру ({rc}), сообщения сохраняются на диск")
+
+    def _on_publish(self, client, userdata, mid, *args) -> None:
+        with self._inflight_lock:
+            if mid in self._untracked:
+                self._untracked.discard(mid)
+                return
+            if self._inflight.pop(mid, None) is None:
+                self._early_acks.add(mid)
+                return
+            row_id = self._inflight_rows.pop(mid, None)
+            if row_id is not None:
+                self._sending_rows.discard(row_id)
+                self._acked_rows.append(row_id)
+        self.stats['acked'] += 1
+        self._window.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        elapsed = max(time.monotonic() - self._started_at, 1e-9)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['inflight'] = len(self._inflight)
+        stats['spool_depth'] = len(self.spool) if self.spool is not None else 0
+        stats['publish_rate'] = stats['published'] / elapsed
+        stats['connected'] = self._connected.is_set()
+        return stats
+
+
+def _encode(payload: Any) -> bytes:
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, str):
+        return payload.encode('utf-8')
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, запас не больше burst."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1.0))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def available(self) -> int:
+        with self._lock:
+            self._refill()
+            return int(self._tokens)
+
+    def delay(self, tokens: float = 1.0) -> float:
+        # Через сколько секунд будет доступно tokens токенов
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate) if self.rate > 0 else float('inf')
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+from array import array
+from collections import deque
+from typing import Dict, Any
+
+
+class RollingWindow:
+    """
+    Статистика по последним size отсчетам за O(1) на отсчет: среднее и дисперсия
+    (Уэлфорд с удалением), min/max (монотонные очереди), наклон регрессии value(t).
+    """
+
+    def __init__(self, size: int, trend_threshold: float = 0.5):
+        self.size = size
+        # Изменение за окно меньше trend_threshold * std считается стабильным
+        self.trend_threshold = trend_threshold
+        self._times = array('d', bytes(8 * size))
+        self._values = array('d', bytes(8 * size))
+        self._index = 0  # сквозной номер следующего отсчета
+        self.count = 0
+        self.mean_t = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0      # сумма квадратов отклонений значения
+        self.m2_t = 0.0    # то же для времени
+        self.c_tv = 0.0    # совместный момент времени и значения
+        self._min = deque()  # (номер, значение), значения возрастают
+        self._max = deque()  # (номер, значение), значения убывают
+
+    def add(self, timestamp: float, value: float) -> None:
+        slot = self._index % self.size
+        if self.count == self.size:
+            self._remove(self._times[slot], self._values[slot])
+        self._times[slot] = timestamp
+        self._values[slot] = value
+
+        n = self.count + 1
+        dt = timestamp - self.mean_t
+        dv = value - self.mean
+        self.mean_t += dt / n
+        self.mean += dv / n
+        self.m2 += dv * (value - self.mean)
+        self.m2_t += dt * (timestamp - self.mean_t)
+        self.c_tv += dt * (value - self.mean)
+        self.count = n
+
+        index = self._index
+        oldest = index - self.size
+        low, high = self._min, self._max
+        while low and low[-1][1] >= value:
+            low.pop()
+        low.append((index, value))
+        if low[0][0] <= oldest:
+            low.popleft()
+        while high and high[-1][1] <= value:
+            high.pop()
+        high.append((index, value))
+        if high[0][0] <= oldest:
+            high.popleft()
+        self._index = index + 1
+
+    def _remove(self, timestamp: float, value: float) -> None:
+        n = self.count - 1
+        if n == 0:
+            self.mean_t = self.mean = self.m2 = self.m2_t = self.c_tv = 0.0
+            self.count = 0
+            return
+        dt = timestamp - self.mean_t
+        dv = value - self.mean
+        self.mean_t -= dt / n
+        self.mean -= dv / n
+        self.m2 -= dv * (value - self.mean)
+        self.m2_t -= dt * (timestamp - self.mean_t)
+        self.c_tv -= dt * (value - self.mean)
+        self.count = n
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(max(self.m2, 0.0) / self.count) if self.count else 0.0
+
+    @property
+    def slope(self) -> float:
+        # Единицы значения в секунду
+        return self.c_tv / self.m2_t if self.m2_t > 1e-12 else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None,
+                    'slope': 0.0, 'trend': 'stable'}
+        std = self.std
+        last = self._times[(self._index - 1) % self.size]
+        first = self._times[(self._index - self.count) % self.size]
+        change = self.slope * (last - first)
+        if abs(change) <= self.trend_threshold * std:
+            trend = 'stable'
+        else:
+            trend = 'increasing' if change > 0 else 'decreasing'
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'std': std,
+            'min': self._min[0][1],
+            'max': self._max[0][1],
+            'slope': self.slope,
+            'trend': trend,
+        }
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import math
+import time
+from collections import deque
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from modules.backup import atomic_write
+
+# Агрегат интервала: [count, sum, min, max, sumsq, alerts]
+COUNT, SUM, MIN, MAX, SUMSQ, ALERTS = range(6)
+EXPORT_COLUMNS = ('data_type', 'start', 'count', 'mean', 'min', 'max', 'std', 'alerts')
+DEFAULT_TIERS = ((300, 288), (3600, 24 * 30), (86400, 730))
+# Смещение местного времени запоминается по получасам: переводы часов приходятся на их границы
+OFFSET_STEP = 1800
+
+
+def new_aggregate() -> List[float]:
+    return [0, 0.0, math.inf, -math.inf, 0.0, 0]
+
+
+def describe(aggregate: List[float]) -> Dict[str, Any]:
+    count = aggregate[COUNT]
+    if not count:
+        return {'count': 0, 'mean': None, 'min': None, 'max': None, 'std': None, 'alerts': aggregate[ALERTS]}
+    mean = aggregate[SUM] / count
+    variance = max(aggregate[SUMSQ] / count - mean * mean, 0.0)
+    return {'count': count, 'mean': mean, 'min': aggregate[MIN], 'max': aggregate[MAX],
+            'std': math.sqrt(variance), 'alerts': aggregate[ALERTS]}
+
+
+class LocalOffset:
+    """Смещение местного времени от UTC на момент ts с учетом перехода на летнее время."""
+
+    __slots__ = ('fixed', 'steps')
+
+    def __init__(self, fixed: Optional[float] = None):
+        self.fixed = fixed
+        self.steps: Dict[int, int] = {}
+
+    def __call__(self, timestamp: float) -> float:
+        if self.fixed is not None:
+            return self.fixed
+        step = int(timestamp // OFFSET_STEP)
+        offset = self.steps.get(step)
+        if offset is None:
+            if len(self.steps) >= 4096:
+                self.steps.clear()
+            offset = self.steps[step] = time.localtime(step * OFFSET_STEP).tm_gmtoff
+        return offset
+
+
+class RollupSeries:
+    """
+    Агрегаты одного ряда по интервалам width секунд; хранится не больше retention интервалов.
+    Интервалы выровнены по местному времени на момент отсчета: сутки - от местной полуночи
+    и в дни перевода часов, а смещение на целые часы не сдвигает часовые интервалы.
+    """
+
+    __slots__ = ('width', 'offset', 'buckets', 'current', 'current_bucket')
+
+    def __init__(self, width: int, retention: int, offset: Callable[[float], float] = LocalOffset(0.0)):
+        self.width = width
+        self.offset = offset
+        self.buckets: deque = deque(maxlen=retention)  # (номер интервала, агрегат) по возрастанию
+        self.current: Optional[List[float]] = None
+        self.current_bucket = -1
+
+    def number(self, timestamp: float, offset: Optional[float] = None) -> int:
+        if offset is None:
+            offset = self.offset(timestamp)
+        return int((timestamp + offset % self.width) // self.width)
+
+    def start(self, bucket: int) -> float:
+        # Смещение берется на начало интервала, а не на его номер в UTC
+        start = bucket * self.width
+        for _ in range(2):
+            start = bucket * self.width - self.offset(start) % self.width
+        return start
+
+    def slot(self, timestamp: float, offset: Optional[float] = None) -> Optional[List[float]]:
+        return self.bucket(self.number(timestamp, offset))
+
+    def bucket(self, bucket: int) -> Optional[List[float]]:
+        if bucket == self.current_bucket:
+            return self.current
+        if bucket > self.current_bucket:
+            self.current = new_aggregate()
+            self.current_bucket = bucket
+            self.buckets.append((bucket, self.current))
+            return self.current
+        # Запоздавший отсчет: ищем его интервал с конца
+        for number, aggregate in reversed(self.buckets):
+            if number == bucket:
+                return aggregate
+            if number < bucket:
+                break
+        return None
+
+    def range(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Tuple[float, List[float]]]:
+        first = -math.inf if start is None else self.number(start)
+        last = math.inf if end is None else self.number(end)
+        for number, aggregate in self.buckets:
+            if first <= number <= last:
+                yield self.start(number), aggregate
+
+
+class RollupStore:
+    """
+    Сводки по рядам, которые ведутся при приеме отсчетов: по каждому ярусу (5 минут,
+    час, сутки) количество, сумма, min, max, сумма квадратов и число алертов.
+    Отчеты и экспорт читают готовые сводки и не перебирают отсчеты.
+    """
+
+    def __init__(self, tiers: Iterable[Tuple[int, int]] = DEFAULT_TIERS, utc_offset: Optional[float] = None):
+        self.tiers = sorted((int(width), int(retention)) for width, retention in tiers)
+        # Границы суток - по местному времени на момент отсчета; utc_offset задает постоянное смещение
+        self.utc_offset = utc_offset
+        self.offset = LocalOffset(utc_offset)
+        self.series: Dict[str, List[RollupSeries]] = {}
+        self.late = 0
+        # Растет при каждом изменении сводок: по нему кэши отчетов понимают, что данные новые
+        self.version = 0
+
+    @classmethod
+    def from_config(cls, options: Dict[str, Any]) -> 'RollupStore':
+        tiers = [(tier['width'], tier['retention']) for tier in options.get('tiers', [])] or DEFAULT_TIERS
+        return cls(tiers)
+
+    def _series(self, key: str) -> List[RollupSeries]:
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [RollupSeries(width, retention, self.offset)
+                                         for width, retention in self.tiers]
+        return series
+
+    def add(self, key: str, timestamp: float, value: float) -> None:
+        self.version += 1
+        offset = self.offset(timestamp)
+        for tier in self.series.get(key) or self._series(key):
+            aggregate = tier.slot(timestamp, offset)
+            if aggregate is None:
+                self.late += 1
+                continue
+            aggregate[COUNT] += 1
+            aggregate[SUM] += value
+            aggregate[SUMSQ] += value * value
+            if value < aggregate[MIN]:
+                aggregate[MIN] = value
+            if value > aggregate[MAX]:
+                aggregate[MAX] = value
+
+    def count_alert(self, key: str, timestamp: float) -> None:
+        self.version += 1
+        for tier in self._series(key):
+            aggregate = tier.slot(timestamp)
+            if aggregate is not None:
+                aggregate[ALERTS] += 1
+
+    def load(self, key: str, times: np.ndarray, values: np.ndarray) -> None:
+        """Сводки по истории (после восстановления) - векторно, по интервалам каждого яруса."""
+        if not len(times):
+            return
+        self.version += 1
+        order = np.argsort(times, kind='stable')
+        times, values = np.asarray(times)[order], np.asarray(values, dtype=np.float64)[order]
+        steps, inverse = np.unique(times // OFFSET_STEP, return_inverse=True)
+        offsets = np.array([self.offset(step * OFFSET_STEP) for step in steps.tolist()], dtype=np.float64)[inverse]
+        for tier in self._series(key):
+            buckets = ((times + offsets % tier.width) // tier.width).astype(np.int64)
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            counts = np.diff(np.r_[starts, len(buckets)])
+            sums = np.add.reduceat(values, starts)
+            sumsq = np.add.reduceat(values * values, starts)
+            mins = np.minimum.reduceat(values, starts)
+            maxs = np.maximum.reduceat(values, starts)
+            for i, bucket in enumerate(buckets[starts].tolist()):
+                if bucket < tier.current_bucket:
+                    continue
+                aggregate = tier.bucket(bucket)
+                aggregate[COUNT] += int(counts[i])
+                aggregate[SUM] += float(sums[i])
+                aggregate[SUMSQ] += float(sumsq[i])
+                aggregate[MIN] = min(aggregate[MIN], float(mins[i]))
+                aggregate[MAX] = max(aggregate[MAX], float(maxs[i]))
+
+    def aligned(self, width: int, timestamp: float) -> bool:
+        """timestamp - начало интервала яруса width."""
+        return (timestamp + self.offset(timestamp) % width) % width == 0
+
+    def tier(self, width: int) -> int:
+        for index, (tier_width, _) in enumerate(self.tiers):
+            if tier_width == width:
+                return index
+        raise ValueError(f"Нет яруса сводок шириной {width} с")
+
+    def query(self, key: str, width: int, start: Optional[float] = None,
+              end: Optional[float] = None) -> List[Tuple[float, Dict[str, Any]]]:
+        series = self.series.get(key)
+        if series is None:
+            return []
+        return [(ts, describe(aggregate)) for ts, aggregate in series[self.tier(width)].range(start, end)]
+
+    def total(self, key: str, width: int, start: float, end: Optional[float] = None) -> Dict[str, Any]:
+        """Сводка за [start, end] из интервалов яруса width, без обращения к отсчетам."""
+        result = new_aggregate()
+        series = self.series.get(key)
+        if series is not None:
+            for _, aggregate in series[self.tier(width)].range(start, end):
+                result[COUNT] += aggregate[COUNT]
+                result[SUM] += aggregate[SUM]
+                result[SUMSQ] += aggregate[SUMSQ]
+                result[MIN] = min(result[MIN], aggregate[MIN])
+                result[MAX] = max(result[MAX], aggregate[MAX])
+                result[ALERTS] += aggregate[ALERTS]
+        return describe(result)
+
+    def snapshot(self, width: int, keys: Optional[Iterable[str]] = None) -> 'RollupStore':
+        """Копия интервалов одного яруса: по ней можно читать, пока прием продолжается."""
+        copy = RollupStore(self.tiers, self.utc_offset)
+        index = self.tier(width)
+        for key in (list(self.series) if keys is None else keys):
+            series = self.series.get(key)
+            if series is not None:
+                copy._series(key)[index].buckets.extend(
+                    (number, list(aggregate)) for number, aggregate in series[index].buckets)
+        return copy
+
+    def iter_rows(self, width: int, keys: Optional[Iterable[str]] = None, start: Optional[float] = None,
+                  end: Optional[float] = None) -> Iterator[Tuple[Any, ...]]:
+        index = self.tier(width)
+        for key in sorted(self.series if keys is None else keys):
+            series = self.series.get(key)
+            if series is None:
+                continue
+            for ts, aggregate in series[index].range(start, end):
+                row = describe(aggregate)
+                yield (key, ts, row['count'], row['mean'], row['min'], row['max'], row['std'], row['alerts'])
+
+    def export(self, path: str, width: int, fmt: str = 'csv', keys: Optional[Iterable[str]] = None,
+               start: Optional[float] = None, end: Optional[float] = None, row_group: int = 10000) -> int:
+        """Пишет сводки построчно (CSV) или группами строк (Parquet) без сборки таблицы в памяти."""
+        rows = self.iter_rows(width, keys, start, end)
+        if fmt == 'csv':
+            return _export_csv(path, rows)
+        if fmt == 'parquet':
+            return _export_parquet(path, rows, row_group)
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+
+def _export_csv(path: str, rows: Iterator[Tuple[Any, ...]]) -> int:
+    written = 0
+    with atomic_write(path) as raw:
+        text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+        text.flush()
+        text.detach()
+    return written
+
+
+def _export_parquet(path: str, rows: Iterator[Tuple[Any, ...]], row_group: int) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для экспорта в Parquet нужен пакет pyarrow")
+    schema = pa.schema([('data_type', pa.string()), ('start', pa.float64()), ('count', pa.int64()),
+                        ('mean', pa.float64()), ('min', pa.float64()), ('max', pa.float64()),
+                        ('std', pa.float64()), ('alerts', pa.int64())])
+    written = 0
+    with atomic_write(path) as raw:
+        with pq.ParquetWriter(raw, schema) as writer:
+            batch: List[Tuple[Any, ...]] = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= row_group:
+                    writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, r)) for r in batch], schema))
+                    written += len(batch)
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, r)) for r in batch], schema))
+                written += len(batch)
+    return written
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import importlib
+import logging
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _enabled(*path: str) -> Callable[[Dict[str, Any]], bool]:
+    def check(config: Dict[str, Any]) -> bool:
+        section = config
+        for key in path:
+            section = section.get(key, {})
+        return bool(section.get('enabled', False))
+    return check
+
+
+# Имя -> (модуль, класс, условие создания). Выключенный в настройках модуль не импортируется
+COMPONENTS: Dict[str, Tuple[str, str, Callable[[Dict[str, Any]], bool]]] = {
+    'mesh': ('modules.mesh_network', 'MeshNetwork', _enabled('mesh')),
+    # Без включенного Modbus точки опроса читаются заглушкой IndustrialProtocols
+    'industrial': ('modules.industrial_protocols', 'IndustrialProtocols',
+                   lambda config: _enabled('industrial')(config) or bool(config.get('polling', {}).get('points'))),
+    'integrations': ('modules.integrations', 'Integrations', _enabled('integrations')),
+    'monitoring': ('modules.monitoring', 'MonitoringAnalytics', _enabled('monitoring')),
+    'business': ('modules.business_integrations', 'BusinessIntegrations', _enabled('business')),
+    'display': ('modules.display', 'EpaperDisplay', _enabled('display', 'epaper')),
+}
+
+
+def is_enabled(config: Dict[str, Any], name: str) -> bool:
+    return COMPONENTS[name][2](config)
+
+
+def create_components(config: Dict[str, Any], names: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Экземпляры включенных модулей из names (по умолчанию - всех) в порядке COMPONENTS."""
+    components = {}
+    for name, (module_name, class_name, _) in COMPONENTS.items():
+        if (names is None or name in names) and is_enabled(config, name):
+            components[name] = getattr(importlib.import_module(module_name), class_name)(config)
+    return components
+
+
+def build_sinks(components: Dict[str, Any], api=None) -> Dict[str, Callable[[Dict[str, Any], Any, float], None]]:
+    """Приемники показаний для PollScheduler: point - описание точки из config['polling']['points']."""
+    def key(point):
+        return point.get('key', point['name'])
+
+    sinks = {}
+    mesh = components.get('mesh')
+    if mesh is not None:
+        sinks['mesh'] = lambda point, value, ts: mesh.send_message(
+            point.get('mesh_protocol', 'lora'), point.get('destination', 'node_sensor_hub'), {key(point): value})
+    integrations = components.get('integrations')
+    if integrations is not None:
+        sinks['mqtt'] = lambda point, value, ts: integrations.publish_mqtt(
+            point.get('topic', f"sensors/{point['name']}"), {key(point): value})
+    monitoring = components.get('monitoring')
+    if monitoring is not None:
+        sinks['monitoring'] = lambda point, value, ts: monitoring.collect_data(point['name'], value, ts)
+    display = components.get('display')
+    if display is not None:
+        sinks['display'] = lambda point, value, ts: display.update(**{key(point): value})
+    if api is not None:
+        sinks['api'] = lambda point, value, ts: api.publish(point['name'], value, ts)
+    return sinks
+
+
+class ServiceStack:
+    """
+    Запущенные модули в порядке запуска. stop_all() останавливает их в обратном
+    порядке; ошибка одного stop() записывается в журнал и не мешает остальным.
+    """
+
+    def __init__(self):
+        self.services: List[Tuple[str, Any]] = []
+
+    def start(self, name: str, service: Any) -> Any:
+        service.start()
+        self.services.append((name, service))
+        return service
+
+    def stop_all(self) -> None:
+        while self.services:
+            name, service = self.services.pop()
+            try:
+                service.stop()
+            except Exception as e:
+                logger.error(f"Ошибка остановки {name}: {e}")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
+
+from modules.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# reader(protocol, points) -> {имя точки: значение}
+Reader = Callable[[str, List[Dict[str, Any]]], Dict[str, Any]]
+# sink(point, value, timestamp)
+Sink = Callable[[Dict[str, Any], Any, float], None]
+
+
+class PollJob:
+    """Группа точек одного протокола с общим интервалом опроса."""
+
+    def __init__(self, name: str, protocol: str, interval: float, deadline: float):
+        self.name = name
+        self.protocol = protocol
+        self.interval = interval
+        self.deadline = deadline
+        self.points: List[Dict[str, Any]] = []
+        self.start = 0.0
+        self.slot = 0
+        self.running = False
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.deadline_misses = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        labels = {'job': name}
+        self.latency = REGISTRY.histogram('mega_agent_poll_seconds', 'Длительность опроса группы', labels)
+        for stat in ('runs', 'errors', 'overruns', 'deadline_misses'):
+            REGISTRY.counter(f'mega_agent_poll_{stat}_total', f"Опрос: {stat}", labels,
+                             function=lambda stat=stat: getattr(self, stat))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'protocol': self.protocol,
+            'interval': self.interval,
+            'deadline': self.deadline,
+            'points': len(self.points),
+            'runs': self.runs,
+            'errors': self.errors,
+            'overruns': self.overruns,
+            'deadline_misses': self.deadline_misses,
+            'last_latency': self.last_latency,
+            'max_latency': self.max_latency,
+            'avg_latency': self.total_latency / self.runs if self.runs else 0.0,
+        }
+
+
+class PollScheduler:
+    """Опрос точек из config['polling'] без дрейфа: слоты start + k * interval."""
+
+    def __init__(self, config: Dict[str, Any], reader: Reader, sinks: Dict[str, Sink]):
+        self.config = config.get('polling', {})
+        self.reader = reader
+        self.sinks = sinks
+        self.max_workers = int(self.config.get('max_workers', 4))
+        self.sink_workers = int(self.config.get('sink_workers', 4))
+        # Сколько вызовов приемников может ждать очереди, лишние отбрасываются
+        self.max_pending_sinks = int(self.config.get('max_pending_sinks', 1000))
+        self.jobs: Dict[str, PollJob] = {}
+        self.sink_stats: Dict[str, Dict[str, float]] = {
+            name: {'calls': 0, 'errors': 0, 'drops': 0, 'max_latency': 0.0} for name in sinks
+        }
+        self.sink_latency = {name: REGISTRY.histogram('mega_agent_sink_seconds', 'Длительность вызова приемника',
+                                                      {'sink': name}) for name in sinks}
+        self._sink_slots = threading.BoundedSemaphore(self.max_pending_sinks)
+        self._sink_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sink_executor: Optional[ThreadPoolExecutor] = None
+        for point in self.config.get('points', []):
+            self.add_point(point)
+
+    def add_point(self, point: Dict[str, Any]) -> None:
+        protocol = point.get('protocol', 'modbus_tcp')
+        interval = float(point.get('interval', 10))
+        deadline = float(point.get('deadline', interval))
+        name = point.get('group') or f"{protocol}@{interval:g}s"
+        job = self.jobs.get(name)
+        if job is None:
+            job = self.jobs[name] = PollJob(name, protocol, interval, deadline)
+        job.points.append(point)
+
+    def start(self) -> None:
+        if not self.jobs:
+            logger.info("Нет точек опроса в конфигурации")
+            return
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='poll')
+        self._sink_executor = ThreadPoolExecutor(self.sink_workers, thread_name_prefix='poll-sink')
+        self._thread = threading.Thread(target=self._dispatch, name='poll-scheduler', daemon=True)
+        self._thread.start()
+        points = sum(len(job.points) for job in self.jobs.values())
+        logger.info(f"Планировщик опроса запущен: {points} точек в {len(self.jobs)} группах")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for executor in (self._executor, self._sink_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._executor = self._sink_executor = None
+        logger.info("Планировщик опроса остановлен")
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._sink_lock:
+            sinks = {name: dict(stats) for name, stats in self.sink_stats.items()}
+        return {
+            'jobs': {name: job.get_stats() for name, job in self.jobs.items()},
+            'sinks': sinks,
+        }
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        heap = []
+        for seq, job in enumerate(self.jobs.values()):
+            job.start, job.slot = now, 0
+            heap.append((now, seq, job))
+        heapq.heapify(heap)
+
+        while not self._stop_event.is_set():
+            due, seq, job = heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+                continue
+            if job.running:
+                # Предыдущий опрос еще идет - слот пропускается
+                job.overruns += 1
+            else:
+                job.running = True
+                self._executor.submit(self._run_job, job, due)
+
+            # Следующий слот считается от старта, а не от конца опроса - без дрейфа
+            job.slot += 1
+            next_due = job.start + job.slot * job.interval
+            now = time.monotonic()
+            if next_due <= now:
+                missed = int((now - next_due) // job.interval) + 1
+                job.overruns += missed
+                job.slot += missed
+                next_due = job.start + job.slot * job.interval
+            heapq.heapreplace(heap, (next_due, seq, job))
+
+    def _run_job(self, job: PollJob, due: float) -> None:
+        started = time.monotonic()
+        try:
+            values = self.reader(job.protocol, job.points)
+        except Exception as e:
+            job.errors += 1
+            values = {}
+            logger.error(f"Ошибка опроса группы {job.name}: {e}")
+        timestamp = time.time()
+        latency = time.monotonic() - started
+        job.runs += 1
+        job.last_latency = latency
+        job.total_latency += latency
+        job.latency.observe(latency)
+        if latency > job.max_latency:
+            job.max_latency = latency
+        if time.monotonic() - due > job.deadline:
+            job.deadline_misses += 1
+        job.running = False
+
+        for point in job.points:
+            value = values.get(point['name'])
+            if value is None:
+                continue
+            for sink_name in point.get('sinks', self.sinks):
+                sink = self.sinks.get(sink_name)
+                if sink is None:
+                    continue
+                if not self._sink_slots.acquire(blocking=False):
+                    with self._sink_lock:
+                        self.sink_stats[sink_name]['drops'] += 1
+                    continue
+                self._sink_executor.submit(self._run_sink, sink_name, sink, point, value, timestamp)
+
+    def _run_sink(self, name: str, sink: Sink, point: Dict[str, Any], value: Any, timestamp: float) -> None:
+        started = time.monotonic()
+        failed = False
+        try:
+            sink(point, value, timestamp)
+        except Exception as e:
+            failed = True
+            logger.error(f"Ошибка приемника {name} для {point['name']}: {e}")
+        finally:
+            self._sink_slots.release()
+        latency = time.monotonic() - started
+        self.sink_latency[name].observe(latency)
+        with self._sink_lock:
+            stats = self.sink_stats[name]
+            stats['calls'] += 1
+            stats['errors'] += failed
+            if latency > stats['max_latency']:
+                stats['max_latency'] = latency
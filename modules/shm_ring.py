@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import struct
+import threading
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional
+
+# Заголовок: метка, емкость кольца, предел рядов, число рядов, последний опубликованный номер
+HEADER = struct.Struct('<4sIIIQ')
+HEAD_OFFSET = 16
+SERIES_OFFSET = 12
+MAGIC = b'MAR1'
+HEADER_SIZE = 64
+# Сохраненные курсоры читателей (по слоту на процесс) в свободной части заголовка; 0 - курсора нет
+CURSOR_OFFSET = HEADER.size
+CURSOR_SLOTS = (HEADER_SIZE - CURSOR_OFFSET) // 8
+# Имя ряда: байт длины + UTF-8
+NAME_SIZE = 64
+# Запись: номер, время, значение, id ряда
+RECORD = struct.Struct('<QddI4x')
+SEQ = struct.Struct('<Q')
+BODY = struct.Struct('<ddI4x')
+
+
+class SampleRing:
+    """
+    Кольцо отсчетов (ряд, время, значение) в multiprocessing.shared_memory: один
+    процесс пишет, любые процессы читают со своим курсором. Записи фиксированного
+    размера, без pickle; ряды передаются номером, имена - в таблице того же блока.
+    Номер записи пишется последним (seqlock): читатель отбрасывает запись,
+    перезаписанную во время чтения, и считает ее потерянной.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, self.capacity, self.max_series, _, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Блок {shm.name} не является кольцом отсчетов")
+        self.records_offset = HEADER_SIZE + self.max_series * NAME_SIZE
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, capacity: int = 16384, max_series: int = 1024, name: Optional[str] = None) -> 'SampleRing':
+        size = HEADER_SIZE + max_series * NAME_SIZE + capacity * RECORD.size
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, capacity, max_series, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SampleRing':
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def head(self) -> int:
+        return SEQ.unpack_from(self.buf, HEAD_OFFSET)[0]
+
+    @property
+    def series_count(self) -> int:
+        return struct.unpack_from('<I', self.buf, SERIES_OFFSET)[0]
+
+    # --- писатель ---
+
+    def series_id(self, name: str) -> int:
+        series = self._ids.get(name)
+        if series is not None:
+            return series
+        encoded = name.encode('utf-8')[:NAME_SIZE - 1]
+        with self._lock:
+            # Ряд мог завести прежний писатель (процесс перезапущен после attach): его номер сохраняется
+            count = self.series_count
+            for series in range(count):
+                offset = HEADER_SIZE + series * NAME_SIZE
+                if bytes(self.buf[offset + 1:offset + 1 + self.buf[offset]]) == encoded:
+                    self._ids[name] = series
+                    return series
+            series = count
+            if series >= self.max_series:
+                raise OverflowError(f"В кольце нет места для ряда {name}")
+            offset = HEADER_SIZE + series * NAME_SIZE
+            self.buf[offset] = len(encoded)
+            self.buf[offset + 1:offset + 1 + len(encoded)] = encoded
+            # Имя видно читателям только после увеличения счетчика
+            struct.pack_into('<I', self.buf, SERIES_OFFSET, series + 1)
+            self._ids[name] = series
+            return series
+
+    def write(self, series: int, timestamp: float, value: float) -> int:
+        buf = self.buf
+        with self._lock:
+            seq = SEQ.unpack_from(buf, HEAD_OFFSET)[0] + 1
+            offset = self.records_offset + (seq % self.capacity) * RECORD.size
+            SEQ.pack_into(buf, offset, 0)
+            BODY.pack_into(buf, offset + 8, timestamp, value, series)
+            SEQ.pack_into(buf, offset, seq)
+            SEQ.pack_into(buf, HEAD_OFFSET, seq)
+        return seq
+
+    def append(self, name: str, timestamp: float, value: float) -> int:
+        return self.write(self.series_id(name), timestamp, value)
+
+    # --- читатели ---
+
+    def series_name(self, series: int) -> Optional[str]:
+        name = self._names.get(series)
+        if name is None and series < self.series_count:
+            offset = HEADER_SIZE + series * NAME_SIZE
+            length = self.buf[offset]
+            name = self._names[series] = bytes(self.buf[offset + 1:offset + 1 + length]).decode('utf-8', 'replace')
+        return name
+
+    def reader(self, from_start: bool = False, slot: Optional[int] = None) -> 'RingReader':
+        """
+        Читатель с текущего конца кольца; from_start - с самой старой сохранившейся записи.
+        С slot курсор хранится в заголовке: новый читатель того же слота продолжает с него.
+        """
+        if slot is not None and not 0 <= slot < CURSOR_SLOTS:
+            raise ValueError(f"Слот курсора должен быть от 0 до {CURSOR_SLOTS - 1}: {slot}")
+        head = self.head
+        cursor = self.saved_cursor(slot) if slot is not None else 0
+        if not cursor:
+            cursor = max(head - self.capacity, 0) if from_start else head
+        return RingReader(self, cursor, slot)
+
+    def saved_cursor(self, slot: int) -> int:
+        return SEQ.unpack_from(self.buf, CURSOR_OFFSET + slot * SEQ.size)[0]
+
+    def close(self) -> None:
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+class RingReader:
+    def __init__(self, ring: SampleRing, cursor: int, slot: Optional[int] = None):
+        self.ring = ring
+        self.cursor = cursor
+        self.lost = 0
+        self.cursor_offset = None if slot is None else CURSOR_OFFSET + slot * SEQ.size
+
+    def pending(self) -> int:
+        return self.ring.head - self.cursor
+
+    def drain(self, handler: Callable[[int, float, float], None], limit: int = 4096) -> int:
+        """Вызывает handler(ряд, время, значение) для новых записей, не больше limit; возвращает их число."""
+        ring = self.ring
+        buf, capacity, base, size = ring.buf, ring.capacity, ring.records_offset, RECORD.size
+        head = ring.head
+        if head - self.cursor > capacity:
+            # Читатель отстал на целый круг: старые записи уже перезаписаны
+            self.lost += head - self.cursor - capacity
+            self.cursor = head - capacity
+        end = min(head, self.cursor + limit)
+        saved = self.cursor_offset
+        count = 0
+        for seq in range(self.cursor + 1, end + 1):
+            offset = base + (seq % capacity) * size
+            first, timestamp, value, series = RECORD.unpack_from(buf, offset)
+            if first != seq or SEQ.unpack_from(buf, offset)[0] != seq:
+                self.lost += 1
+                continue
+            if saved is not None:
+                # Курсор сохраняется до обработки: упавший на записи процесс не получит ее повторно
+                SEQ.pack_into(buf, saved, seq)
+            handler(series, timestamp, value)
+            count += 1
+        self.cursor = end
+        if saved is not None:
+            SEQ.pack_into(buf, saved, end)
+        return count
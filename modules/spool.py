@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DiskQueue:
+    """Очередь FIFO в SQLite: переживает перезапуск, запись пачкой - одна транзакция."""
+
+    def __init__(self, path: str, table: str = 'queue'):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL + synchronous=NORMAL: меньше fsync на SD-карте при сохранении атомарности
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                         f'(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, body BLOB, meta TEXT)')
+        self._db.execute(f'CREATE INDEX IF NOT EXISTS {table}_key ON {table} (key, id)')
+        self._size = self._db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    def put_many(self, items: Iterable[Tuple[str, bytes, str]]) -> int:
+        items = list(items)
+        if not items:
+            return 0
+        with self._lock:
+            with self._db:
+                self._db.execute('BEGIN')
+                self._db.executemany(f'INSERT INTO {self.table} (key, body, meta) VALUES (?, ?, ?)', items)
+            self._size += len(items)
+        return len(items)
+
+    def peek(self, limit: int, key: Optional[str] = None) -> List[Tuple[int, str, bytes, str]]:
+        with self._lock:
+            if key is None:
+                return self._db.execute(f'SELECT id, key, body, meta FROM {self.table} ORDER BY id LIMIT ?',
+                                        (limit,)).fetchall()
+            return self._db.execute(f'SELECT id, key, body, meta FROM {self.table} WHERE key = ? '
+                                    f'ORDER BY id LIMIT ?', (key, limit)).fetchall()
+
+    def counts(self) -> Dict[str, int]:
+        # Сколько записей лежит под каждым ключом (восстановление после перезапуска)
+        with self._lock:
+            return dict(self._db.execute(f'SELECT key, COUNT(*) FROM {self.table} GROUP BY key').fetchall())
+
+    def delete(self, ids: Iterable[Any]) -> None:
+        ids = [(i,) for i in ids]
+        if not ids:
+            return
+        with self._lock:
+            with self._db:
+                self._db.execute('BEGIN')
+                self._db.executemany(f'DELETE FROM {self.table} WHERE id = ?', ids)
+            self._size -= len(ids)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def __len__(self) -> int:
+        return self._size
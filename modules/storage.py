@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Запись фиксированной длины: время, значение, id ряда, маркер целостности
+RECORD = struct.Struct('<ddII')
+RECORD_DTYPE = np.dtype([('ts', '<f8'), ('value', '<f8'), ('series', '<u4'), ('magic', '<u4')])
+RECORD_MAGIC = 0x5345474D  # 'MGES'
+SEGMENT_GLOB = 'seg_*.dat'
+
+
+class Segment:
+    """Файл сегмента и разреженный индекс: (min ts, max ts) на каждые index_interval записей."""
+
+    def __init__(self, path: str, index_interval: int):
+        self.path = path
+        self.index_interval = index_interval
+        self.sealed = False
+        self.index = np.empty((0, 2))
+        self._mmap: Optional[mmap.mmap] = None
+        self._records: Optional[np.ndarray] = None
+
+    @property
+    def index_path(self) -> str:
+        return self.path[:-4] + '.idx'
+
+    def records(self) -> np.ndarray:
+        # Запечатанный сегмент отображается один раз, активный - заново по текущему размеру
+        if self._records is not None:
+            return self._records
+        size = os.path.getsize(self.path) // RECORD.size * RECORD.size
+        if size == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        records = np.frombuffer(mapped, dtype=RECORD_DTYPE)
+        if self.sealed:
+            self._mmap, self._records = mapped, records
+        return records
+
+    def build_index(self, records: np.ndarray) -> None:
+        self.index = self._block_ranges(records['ts'])
+
+    def extend_index(self, first: int) -> None:
+        # После записи пачки пересчитываем блоки начиная с того, где лежит запись first
+        start_block = first // self.index_interval
+        tail = self.records()['ts'][start_block * self.index_interval:]
+        self.index = np.vstack((self.index[:start_block], self._block_ranges(tail)))
+
+    def _block_ranges(self, ts: np.ndarray) -> np.ndarray:
+        k = self.index_interval
+        full = len(ts) // k * k
+        blocks = ts[:full].reshape(-1, k)
+        index = np.column_stack((blocks.min(axis=1), blocks.max(axis=1))) if full else np.empty((0, 2))
+        if full < len(ts):
+            index = np.vstack((index, [[ts[full:].min(), ts[full:].max()]]))
+        return index
+
+    def seal(self) -> None:
+        self.sealed = True
+        self.index.astype('<f8').tofile(self.index_path)
+
+    def load_index(self) -> bool:
+        if not os.path.exists(self.index_path):
+            return False
+        self.index = np.fromfile(self.index_path, dtype='<f8').reshape(-1, 2)
+        return True
+
+    def close(self) -> None:
+        self._records = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # на отображение еще ссылаются выданные массивы
+            self._mmap = None
+
+    def time_range(self) -> Tuple[float, float]:
+        if not len(self.index):
+            return float('inf'), float('-inf')
+        return float(self.index[:, 0].min()), float(self.index[:, 1].max())
+
+
+class SegmentLog:
+    """
+    Журнал отсчетов только на добавление. Записи копятся в памяти и пишутся пачкой
+    с одним fsync (групповая фиксация); сегменты ротируются по размеру.
+    """
+
+    def __init__(self, path: str, segment_size_mb: float = 16, fsync_interval: float = 5.0,
+                 batch_records: int = 4096, index_interval: int = 1024, retention_days: float = 0):
+        self.path = path
+        self.segment_bytes = int(segment_size_mb * 1024 * 1024) // RECORD.size * RECORD.size
+        self.fsync_interval = fsync_interval
+        self.batch_bytes = batch_records * RECORD.size
+        self.index_interval = index_interval
+        self.retention_days = retention_days
+        self.series: Dict[str, int] = {}
+        self.series_names: Dict[int, str] = {}
+        self.segments: List[Segment] = []
+        self._pending = bytearray()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._pack = RECORD.pack
+        self.stats: Dict[str, int] = {'records': 0, 'commits': 0, 'fsyncs': 0, 'segments': 0, 'recovered': 0}
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    # --- открытие и восстановление ---
+
+    def open(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self._load_catalog()
+        for path in sorted(glob.glob(os.path.join(self.path, SEGMENT_GLOB))):
+            segment = Segment(path, self.index_interval)
+            segment.sealed = True
+            self.segments.append(segment)
+        if self.segments:
+            active = self.segments[-1]
+            active.sealed = False
+            self._repair_tail(active)
+            for segment in self.segments[:-1]:
+                if not segment.load_index():
+                    segment.build_index(segment.records())
+                    segment.seal()
+            active.build_index(active.records())
+        else:
+            self._new_segment()
+        self._file = open(self.segments[-1].path, 'ab')
+        self.stats['segments'] = len(self.segments)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='segment-log', daemon=True)
+        self._thread.start()
+        logger.info(f"Журнал мониторинга открыт: {len(self.segments)} сегм., {len(self.series)} рядов")
+
+    def _repair_tail(self, segment: Segment) -> None:
+        # Обрыв питания: недописанная запись или нули в хвосте - обрезаем до последней целой
+        size = os.path.getsize(segment.path)
+        records = segment.records()
+        valid = len(records)
+        if valid:
+            bad = np.flatnonzero(records['magic'] != RECORD_MAGIC)
+            if len(bad):
+                valid = int(bad[0])
+        del records
+        if valid * RECORD.size != size:
+            logger.warning(f"{segment.path}: обрезан поврежденный хвост ({size - valid * RECORD.size} байт)")
+            with open(segment.path, 'r+b') as f:
+                f.truncate(valid * RECORD.size)
+
+    def _load_catalog(self) -> None:
+        catalog = os.path.join(self.path, 'series.log')
+        if not os.path.exists(catalog):
+            return
+        with open(catalog, 'r', encoding='utf-8') as f:
+            for line in f:
+                series_id, _, name = line.rstrip('\n').partition('\t')
+                if name:
+                    self.series[name] = int(series_id)
+                    self.series_names[int(series_id)] = name
+
+    def series_id(self, name: str) -> int:
+        series_id = self.series.get(name)
+        if series_id is None:
+            with self._lock:
+                series_id = self.series.get(name)
+                if series_id is None:
+                    series_id = len(self.series)
+                    with open(os.path.join(self.path, 'series.log'), 'a', encoding='utf-8') as f:
+                        f.write(f"{series_id}\t{name}\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self.series_names[series_id] = name
+                    self.series[name] = series_id
+        return series_id
+
+    def recover(self, max_segments: int = 8) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Последние данные рядов из max_segments новейших сегментов (через mmap, без разбора)."""
+        parts: Dict[int, List[np.ndarray]] = {}
+        for segment in self.segments[-max_segments:]:
+            records = segment.records()
+            if not len(records):
+                continue
+            order = np.argsort(records['series'], kind='stable')
+            ids, starts = np.unique(records['series'][order], return_index=True)
+            bounds = list(starts[1:]) + [len(order)]
+            for series_id, lo, hi in zip(ids.tolist(), starts.tolist(), bounds):
+                parts.setdefault(series_id, []).append(records[order[lo:hi]])
+        result = {}
+        for series_id, chunks in parts.items():
+            name = self.series_names.get(series_id)
+            if name is None:
+                continue
+            records = np.concatenate(chunks)
+            result[name] = (records['ts'].copy(), records['value'].copy())
+            self.stats['recovered'] += len(records)
+        return result
+
+    # --- запись ---
+
+    def append(self, series_id: int, timestamp: float, value: float) -> None:
+        with self._lock:
+            self._pending += self._pack(timestamp, value, series_id, RECORD_MAGIC)
+            self.stats['records'] += 1
+            if len(self._pending) >= self.batch_bytes:
+                self._flush_event.set()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.fsync_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала мониторинга: {e}")
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                data, self._pending = self._pending, bytearray()
+            if not data:
+                return
+            view = memoryview(data)
+            while view:
+                # Пачка делится по границе сегмента, чтобы сегменты были одного размера
+                position = self._file.tell()
+                part = view[:max(self.segment_bytes - position, RECORD.size)]
+                view = view[len(part):]
+                self._file.write(part)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.stats['fsyncs'] += 1
+                self.segments[-1].extend_index(position // RECORD.size)
+                if self._file.tell() >= self.segment_bytes:
+                    self._rotate()
+            self.stats['commits'] += 1
+
+    def _new_segment(self) -> Segment:
+        number = int(os.path.basename(self.segments[-1].path)[4:-4]) + 1 if self.segments else 1
+        segment = Segment(os.path.join(self.path, f"seg_{number:08d}.dat"), self.index_interval)
+        open(segment.path, 'ab').close()
+        self.segments.append(segment)
+        self.stats['segments'] = len(self.segments)
+        return segment
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self.segments[-1].seal()
+        self._new_segment()
+        self._file = open(self.segments[-1].path, 'ab')
+        self._apply_retention()
+
+    def _apply_retention(self) -> None:
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        while len(self.segments) > 1 and self.segments[0].time_range()[1] < cutoff:
+            segment = self.segments.pop(0)
+            segment.close()
+            for path in (segment.path, segment.index_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            logger.info(f"Удален устаревший сегмент {segment.path}")
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for segment in self.segments:
+            segment.close()
+
+    # --- чтение ---
+
+    def query(self, name: str, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Отсчеты ряда в [start, end]; сегменты и блоки вне диапазона не читаются."""
+        series_id = self.series.get(name)
+        if series_id is None:
+            return np.empty(0), np.empty(0)
+        k = self.index_interval
+        chunks = []
+        for segment in list(self.segments):
+            index = segment.index
+            if not len(index):
+                continue
+            hits = np.flatnonzero((index[:, 0] <= end) & (index[:, 1] >= start))
+            if not len(hits):
+                continue
+            records = segment.records()
+            # Соседние подходящие блоки читаются одним срезом
+            runs = np.split(hits, np.flatnonzero(np.diff(hits) > 1) + 1)
+            for run in runs:
+                block = records[run[0] * k:(run[-1] + 1) * k]
+                mask = (block['series'] == series_id) & (block['ts'] >= start) & (block['ts'] <= end)
+                chunks.append(block[mask])
+        with self._lock:
+            pending = np.frombuffer(bytes(self._pending), dtype=RECORD_DTYPE)
+        mask = (pending['series'] == series_id) & (pending['ts'] >= start) & (pending['ts'] <= end)
+        chunks.append(pending[mask])
+        records = np.concatenate(chunks)
+        order = np.argsort(records['ts'], kind='stable')
+        return records['ts'][order], records['value'][order]
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        stats['pending_records'] = len(self._pending) // RECORD.size
+        stats['disk_bytes'] = sum(os.path.getsize(s.path) for s in self.segments if os.path.exists(s.path))
+        return stats
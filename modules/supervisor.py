@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from modules.metrics import REGISTRY, MetricsServer
+from modules.runtime import ServiceStack, build_sinks, create_components, is_enabled
+from modules.shm_ring import RingReader, SampleRing
+
+logger = logging.getLogger(__name__)
+
+# Рабочий процесс -> (модули, приемники точек опроса, которые он обслуживает)
+WORKERS: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    'acquisition': (('industrial', 'mesh'), ('mesh',)),
+    'analytics': (('monitoring',), ('monitoring', 'api')),
+    'publishing': (('integrations', 'business'), ('mqtt',)),
+    'display': (('display',), ('display',)),
+}
+# Приемник-заглушка сбора: отсчет точки пишется в кольцо один раз для всех процессов
+RING_SINK = 'ring'
+
+
+def worker_enabled(config: Dict[str, Any], name: str) -> bool:
+    if name == 'analytics' and config.get('api', {}).get('enabled', False):
+        return True
+    return any(is_enabled(config, component) for component in WORKERS[name][0])
+
+
+def acquisition_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Точки опроса, у которых приемники в других процессах, получают один приемник RING_SINK."""
+    local = WORKERS['acquisition'][1]
+    points = []
+    for point in config.get('polling', {}).get('points', []):
+        sinks = point.get('sinks')
+        remote = sinks is None or any(sink not in local for sink in sinks)
+        sinks = [sink for sink in (local if sinks is None else sinks) if sink in local]
+        points.append(dict(point, sinks=sinks + ([RING_SINK] if remote else [])))
+    return dict(config, polling=dict(config.get('polling', {}), points=points))
+
+
+class SampleDispatcher:
+    """Отсчеты кольца -> локальные приемники процесса; список приемников ряда строится один раз."""
+
+    def __init__(self, ring: SampleRing, config: Dict[str, Any], sinks: Dict[str, Callable]):
+        self.ring = ring
+        self.sinks = sinks
+        self.points = {point['name']: point for point in config.get('polling', {}).get('points', [])}
+        self.routes: Dict[int, List[Tuple[Callable, Dict[str, Any]]]] = {}
+        self.errors = 0
+
+    def __call__(self, series: int, timestamp: float, value: float) -> None:
+        route = self.routes.get(series)
+        if route is None:
+            route = self._route(series)
+        for sink, point in route:
+            try:
+                sink(point, value, timestamp)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка приемника для {point['name']}: {e}")
+
+    def _route(self, series: int) -> List[Tuple[Callable, Dict[str, Any]]]:
+        name = self.ring.series_name(series)
+        if name is None:
+            return []
+        point = self.points.get(name, {'name': name})
+        wanted = point.get('sinks')
+        route = self.routes[series] = [(sink, point) for sink_name, sink in self.sinks.items()
+                                       if wanted is None or sink_name in wanted]
+        return route
+
+
+class ReaderStats:
+    def __init__(self, reader: RingReader, dispatcher: SampleDispatcher):
+        self.reader = reader
+        self.dispatcher = dispatcher
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'cursor': self.reader.cursor, 'pending': self.reader.pending(), 'lost': self.reader.lost,
+                'sink_errors': self.dispatcher.errors}
+
+
+def _stopped(stop_flag, timeout: float) -> bool:
+    """Ожидание флага остановки опросом: в отличие от Event, убитый во время ожидания процесс его не портит."""
+    deadline = time.monotonic() + timeout
+    while not stop_flag.value:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(remaining, 0.1))
+    return True
+
+
+def run_worker(name: str, config: Dict[str, Any], ring_name: str, stop_flag, alerts, metrics_port: int = 0) -> None:
+    """Точка входа рабочего процесса. Завершается по stop_flag; SIGINT получает только супервизор."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s')
+    options = config.get('supervisor', {})
+    ring = SampleRing.attach(ring_name)
+    services = ServiceStack()
+    try:
+        if metrics_port:
+            server = MetricsServer.from_config(dict(config.get('metrics', {}), port=metrics_port))
+            try:
+                services.start('metrics', server)
+            except OSError as e:
+                logger.error(f"Не удалось открыть порт метрик {metrics_port}: {e}")
+        if name == 'acquisition':
+            _run_acquisition(config, ring, services, stop_flag, float(options.get('stats_interval', 60)))
+        else:
+            _run_consumer(name, config, ring, services, stop_flag, alerts,
+                          float(options.get('poll_interval', 0.01)), int(options.get('batch', 4096)))
+    finally:
+        services.stop_all()
+        ring.close()
+
+
+def _run_acquisition(config, ring: SampleRing, services: ServiceStack, stop_flag, stats_interval: float) -> None:
+    from modules.scheduler import PollScheduler
+    config = acquisition_config(config)
+    components = create_components(config, list(WORKERS['acquisition'][0]))
+    for component_name, component in components.items():
+        services.start(component_name, component)
+    sinks = build_sinks(components)
+    sinks[RING_SINK] = lambda point, value, ts: ring.append(point['name'], ts, float(value))
+    industrial = components.get('industrial')
+    reader = industrial.read_many if industrial is not None else (lambda protocol, points: {})
+    scheduler = services.start('scheduler', PollScheduler(config, reader, sinks))
+    while not _stopped(stop_flag, stats_interval):
+        for job_name, stats in scheduler.get_stats()['jobs'].items():
+            logger.info(f"[Опрос] {job_name}: {stats['runs']} опросов, "
+                        f"задержка {stats['avg_latency'] * 1000:.1f} мс, пропусков {stats['overruns']}")
+
+
+def _run_consumer(name: str, config, ring: SampleRing, services: ServiceStack, stop_flag, alerts,
+                  poll_interval: float, batch: int) -> None:
+    components = create_components(config, list(WORKERS[name][0]))
+    api = None
+    if name == 'analytics' and config.get('api', {}).get('enabled', False):
+        from modules.web_api import ApiService
+        api = ApiService(config, components.get('monitoring'))
+    monitoring = components.get('monitoring')
+    if monitoring is not None:
+        # Алерты - редкие сообщения: через очередь процессов в процесс публикации
+        monitoring.set_alert_sender(lambda message, level, channel: _put_alert(alerts, message, level, channel))
+    for component_name, component in components.items():
+        services.start(component_name, component)
+
+    local = WORKERS[name][1]
+    sinks = {sink: call for sink, call in build_sinks(components, api).items() if sink in local}
+    # Курсор процесса хранится в заголовке кольца: перезапущенный процесс продолжает с места падения
+    # и не отдает отсчеты повторно; без сохраненного курсора - с самой старой записи
+    reader = ring.reader(from_start=True, slot=list(WORKERS).index(name))
+    dispatcher = SampleDispatcher(ring, config, sinks)
+    if api is not None:
+        api.add_source('ring', ReaderStats(reader, dispatcher))
+        services.start('api', api)
+    integrations = components.get('integrations') if name == 'publishing' else None
+    REGISTRY.counter('mega_agent_ring_lost_total', 'Отсчеты, перезаписанные до чтения', {'worker': name},
+                     function=lambda: reader.lost)
+
+    while not stop_flag.value:
+        count = reader.drain(dispatcher, batch)
+        if name == 'publishing':
+            _deliver_alerts(alerts, integrations)
+        if count < batch:
+            time.sleep(poll_interval)
+    reader.drain(dispatcher, reader.pending())
+
+
+def _put_alert(alerts, message: str, level: str, channel: str) -> None:
+    try:
+        alerts.put_nowait((message, level, channel))
+    except queue.Full:
+        logger.warning(f"Очередь алертов переполнена, алерт потерян: {message}")
+
+
+def _deliver_alerts(alerts, integrations) -> None:
+    while True:
+        try:
+            message, level, channel = alerts.get_nowait()
+        except queue.Empty:
+            return
+        if integrations is not None:
+            integrations.send_alert(message, level, channel)
+        else:
+            logger.info(f"Алерт [{level.upper()}] ({channel}): {message}")
+
+
+class WorkerState:
+    def __init__(self, name: str):
+        self.name = name
+        self.process: Optional[multiprocessing.Process] = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = 0.0
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    """
+    Многопроцессный режим: сбор (Modbus, mesh), аналитика (мониторинг, веб-API),
+    публикация (MQTT, бизнес-системы) и дисплей работают в отдельных процессах,
+    тяжелый шаг одного не задерживает опрос. Отсчеты идут из процесса сбора
+    через SampleRing в общей памяти. Упавший процесс перезапускается с растущей
+    паузой; остановка - событием, с ожиданием и принудительным завершением
+    зависших процессов.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.options = config.get('supervisor', {})
+        self.context = multiprocessing.get_context(self.options.get('start_method', 'spawn'))
+        self.restart_delay = float(self.options.get('restart_delay', 1.0))
+        self.restart_max_delay = float(self.options.get('restart_max_delay', 60.0))
+        # Проработавший столько секунд процесс считается здоровым: пауза перезапуска сбрасывается
+        self.stable_after = float(self.options.get('stable_after', 60.0))
+        self.shutdown_timeout = float(self.options.get('shutdown_timeout', 30.0))
+        self.workers = {name: WorkerState(name) for name in WORKERS if worker_enabled(config, name)}
+        self.ring: Optional[SampleRing] = None
+        self.metrics: Optional[MetricsServer] = None
+        # Флаг в общей памяти, а не Event: SIGKILL ожидающего процесса оставил бы Event.set() висеть
+        self._stop_flag = self.context.RawValue('b', 0)
+        self._alerts = self.context.Queue(int(self.options.get('alert_queue', 1000)))
+        self._stopping = False
+        self._terminate = False
+        for name, state in self.workers.items():
+            REGISTRY.counter('mega_agent_worker_restarts_total', 'Перезапуски рабочих процессов', {'worker': name},
+                             function=lambda state=state: state.restarts)
+            REGISTRY.gauge('mega_agent_worker_up', 'Рабочий процесс жив', {'worker': name},
+                           function=lambda state=state: state.process is not None and state.process.is_alive())
+
+    def start(self) -> None:
+        self.ring = SampleRing.create(capacity=int(self.options.get('ring_capacity', 16384)),
+                                      max_series=int(self.options.get('max_series', 1024)))
+        REGISTRY.counter('mega_agent_ring_samples_total', 'Отсчеты, записанные в кольцо',
+                         function=lambda: self.ring.head if self.ring is not None and self.ring.buf is not None else 0)
+        metrics = self.config.get('metrics', {})
+        if metrics.get('enabled', False):
+            self.metrics = MetricsServer.from_config(metrics)
+            try:
+                self.metrics.start()
+            except OSError as e:
+                logger.error(f"Не удалось открыть порт метрик: {e}")
+                self.metrics.stop()
+                self.metrics = None
+        self._stop_flag.value = 0
+        for state in self.workers.values():
+            self._spawn(state)
+        logger.info(f"Супервизор запустил процессы: {', '.join(self.workers)}")
+
+    def _metrics_port(self, name: str) -> int:
+        metrics = self.config.get('metrics', {})
+        if not metrics.get('enabled', False):
+            return 0
+        # Каждый процесс отдает свои метрики: порт супервизора + номер процесса
+        return int(metrics.get('port', 9108)) + 1 + list(WORKERS).index(name)
+
+    def _spawn(self, state: WorkerState) -> None:
+        state.process = self.context.Process(
+            target=run_worker, name=f"mega-agent-{state.name}",
+            args=(state.name, self.config, self.ring.name, self._stop_flag, self._alerts,
+                  self._metrics_port(state.name)))
+        state.process.start()
+        state.started = time.monotonic()
+
+    def check(self) -> None:
+        """Перезапуск завершившихся процессов; вызывается периодически из run()."""
+        now = time.monotonic()
+        for state in self.workers.values():
+            process = state.process
+            if self._stopping or process is None or process.is_alive():
+                continue
+            if not state.restart_at:
+                uptime = now - state.started
+                state.backoff = self.restart_delay if uptime >= self.stable_after or not state.backoff \
+                    else min(state.backoff * 2, self.restart_max_delay)
+                state.restart_at = now + state.backoff
+                logger.error(f"Процесс {state.name} завершился с кодом {process.exitcode} "
+                             f"через {uptime:.1f} с, перезапуск через {state.backoff:.1f} с")
+            elif now >= state.restart_at:
+                process.close()
+                state.restart_at = 0.0
+                state.restarts += 1
+                self._spawn(state)
+
+    def stop(self) -> None:
+        if self._stopping:
+            return
+        self._stopping = True
+        logger.info("Остановка рабочих процессов...")
+        self._stop_flag.value = 1
+        deadline = time.monotonic() + self.shutdown_timeout
+        for state in self.workers.values():
+            if state.process is not None:
+                state.process.join(max(deadline - time.monotonic(), 0))
+        for state in self.workers.values():
+            process = state.process
+            if process is not None and process.is_alive():
+                logger.warning(f"Процесс {state.name} не завершился за {self.shutdown_timeout} с, SIGTERM")
+                process.terminate()
+                process.join(5)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+        self._alerts.close()
+        self._alerts.cancel_join_thread()
+        if self.metrics is not None:
+            self.metrics.stop()
+            self.metrics = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+        logger.info("Рабочие процессы остановлены")
+
+    def run(self) -> None:
+        """Запуск и надзор до Ctrl+C или SIGTERM."""
+        # В обработчике сигнала только флаг: события multiprocessing там брать нельзя
+        previous = signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, '_terminate', True))
+        interval = float(self.options.get('check_interval', 0.5))
+        try:
+            self.start()
+            while not self._terminate:
+                time.sleep(interval)
+                self.check()
+        except KeyboardInterrupt:
+            logger.info("Получен сигнал завершения (Ctrl+C).")
+        finally:
+            self.stop()
+            signal.signal(signal.SIGTERM, previous)
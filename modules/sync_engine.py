@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Set, Tuple
+
+from modules.metrics import REGISTRY
+from modules.ratelimit import TokenBucket
+from modules.spool import DiskQueue
+
+logger = logging.getLogger(__name__)
+
+# Временные ошибки: пачку можно повторить с тем же ключом идемпотентности
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def requests_session_factory(name: str, options: Dict[str, Any]):
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    # Соединений в пуле столько же, сколько одновременных запросов к системе
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(options.get('max_concurrency', 2)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    session.headers.update(options.get('headers', {}))
+    if options.get('token'):
+        session.headers['Authorization'] = f"Bearer {options['token']}"
+    return session
+
+
+class SyncTarget:
+    """Внешняя система (CRM/ERP): адрес, сессия, пул отправителей и ограничение частоты."""
+
+    def __init__(self, name: str, options: Dict[str, Any], defaults: Dict[str, Any], session_factory: Callable):
+        self.name = name
+        self.url = options.get('url', '')
+        self.max_concurrency = int(options.get('max_concurrency', defaults.get('max_concurrency', 2)))
+        self.batch_size = int(options.get('batch_size', defaults.get('batch_size', 100)))
+        rate = float(options.get('rate', defaults.get('rate', 5)))
+        self.limiter = TokenBucket(rate, float(options.get('burst', defaults.get('burst', self.max_concurrency))))
+        self.session = session_factory(name, dict(options, max_concurrency=self.max_concurrency))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"sync-{name}")
+        self.active = 0
+        # Итог последних обращений - для BusinessIntegrations.get_system_status
+        self.last_success: Optional[float] = None
+        self.last_failure: Optional[float] = None
+        self.last_error = ''
+        self.last_http_status: Optional[int] = None
+        labels = {'system': name}
+        self.latency = REGISTRY.histogram('mega_agent_sync_request_seconds', 'Длительность запроса к системе', labels,
+                                          buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+        self.records = {'sent': 0, 'rejected': 0, 'failed': 0}
+        for outcome in self.records:
+            REGISTRY.counter('mega_agent_sync_records_total', 'Записи по итогу отправки', dict(labels, outcome=outcome),
+                             function=lambda outcome=outcome: self.records[outcome])
+
+    def endpoint(self, data_type: str) -> str:
+        if '{data_type}' in self.url:
+            return self.url.format(data_type=data_type)
+        return f"{self.url.rstrip('/')}/{data_type}"
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+class SyncEngine:
+    """
+    Пакетная синхронизация с внешними системами. submit() только ставит записи в
+    очередь; фоновый поток складывает их в outbox на диске и собирает пачки по
+    (система, тип данных) - по размеру или по времени ожидания. Пачки уходят
+    параллельно, не больше max_concurrency на систему и с ограничением частоты.
+    Запись удаляется из outbox только после ответа 2xx, поэтому после перезапуска
+    неотправленное досылается.
+    """
+
+    def __init__(self, options: Dict[str, Any], targets: Dict[str, Dict[str, Any]],
+                 session_factory: Optional[Callable] = None):
+        self.options = options
+        self.session_factory = session_factory or requests_session_factory
+        self.target_options = targets
+        self.batch_max_delay = float(options.get('batch_max_delay', 2.0))
+        self.max_retries = int(options.get('max_retries', 5))
+        self.backoff = float(options.get('backoff', 0.5))
+        self.backoff_max = float(options.get('backoff_max', 30.0))
+        self.timeout = float(options.get('timeout', 10.0))
+        self.outbox_path = options.get('outbox_path', './sync_outbox/outbox.db')
+        self._queue: queue.Queue = queue.Queue(maxsize=int(options.get('queue_size', 10000)))
+        self.targets: Dict[str, SyncTarget] = {}
+        self.outbox: Optional[DiskQueue] = None
+        self.dead: Optional[DiskQueue] = None
+        # Состояние пачек по ключу "система\tтип": ждут отправки, в полете, когда копить начали
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._inflight: Dict[str, Set[int]] = defaultdict(set)
+        self._first: Dict[str, float] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._force = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {
+            'submitted': 0, 'dropped': 0, 'stored': 0, 'batches': 0, 'sent': 0,
+            'retries': 0, 'failed_batches': 0, 'rejected': 0,
+        }
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.outbox = DiskQueue(self.outbox_path, table='outbox')
+        self.dead = DiskQueue(self.outbox_path, table='dead')
+        for name, target_options in self.target_options.items():
+            self.targets[name] = SyncTarget(name, target_options, self.options, self.session_factory)
+        # Оставшееся с прошлого запуска отправляется сразу, не дожидаясь новых записей
+        for key, count in self.outbox.counts().items():
+            if key.split('\t', 1)[0] in self.targets:
+                self._pending[key] = count
+                self._first[key] = float('-inf')
+        if len(self.outbox):
+            logger.info(f"В outbox синхронизации {len(self.outbox)} записей с прошлого запуска")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sync-engine', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        for target in self.targets.values():
+            target.close()
+        self.targets.clear()
+        self.outbox.close()
+        self.dead.close()
+
+    # --- горячий путь вызывающего ---
+
+    def submit(self, system: str, data_type: str, data: Any) -> bool:
+        if system not in self.target_options:
+            logger.warning(f"Синхронизация с неизвестной системой {system}")
+            return False
+        records = data if isinstance(data, list) else [data]
+        try:
+            self._queue.put_nowait((system, data_type, records))
+        except queue.Full:
+            self.stats['dropped'] += len(records)
+            return False
+        self.stats['submitted'] += len(records)
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Отправить все накопленное, не дожидаясь заполнения пачек; True, если outbox опустел."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self._force.set()
+            with self._lock:
+                idle = (self._queue.unfinished_tasks == 0 and not any(self._pending.values())
+                        and not any(self._inflight.values()))
+            if idle:
+                return True
+            time.sleep(0.01)
+        return False
+
+    # --- фоновый поток ---
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self._collect(timeout=0.05)
+            force = self._force.is_set()
+            self._force.clear()
+            self._dispatch(force)
+        # При остановке очередь в памяти переносится в outbox целиком, а не одной пачкой
+        while self._collect(timeout=0):
+            pass
+
+    def _collect(self, timeout: float) -> bool:
+        # Все, что накопилось в очереди, пишется в outbox одной транзакцией; False - очередь пуста
+        try:
+            items = [self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()]
+        except queue.Empty:
+            return False
+        while len(items) < 1000:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        rows = []
+        added: Dict[str, int] = defaultdict(int)
+        for system, data_type, records in items:
+            key = f"{system}\t{data_type}"
+            for record in records:
+                rows.append((key, json.dumps(record, ensure_ascii=False, default=str).encode('utf-8'),
+                             uuid.uuid4().hex))
+            added[key] += len(records)
+        try:
+            self.stats['stored'] += self.outbox.put_many(rows)
+            now = time.monotonic()
+            with self._lock:
+                for key, count in added.items():
+                    self._pending[key] += count
+                    self._first.setdefault(key, now)
+        except Exception as e:
+            logger.error(f"Ошибка записи в outbox синхронизации: {e}")
+            self.stats['dropped'] += len(rows)
+        finally:
+            for _ in items:
+                self._queue.task_done()
+        return True
+
+    def _dispatch(self, force: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in list(self._pending):
+                system, data_type = key.split('\t', 1)
+                target = self.targets.get(system)
+                if target is None or now < self._retry_at.get(key, 0):
+                    continue
+                while self._pending[key] > 0 and target.active < target.max_concurrency:
+                    due = (force or self._pending[key] >= target.batch_size
+                           or now - self._first.get(key, now) >= self.batch_max_delay)
+                    if not due:
+                        break
+                    inflight = self._inflight[key]
+                    rows = [row for row in self.outbox.peek(target.batch_size + len(inflight), key)
+                            if row[0] not in inflight][:target.batch_size]
+                    if not rows:
+                        self._pending[key] = 0
+                        break
+                    inflight.update(row[0] for row in rows)
+                    self._pending[key] -= len(rows)
+                    self._first[key] = now
+                    target.active += 1
+                    target.executor.submit(self._send, target, key, data_type, rows)
+                if self._pending[key] <= 0:
+                    self._first.pop(key, None)
+
+    def _send(self, target: SyncTarget, key: str, data_type: str, rows: List[Tuple[int, str, bytes, str]]) -> None:
+        ids = [row[0] for row in rows]
+        outcome = 'failed'
+        try:
+            body = b''.join([b'{"system":', json.dumps(target.name).encode(), b',"data_type":',
+                             json.dumps(data_type).encode(), b',"records":[',
+                             b','.join(b'{"id":"%s","data":%s}' % (meta.encode(), payload)
+                                       for _, _, payload, meta in rows),
+                             b']}'])
+            # Один и тот же ключ при повторах: система может отбросить дубликат пачки
+            idempotency_key = hashlib.sha256(''.join(row[3] for row in rows).encode()).hexdigest()
+            outcome = self._post(target, target.endpoint(data_type), body, idempotency_key)
+            if outcome == 'sent':
+                self.outbox.delete(ids)
+                self.stats['batches'] += 1
+                self.stats['sent'] += len(rows)
+            elif outcome == 'rejected':
+                self.dead.put_many(row[1:] for row in rows)
+                self.outbox.delete(ids)
+                self.stats['rejected'] += len(rows)
+        except Exception as e:
+            logger.error(f"Ошибка синхронизации с {target.name}: {e}")
+            target.last_error = str(e)
+            outcome = 'failed'
+        finally:
+            with self._lock:
+                self._inflight[key].difference_update(ids)
+                target.active -= 1
+                target.records[outcome] += len(rows)
+                if outcome == 'failed':
+                    target.last_failure = time.time()
+                    # Записи остаются в outbox; следующая попытка - после паузы
+                    self.stats['failed_batches'] += 1
+                    self._pending[key] += len(rows)
+                    self._first.setdefault(key, time.monotonic())
+                    self._retry_at[key] = time.monotonic() + self.backoff_max
+
+    def _post(self, target: SyncTarget, url: str, body: bytes, idempotency_key: str) -> str:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats['retries'] += 1
+            if not self._acquire(target):
+                return 'failed'
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = target.session.post(url, data=body, timeout=self.timeout,
+                                               headers={'Idempotency-Key': idempotency_key})
+                target.latency.observe(time.perf_counter() - started)
+                status = target.last_http_status = response.status_code
+                if 200 <= status < 300:
+                    target.last_success = time.time()
+                    return 'sent'
+                target.last_error = f"HTTP {status}"
+                if status not in RETRY_STATUSES:
+                    logger.error(f"{target.name} отклонил пачку: HTTP {status}")
+                    return 'rejected'
+                retry_after = _retry_after(response.headers.get('Retry-After'))
+                logger.warning(f"{target.name}: HTTP {status}, попытка {attempt + 1}")
+            except Exception as e:
+                target.latency.observe(time.perf_counter() - started)
+                target.last_error = str(e)
+                logger.warning(f"{target.name}: {e}, попытка {attempt + 1}")
+            if attempt == self.max_retries:
+                break
+            # Retry-After сервера тоже не больше backoff_max: один ответ не держит поток отправки часами
+            delay = min(retry_after, self.backoff_max) if retry_after is not None else \
+                min(self.backoff_max, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            if self._stop_event.wait(delay):
+                break
+        return 'failed'
+
+    def _acquire(self, target: SyncTarget) -> bool:
+        while not target.limiter.try_acquire():
+            if self._stop_event.wait(max(target.limiter.delay(), 0.001)):
+                return False
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['outbox_depth'] = len(self.outbox) if self.outbox is not None else 0
+        stats['dead_letters'] = len(self.dead) if self.dead is not None else 0
+        stats['active'] = {name: target.active for name, target in self.targets.items()}
+        return stats
+
+    def target_status(self, name: str) -> Optional[Dict[str, Any]]:
+        """Состояние обмена с одной системой; None, если она не запущена."""
+        target = self.targets.get(name)
+        if target is None:
+            return None
+        outbox = sum(count for key, count in self.outbox.counts().items() if key.split('\t', 1)[0] == name)
+        if target.last_failure is not None and (target.last_success is None
+                                                or target.last_failure > target.last_success):
+            status = 'degraded'
+        else:
+            status = 'ok' if target.last_success is not None else 'idle'
+        return {
+            'status': status,
+            'url': target.url,
+            'active_requests': target.active,
+            'outbox': outbox,
+            'sent': target.records['sent'],
+            'rejected': target.records['rejected'],
+            'failed': target.records['failed'],
+            'last_success': target.last_success,
+            'last_failure': target.last_failure,
+            'last_error': target.last_error,
+            'last_http_status': target.last_http_status,
+            'request_p95': target.latency.quantile(0.95),
+        }
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
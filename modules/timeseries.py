@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from array import array
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Байт на отсчет: время и значение по 8 байт, каждое хранится дважды (см. RingBuffer)
+BYTES_PER_SAMPLE = 32
+
+
+class RingBuffer:
+    """
+    Кольцевой буфер (время, значение) фиксированной емкости. Каждый отсчет пишется
+    в позиции i и i + capacity, поэтому любые последние n <= capacity отсчетов лежат
+    в памяти подряд и окно отдается как view numpy без копирования.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._times = array('d', bytes(16 * capacity))
+        self._values = array('d', bytes(16 * capacity))
+        self._times_view = np.frombuffer(self._times, dtype=np.float64)
+        self._values_view = np.frombuffer(self._values, dtype=np.float64)
+        self._times_view.flags.writeable = False
+        self._values_view.flags.writeable = False
+        self._head = 0
+        self.count = 0
+        self.total = 0
+
+    def append(self, timestamp: float, value: float) -> None:
+        i = self._head
+        j = i + self.capacity
+        self._times[i] = self._times[j] = timestamp
+        self._values[i] = self._values[j] = value
+        self._head = i + 1 if i + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+        self.total += 1
+
+    def extend(self, times: np.ndarray, values: np.ndarray) -> None:
+        # Пакетная загрузка (восстановление с диска): в буфер попадают последние capacity отсчетов
+        total = len(times)
+        times, values = times[-self.capacity:], values[-self.capacity:]
+        k = len(times)
+        positions = (self._head + np.arange(k)) % self.capacity
+        for target, source in ((self._times, times), (self._values, values)):
+            view = np.frombuffer(target, dtype=np.float64)
+            view[positions] = source
+            view[positions + self.capacity] = source
+        self._head = int((self._head + k) % self.capacity)
+        self.count = min(self.count + k, self.capacity)
+        self.total += total
+
+    def window(self, n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Последние n отсчетов (все, если n не задан): (времена, значения) без копирования."""
+        n = self.count if n is None else max(0, min(n, self.count))
+        end = self._head + self.capacity
+        return self._times_view[end - n:end], self._values_view[end - n:end]
+
+    def since(self, start: float, end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # Время отсчетов растет, поэтому границы ищутся бинарным поиском
+        times, values = self.window()
+        lo = int(np.searchsorted(times, start, side='left'))
+        hi = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+        return times[lo:hi], values[lo:hi]
+
+    def latest(self) -> Optional[Tuple[float, float]]:
+        if not self.count:
+            return None
+        i = self._head - 1 if self._head else self.capacity - 1
+        return self._times[i], self._values[i]
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class TimeSeriesStore:
+    """Набор кольцевых буферов по data_type с общим ограничением памяти."""
+
+    def __init__(self, retention_samples: int = 8640, memory_limit_mb: float = 64,
+                 min_samples: int = 1024):
+        self.retention_samples = retention_samples
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.min_samples = min(min_samples, retention_samples)
+        self._series: Dict[str, RingBuffer] = {}
+        self._allocated = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def append(self, data_type: str, timestamp: float, value: float) -> bool:
+        with self._lock:
+            buffer = self._series.get(data_type)
+            if buffer is None:
+                buffer = self._create(data_type)
+                if buffer is None:
+                    self.dropped += 1
+                    return False
+            buffer.append(timestamp, value)
+        return True
+
+    def extend(self, data_type: str, times: np.ndarray, values: np.ndarray) -> bool:
+        with self._lock:
+            buffer = self._series.get(data_type)
+            if buffer is None:
+                buffer = self._create(data_type)
+                if buffer is None:
+                    self.dropped += len(times)
+                    return False
+            buffer.extend(times, values)
+        return True
+
+    def _create(self, data_type: str) -> Optional[RingBuffer]:
+        free = (self.memory_limit - self._allocated) // BYTES_PER_SAMPLE
+        capacity = min(self.retention_samples, free)
+        if capacity < self.min_samples:
+            if self.dropped == 0:
+                logger.warning(f"Лимит памяти хранилища исчерпан, ряд {data_type} не сохраняется")
+            return None
+        if capacity < self.retention_samples:
+            logger.warning(f"Ряд {data_type}: глубина хранения урезана до {capacity} отсчетов по лимиту памяти")
+        buffer = self._series[data_type] = RingBuffer(capacity)
+        self._allocated += capacity * BYTES_PER_SAMPLE
+        return buffer
+
+    def window(self, data_type: str, n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            buffer = self._series.get(data_type)
+            if buffer is None:
+                return np.empty(0), np.empty(0)
+            return buffer.window(n)
+
+    def since(self, data_type: str, start: float, end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            buffer = self._series.get(data_type)
+            if buffer is None:
+                return np.empty(0), np.empty(0)
+            return buffer.since(start, end)
+
+    def memory_usage(self) -> int:
+        return self._allocated
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'series': len(self._series),
+                'samples': sum(len(b) for b in self._series.values()),
+                'memory_bytes': self._allocated,
+                'memory_limit_bytes': self.memory_limit,
+                'dropped': self.dropped,
+            }
+
+    def __getitem__(self, data_type: str) -> RingBuffer:
+        return self._series[data_type]
+
+    def __contains__(self, data_type: str) -> bool:
+        return data_type in self._series
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._series))
+
+    def __len__(self) -> int:
+        return len(self._series)
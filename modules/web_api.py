@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import Dict, Any, Callable, Hashable, Optional, Tuple
+
+from modules.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = {status: REGISTRY.counter('mega_agent_api_responses_total', 'Ответы API', {'status': status})
+            for status in ('200', '304', '503')}
+SNAPSHOT_BUILDS = REGISTRY.counter('mega_agent_api_snapshot_builds_total', 'Пересборки снимков API')
+
+
+def dumps(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, default=str, separators=(',', ':')).encode('utf-8')
+
+
+class Snapshot:
+    """
+    Готовое тело ответа ресурса. Запрос только читает ссылку на (тело, ETag);
+    пересборка - когда сменилась версия данных и прошло не меньше min_interval
+    с прошлой сборки. ETag - хеш содержимого: одинаковый результат сохраняет его.
+    """
+
+    def __init__(self, build: Callable[[], Any], version: Callable[[], Hashable], min_interval: float = 0.0):
+        self.build = build
+        self.version = version
+        self.min_interval = min_interval
+        self._current: Optional[Tuple[bytes, str]] = None
+        self._version: Any = None
+        self._built = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Tuple[bytes, str]:
+        version = self.version()
+        if self._current is None or (version != self._version
+                                     and time.monotonic() - self._built >= self.min_interval):
+            # Один сборщик на ресурс: остальные запросы ждут его результат, а не собирают свой
+            with self._lock:
+                if self._current is None or (version != self._version
+                                             and time.monotonic() - self._built >= self.min_interval):
+                    try:
+                        body = dumps(self.build())
+                        self._current = (body, '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest())
+                        SNAPSHOT_BUILDS.inc()
+                    except Exception as e:
+                        if self._current is None:
+                            raise
+                        logger.error(f"Ошибка сборки снимка API, отдается прежний: {e}")
+                    self._version = version
+                    self._built = time.monotonic()
+        return self._current
+
+
+class EventStream:
+    """
+    Рассылка server-sent events. Событие превращается в байты один раз при
+    публикации и кладется в общий кольцевой буфер; клиенты отдают из него те же
+    объекты bytes. Отставший больше чем на history событий клиент пропускает
+    старые. Клиенту с Last-Event-ID досылается то, что еще есть в буфере.
+    """
+
+    def __init__(self, history: int = 256, keepalive: float = 15.0, max_clients: int = 32):
+        self.keepalive = keepalive
+        self.max_clients = max_clients
+        self.seq = 0
+        self.clients = 0
+        self._ring: deque = deque(maxlen=history)
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def publish(self, event: str, data: Any) -> int:
+        data = dumps(data)
+        with self._cond:
+            self.seq += 1
+            self._ring.append(b'id: %d\nevent: %s\ndata: %s\n\n' % (self.seq, event.encode(), data))
+            self._cond.notify_all()
+            return self.seq
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def subscribe(self, last_id: Optional[int] = None) -> Optional['Subscription']:
+        """Итератор частей потока; None, если клиентов уже max_clients."""
+        with self._cond:
+            if self.clients >= self.max_clients or self._closed:
+                return None
+            self.clients += 1
+            cursor = self.seq if last_id is None else min(max(int(last_id), 0), self.seq)
+        return Subscription(self, cursor)
+
+    def next_chunk(self, cursor: int) -> Tuple[Optional[bytes], int]:
+        """Ждет новых событий до keepalive; (часть потока, новый курсор), None - поток закрыт."""
+        with self._cond:
+            if self.seq == cursor and not self._closed:
+                self._cond.wait(self.keepalive)
+            if self._closed:
+                return None, cursor
+            missed = self.seq - cursor
+            if not missed:
+                return b': ping\n\n', cursor
+            ring = self._ring
+            if missed == 1:
+                return ring[-1], self.seq
+            return b''.join(islice(ring, max(len(ring) - missed, 0), None)), self.seq
+
+    def release(self) -> None:
+        with self._cond:
+            self.clients -= 1
+
+
+class Subscription:
+    """Поток одного клиента: только курсор в общем буфере. close() вызывает WSGI-сервер."""
+
+    def __init__(self, stream: EventStream, cursor: int):
+        self.stream = stream
+        self.cursor = cursor
+        self._started = False
+        self._closed = False
+
+    def __iter__(self) -> 'Subscription':
+        return self
+
+    def __next__(self) -> bytes:
+        if not self._started:
+            self._started = True
+            return b'retry: 3000\n\n'
+        chunk, self.cursor = self.stream.next_chunk(self.cursor)
+        if chunk is None:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.stream.release()
+
+
+class ApiService:
+    """
+    Веб-дашборд и API на Flask. Приемник опроса publish() только кладет показание
+    в очередь и возвращается: свертка, сериализация и рассылка идут в отдельном
+    потоке раз в stream_interval. Запросы читают готовые снимки и не обращаются к
+    модулям чаще, чем меняются данные (stats - не чаще stats_interval, отчет - не
+    чаще report_interval).
+    """
+
+    def __init__(self, config: Dict[str, Any], monitoring=None, sources: Optional[Dict[str, Any]] = None):
+        self.config = config.get('api', {})
+        self.enabled = self.config.get('enabled', False)
+        self.host = self.config.get('host', '0.0.0.0')
+        self.port = int(self.config.get('port', 5000))
+        self.stream_interval = float(self.config.get('stream_interval', 0.5))
+        self.stats_interval = float(self.config.get('stats_interval', 5))
+        self.report_interval = float(self.config.get('report_interval', 60))
+        self.monitoring = monitoring
+        # Модули с get_stats(): имя раздела /api/stats -> модуль
+        self.sources: Dict[str, Any] = dict(sources or {})
+        self.stream = EventStream(history=int(self.config.get('history', 256)),
+                                  keepalive=float(self.config.get('keepalive', 15)),
+                                  max_clients=int(self.config.get('max_clients', 32)))
+        self.version = 0
+        self.latest: Dict[str, Dict[str, Any]] = {}
+        self._incoming: deque = deque(maxlen=int(self.config.get('max_pending', 10000)))
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server = None
+        self._server_thread: Optional[threading.Thread] = None
+        self.readings = Snapshot(lambda: {'version': self.version, 'readings': dict(self.latest)},
+                                 lambda: self.version)
+        self.stats = Snapshot(self._collect_stats, lambda: int(time.monotonic() // self.stats_interval))
+        self._reports: Dict[str, Snapshot] = {}
+        REGISTRY.gauge('mega_agent_api_stream_clients', 'Подключенные SSE клиенты',
+                       function=lambda: self.stream.clients)
+        logger.info("Инициализирован модуль ApiService")
+
+    def add_source(self, name: str, module: Any) -> None:
+        self.sources[name] = module
+
+    def start(self) -> None:
+        if not self.enabled:
+            logger.info("Веб-API отключен")
+            return
+        from werkzeug.serving import make_server
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._pump, name='api-stream', daemon=True)
+        self._thread.start()
+        self._server = make_server(self.host, self.port, self.create_app(), threaded=True)
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name='api-http', daemon=True)
+        self._server_thread.start()
+        logger.info(f"Веб-API запущен на http://{self.host}:{self._server.server_port}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wakeup.set()
+        self.stream.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server_thread.join()
+            self._server = self._server_thread = None
+            logger.info("Веб-API остановлен")
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return (self.host, self._server.server_port if self._server is not None else self.port)
+
+    # --- приемник опроса ---
+
+    def publish(self, name: str, value: Any, timestamp: float) -> None:
+        self._incoming.append((name, value, timestamp))
+        self._wakeup.set()
+
+    def _pump(self) -> None:
+        while not self._stop_event.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+            # Показания за stream_interval уходят одним событием
+            self._stop_event.wait(self.stream_interval)
+
+    def flush(self) -> int:
+        """Свернуть накопленные показания в снимок и одно событие потока; число обновленных ключей."""
+        changed: Dict[str, Dict[str, Any]] = {}
+        incoming = self._incoming
+        while incoming:
+            name, value, timestamp = incoming.popleft()
+            changed[name] = {'value': value, 'ts': timestamp}
+        if changed:
+            self.latest.update(changed)
+            self.version += 1
+            self.stream.publish('readings', changed)
+        return len(changed)
+
+    # --- снимки ---
+
+    def _collect_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {'timestamp': time.time()}
+        for name, module in self.sources.items():
+            try:
+                stats[name] = module.get_stats()
+            except Exception as e:
+                stats[name] = {'error': str(e)}
+        return stats
+
+    def report(self, date: Optional[str] = None) -> Snapshot:
+        date = date or self.monitoring.report_date()
+        snapshot = self._reports.get(date)
+        if snapshot is None:
+            if len(self._reports) >= 8:
+                self._reports.pop(next(iter(self._reports)))
+            snapshot = self._reports[date] = Snapshot(lambda: self.monitoring.get_daily_report(date),
+                                                      lambda: self.monitoring.data_version, self.report_interval)
+        return snapshot
+
+    # --- HTTP ---
+
+    def create_app(self):
+        from flask import Flask, Response, request
+
+        app = Flask(__name__)
+
+        def send(snapshot: Snapshot):
+            try:
+                body, etag = snapshot.get()
+            except Exception as e:
+                logger.error(f"Ресурс API недоступен: {e}")
+                REQUESTS['503'].inc()
+                return Response(dumps({'error': str(e)}), 503, mimetype='application/json')
+            headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+            if etag in request.headers.get('If-None-Match', ''):
+                REQUESTS['304'].inc()
+                return Response(status=304, headers=headers)
+            REQUESTS['200'].inc()
+            return Response(body, mimetype='application/json', headers=headers)
+
+        @app.route('/')
+        def dashboard():
+            return Response(DASHBOARD, mimetype='text/html')
+
+        @app.route('/api')
+        def index():
+            return {'endpoints': ['/api/readings', '/api/stats', '/api/report?date=YYYY-MM-DD', '/api/stream']}
+
+        @app.route('/api/readings')
+        def readings():
+            return send(self.readings)
+
+        @app.route('/api/stats')
+        def stats():
+            return send(self.stats)
+
+        @app.route('/api/report')
+        def report():
+            if self.monitoring is None:
+                return Response(dumps({'error': 'monitoring disabled'}), 404, mimetype='application/json')
+            date = request.args.get('date')
+            try:
+                if date:
+                    time.strptime(date, '%Y-%m-%d')
+            except ValueError:
+                return Response(dumps({'error': 'date must be YYYY-MM-DD'}), 400, mimetype='application/json')
+            return send(self.report(date))
+
+        @app.route('/api/stream')
+        def stream():
+            last_id = request.headers.get('Last-Event-ID')
+            events = self.stream.subscribe(int(last_id) if last_id and last_id.isdigit() else None)
+            if events is None:
+                REQUESTS['503'].inc()
+                return Response(dumps({'error': 'too many clients'}), 503, mimetype='application/json')
+            return Response(events, mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        return app
+
+
+DASHBOARD = """<!doctype html>
+<html lang="ru"><head><meta charset="utf-8"><title>Mega-Agent</title>
+<style>body{font-family:sans-serif;margin:2em}td{padding:2px 12px}</style></head>
+<body><h1>Mega-Agent</h1><table id="readings"></table>
+<script>
+const rows = {};
+function show(readings) {
+  for (const [name, r] of Object.entries(readings)) {
+    let row = rows[name];
+    if (!row) {
+      row = rows[name] = document.getElementById('readings').insertRow();
+      row.insertCell().textContent = name;
+      row.insertCell();
+      row.insertCell();
+    }
+    row.cells[1].textContent = typeof r.value === 'number' ? r.value.toFixed(2) : r.value;
+    row.cells[2].textContent = new Date(r.ts * 1000).toLocaleTimeString();
+  }
+}
+fetch('/api/readings').then(r => r.json()).then(d => show(d.readings));
+new EventSource('/api/stream').addEventListener('readings', e => show(JSON.parse(e.data)));
+</script></body></html>
+"""
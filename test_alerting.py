@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты правил алертов, дедупликации и ограничения частоты
+"""
+
+import time
+
+import pytest
+
+from modules.alerting import AlertNotifier, RuleEngine
+from modules.monitoring import MonitoringAnalytics
+
+
+def states(alerts):
+    return [(alert.rule, alert.firing) for alert in alerts]
+
+
+def test_threshold_with_hysteresis():
+    engine = RuleEngine([{'name': 'hot', 'data_type': 'temp', 'type': 'threshold',
+                          'above': 35, 'clear_below': 33, 'below': 5}])
+    fired = []
+    for ts, value in enumerate([30, 36, 37, 34, 32.5, 36, 20, 4]):
+        fired += [(ts, firing) for _, firing in states(engine.evaluate('temp', ts, value))]
+    assert fired == [(1, True), (4, False), (5, True), (6, False), (7, True)]
+    assert engine.active() == ['hot']
+    assert engine.evaluate('humidity', 0, 100) == []
+
+
+def test_rate_and_stale_rules():
+    engine = RuleEngine([{'name': 'jump', 'data_type': 'temp', 'type': 'rate', 'max_rate': 0.5},
+                         {'name': 'silent', 'data_type': 'temp', 'type': 'stale', 'max_age': 30}],
+                        stale_check_interval=1000)
+    assert engine.evaluate('temp', 0, 20.0) == []
+    assert engine.evaluate('temp', 10, 22.0) == []
+    assert states(engine.evaluate('temp', 12, 30.0)) == [('jump', True)]
+    assert states(engine.evaluate('temp', 22, 30.5)) == [('jump', False)]
+    assert engine.check_stale(40) == []
+    alerts = engine.check_stale(60)
+    assert states(alerts) == [('silent', True)] and alerts[0].value is None
+    assert engine.check_stale(70) == []
+    assert states(engine.evaluate('temp', 71, 30.5)) == [('silent', False)]
+
+
+def test_pattern_rules_bind_on_first_sample():
+    engine = RuleEngine([{'data_type': 'temperature_*', 'type': 'threshold', 'above': 30}])
+    assert engine.rule_count == 0
+    assert states(engine.evaluate('temperature_kitchen', 0, 31)) == [('threshold:temperature_kitchen', True)]
+    assert states(engine.evaluate('temperature_hall', 0, 31)) == [('threshold:temperature_hall', True)]
+    assert engine.evaluate('humidity_hall', 0, 99) == []
+    assert engine.rule_count == 2
+    with pytest.raises(ValueError):
+        RuleEngine([{'data_type': 'x', 'type': 'magic'}])
+
+
+def test_notifier_deduplicates_groups_and_limits_storm():
+    sent = []
+    notifier = AlertNotifier(lambda message, level, channel: sent.append((message, level, channel)),
+                             {'telegram': {'rate': 0.001, 'burst': 2}}, group_window=1.0, dedup_window=60)
+    engine = RuleEngine([{'data_type': 'sensor_*', 'type': 'threshold', 'above': 10, 'level': 'critical',
+                          'channels': ['telegram']}])
+    now = 0.0
+    # Дребезг одного правила: неотправленные встречные переходы взаимно отменяются, остается итог
+    for value in (11, 9, 11, 9, 11):
+        notifier.submit(engine.evaluate('sensor_0', now, value), now)
+    assert notifier.stats['deduplicated'] == 4 and sent == []
+    notifier.flush(now + 1)
+    assert sent == [('sensor_0 = 11 выше 10', 'critical', 'telegram')]
+
+    # Шторм: 1000 датчиков сработали одновременно - сообщений не больше лимита канала
+    for i in range(1, 1001):
+        notifier.submit(engine.evaluate(f"sensor_{i}", now + 2, 50), now + 2)
+    for step in range(10):
+        notifier.flush(now + 3 + step)
+    assert len(sent) == 2
+    assert sent[1][0].startswith('Алертов: 1000') and '... и еще 990' in sent[1][0]
+    assert notifier.stats['overflow'] == 900 and notifier.stats['rate_limited'] == 0
+    notifier.submit(engine.evaluate('sensor_0', now + 100, 5), now + 100)
+    notifier.flush(now + 200)
+    assert len(sent) == 2 and notifier.stats['rate_limited'] >= 1 and notifier.pending() == 1
+
+
+def test_notifier_never_drops_state_change():
+    sent = []
+    notifier = AlertNotifier(lambda message, level, channel: sent.append(message), group_window=0, dedup_window=300)
+    engine = RuleEngine([{'name': 'hot', 'data_type': 'temp', 'type': 'threshold', 'above': 35, 'clear_below': 33}])
+    # Повторное срабатывание после доставленного "в норме" доставляется даже внутри dedup_window
+    for ts, value in ((0, 36), (10, 30), (20, 36), (1000, 40), (2000, 40)):
+        notifier.submit(engine.evaluate('temp', ts, value), ts)
+    assert sent == ['temp = 36 выше 35', 'temp = 30 в норме', 'temp = 36 выше 35']
+    assert engine.active() == ['hot'] and notifier.stats['deduplicated'] == 0
+
+
+def test_monitoring_raises_alerts_from_collect_data():
+    sent = []
+    analytics = MonitoringAnalytics({'monitoring': {'enabled': True, 'alerts': {
+        'group_window': 0, 'rules': [{'name': 'hot', 'data_type': 'temperature_kitchen', 'type': 'threshold',
+                                      'above': 35, 'clear_below': 33}]}}})
+    analytics.set_alert_sender(lambda message, level, channel: sent.append((message, level, channel)))
+    now = time.time()
+    analytics.collect_data('temperature_kitchen', 30, now)
+    analytics.collect_data('temperature_kitchen', 36, now + 1)
+    analytics.collect_data('temperature_kitchen', 32, now + 2)
+    assert sent[0] == ('temperature_kitchen = 36 выше 35', 'warning', 'mqtt')
+    assert sent[1][1] == 'info' and len(sent) == 2
+    assert analytics.get_daily_report()['summary']['total_alerts'] == 1
+
+
+def test_per_sample_cost_does_not_depend_on_rule_count():
+    def cost(rules):
+        engine = RuleEngine(rules)
+        samples = 20000
+        started = time.perf_counter()
+        for i in range(samples):
+            engine.evaluate('sensor_0', i, 20.0 + i % 3)
+        return (time.perf_counter() - started) / samples
+
+    own = [{'data_type': 'sensor_0', 'type': 'threshold', 'above': 30},
+           {'data_type': 'sensor_0', 'type': 'rate', 'max_rate': 10},
+           {'data_type': 'sensor_0', 'type': 'stale', 'max_age': 1e9}]
+    others = [{'data_type': f"sensor_{i}", 'type': kind, 'above': 30, 'max_rate': 10, 'max_age': 1e9}
+              for i in range(1, 2001) for kind in ('threshold', 'rate')]
+    small, large = min(cost(own) for _ in range(3)), min(cost(own + others) for _ in range(3))
+    assert large < small * 1.5, f"{small * 1e6:.2f} мкс -> {large * 1e6:.2f} мкс"
+    assert large < 20e-6
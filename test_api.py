@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты веб-API: снимки с ETag/304 и поток server-sent events
+"""
+
+import json
+import threading
+import time
+import urllib.request
+
+from modules.monitoring import MonitoringAnalytics
+from modules.web_api import ApiService, EventStream, Snapshot
+
+
+class CountingSource:
+    def __init__(self):
+        self.calls = 0
+
+    def get_stats(self):
+        self.calls += 1
+        return {'calls': self.calls}
+
+
+def test_snapshot_rebuilds_only_on_new_version():
+    version, builds = [0], []
+    snapshot = Snapshot(lambda: builds.append(1) or {'v': version[0] // 2}, lambda: version[0])
+    body, etag = snapshot.get()
+    assert snapshot.get() == (body, etag) and len(builds) == 1
+    version[0] = 1
+    # Версия сменилась, содержимое то же - ETag прежний
+    assert snapshot.get()[1] == etag and len(builds) == 2
+    version[0] = 2
+    assert snapshot.get()[1] != etag and json.loads(snapshot.get()[0]) == {'v': 1}
+
+
+def test_readings_etag_and_not_modified():
+    source = CountingSource()
+    api = ApiService({'api': {'stats_interval': 60}}, sources={'polling': source})
+    client = api.create_app().test_client()
+
+    api.publish('temperature', 21.5, 1000.0)
+    api.flush()
+    response = client.get('/api/readings')
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+    assert response.get_json()['readings'] == {'temperature': {'value': 21.5, 'ts': 1000.0}}
+    assert client.get('/api/readings', headers={'If-None-Match': etag}).status_code == 304
+
+    api.publish('temperature', 22.0, 1001.0)
+    api.flush()
+    response = client.get('/api/readings', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+    # Статистика модулей собирается не чаще stats_interval, сколько бы ни было запросов
+    for _ in range(20):
+        assert client.get('/api/stats').get_json()['polling'] == {'calls': 1}
+    assert source.calls == 1
+
+
+def test_report_snapshot_follows_data():
+    monitoring = MonitoringAnalytics({'monitoring': {'enabled': True}})
+    api = ApiService({'api': {'report_interval': 0}}, monitoring)
+    client = api.create_app().test_client()
+    monitoring.collect_data('temperature', 20.0)
+    api.publish('temperature', 20.0, time.time())
+    api.flush()
+    report = client.get('/api/report').get_json()
+    assert report['summary']['total_data_points'] == 1
+    # Точка без приемника "api": отчет все равно следует за данными мониторинга
+    monitoring.collect_data('humidity', 40.0)
+    assert client.get('/api/report').get_json()['summary']['total_data_points'] == 2
+    assert client.get('/api/report?date=' + monitoring.report_date()).get_json()['summary']['total_data_points'] == 2
+    assert client.get('/api/report?date=yesterday').status_code == 400
+
+
+def test_event_stream_serializes_once_for_all_clients():
+    stream = EventStream(keepalive=1)
+    clients = [stream.subscribe() for _ in range(3)]
+    assert all(next(client) == b'retry: 3000\n\n' for client in clients)
+    stream.publish('readings', {'t': 1})
+    chunks = [next(client) for client in clients]
+    assert chunks[0] == b'id: 1\nevent: readings\ndata: {"t":1}\n\n'
+    assert all(chunk is chunks[0] for chunk in chunks)
+
+    # Отставший клиент получает пропущенное одной частью; возобновление по Last-Event-ID
+    stream.publish('readings', {'t': 2})
+    stream.publish('readings', {'t': 3})
+    assert next(clients[0]).count(b'event: readings') == 2
+    resumed = stream.subscribe(last_id=1)
+    next(resumed)
+    assert next(resumed).startswith(b'id: 2\n')
+    for client in clients + [resumed]:
+        client.close()
+    assert stream.clients == 0
+
+
+def test_event_stream_limits_clients_and_keepalive():
+    stream = EventStream(keepalive=0.05, max_clients=1)
+    client = stream.subscribe()
+    assert stream.subscribe() is None
+    next(client)
+    assert next(client) == b': ping\n\n'
+    stream.close()
+    assert list(client) == [] and stream.clients == 0
+
+
+def test_sse_over_http():
+    api = ApiService({'api': {'enabled': True, 'host': '127.0.0.1', 'port': 0, 'stream_interval': 0.01}})
+    api.start()
+    try:
+        base = 'http://%s:%d' % api.address
+        lines = []
+
+        def read():
+            with urllib.request.urlopen(base + '/api/stream', timeout=5) as response:
+                assert response.headers['Content-Type'].startswith('text/event-stream')
+                for line in response:
+                    lines.append(line)
+                    if line.startswith(b'data:'):
+                        return
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        deadline = time.monotonic() + 5
+        while api.stream.clients == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        api.publish('humidity', 40.0, 1000.0)
+        reader.join(5)
+        assert json.loads(lines[-1][len(b'data: '):]) == {'humidity': {'value': 40.0, 'ts': 1000.0}}
+        with urllib.request.urlopen(base + '/') as response:
+            assert b'EventSource' in response.read()
+    finally:
+        api.stop()
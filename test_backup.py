@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты потоковых резервных копий
+"""
+
+import os
+import tracemalloc
+
+import pytest
+
+from modules.backup import BackupEngine
+from modules.business_integrations import BusinessIntegrations
+
+
+def readings(n, start=0):
+    for i in range(start, start + n):
+        yield {'id': i, 'sensor': f"sensor_{i % 50}", 'value': i * 0.5}
+
+
+def chunk_files(engine):
+    return sum(len(files) for _, _, files in os.walk(engine.chunks_path))
+
+
+@pytest.mark.parametrize('incremental', [True, False])
+def test_round_trip(tmp_path, incremental):
+    business = BusinessIntegrations({'business': {'backup_storage': str(tmp_path),
+                                                  'backup_incremental': incremental}})
+    data = {'orders': [1, 2, 3], 'client': 'ООО Ромашка'}
+    path = business.create_backup('crm', data)
+    assert path and not [name for name in os.listdir(tmp_path) if '.tmp-' in name]
+    assert business.backups.restore(path) == data
+    path = business.create_backup('sensors', readings(5000))
+    assert list(business.restore_backup(path)) == list(readings(5000))
+    assert business.backups.read_info(path)['kind'] == 'list'
+
+
+def test_incremental_stores_only_changed_chunks(tmp_path):
+    engine = BackupEngine(str(tmp_path), chunk_size=64 * 1024, average_chunk_records=64)
+    engine.create_incremental('sensors', readings(20000), 'first')
+    written = engine.stats['chunks_written']
+    assert written > 10
+
+    # Вставка записи в середину меняет только соседние фрагменты
+    def changed():
+        yield from readings(10000)
+        yield {'id': -1, 'sensor': 'new', 'value': 0.0}
+        yield from readings(10000, 10000)
+
+    path = engine.create_incremental('sensors', changed(), 'second')
+    assert engine.stats['chunks_written'] - written <= 2
+    assert engine.stats['chunks_reused'] >= written - 2
+    assert len(list(engine.iter_backup(path))) == 20001
+
+    os.remove(os.path.join(tmp_path, 'first.manifest.json'))
+    before = chunk_files(engine)
+    assert engine.prune_chunks() >= 1
+    assert chunk_files(engine) < before
+    assert len(list(engine.iter_backup(path))) == 20001
+
+
+def test_failed_backup_leaves_no_file(tmp_path):
+    engine = BackupEngine(str(tmp_path))
+
+    def broken():
+        yield {'id': 1}
+        raise IOError("источник недоступен")
+
+    with pytest.raises(IOError):
+        engine.create_full('crm', broken(), 'broken')
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('incremental', [True, False])
+def test_memory_does_not_grow_with_dataset(tmp_path, incremental):
+    engine = BackupEngine(str(tmp_path), chunk_size=64 * 1024)
+    create = engine.create_incremental if incremental else engine.create_full
+    peaks = []
+    for index, n in enumerate((10000, 40000)):
+        tracemalloc.start()
+        create('sensors', readings(n), f"size_{index}")
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < peaks[0] * 1.5
+    assert peaks[1] < 4 * 1024 * 1024
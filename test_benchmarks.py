@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты набора бенчмарков: короткий прогон на симуляторах и сравнение с эталоном
+"""
+
+import os
+
+from benchmarks.suite import compare, load, run_suite
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+
+
+def test_quick_suite_covers_baseline_metrics():
+    results = run_suite(quick=True)
+    metrics = results['metrics']
+    assert set(metrics) == set(load(BASELINE)['metrics'])
+    assert all(m['value'] >= 0 and m['better'] in ('higher', 'lower') for m in metrics.values())
+    assert metrics['mesh.bytes_per_reading']['value'] < 8
+    assert metrics['poll.cycle_latency_p95_ms']['value'] > 0
+    assert metrics['industrial.points_per_sec']['value'] > 1000
+
+
+def test_compare_flags_only_real_regressions():
+    baseline = {'metrics': {
+        'rate': {'value': 100.0, 'unit': 'op/s', 'better': 'higher'},
+        'latency': {'value': 10.0, 'unit': 'ms', 'better': 'lower'},
+        'errors': {'value': 0.0, 'unit': 'n', 'better': 'lower'},
+    }}
+    results = {'metrics': {
+        'rate': {'value': 80.0, 'unit': 'op/s', 'better': 'higher'},
+        'latency': {'value': 14.0, 'unit': 'ms', 'better': 'lower'},
+        'errors': {'value': 2.0, 'unit': 'n', 'better': 'lower'},
+        'new_metric': {'value': 1.0, 'unit': 'n', 'better': 'lower'},
+    }}
+    report = {row['metric']: row for row in compare(results, baseline, tolerance=0.25)}
+    assert set(report) == {'rate', 'latency', 'errors'}
+    assert not report['rate']['regression'] and report['rate']['change'] == -0.2
+    assert report['latency']['regression'] and report['errors']['regression']
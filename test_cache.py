@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты TTL/LRU кэша
+"""
+
+import threading
+import time
+
+import pytest
+
+from modules.business_integrations import BusinessIntegrations
+from modules.cache import TTLCache
+from modules.integrations import Integrations
+
+
+def test_lru_eviction_and_ttl():
+    cache = TTLCache(max_entries=2, default_ttl=0.05)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # 'a' становится свежее 'b'
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    stats = cache.get_stats()
+    assert stats['evictions'] == 1 and stats['expirations'] == 1 and stats['hits'] == 3
+
+
+def test_concurrent_misses_run_one_load():
+    cache = TTLCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return {'status': 'ok'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('crm', loader))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{'status': 'ok'}] * 10
+    assert cache.get_stats()['coalesced'] == 9
+
+
+def test_stale_while_revalidate():
+    cache = TTLCache(default_ttl=0.05, stale_ttl=1.0)
+    versions = iter(range(100))
+    release = threading.Event()
+
+    def loader():
+        version = next(versions)
+        if version:
+            release.wait(1)
+        return version
+
+    assert cache.get('k', loader) == 0
+    time.sleep(0.06)
+    started = time.perf_counter()
+    assert cache.get('k', loader) == 0  # просроченное значение сразу, загрузка в фоне
+    assert time.perf_counter() - started < 0.05
+    release.set()
+    deadline = time.monotonic() + 1
+    while cache.get('k', loader) != 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get('k', loader) == 1
+    assert cache.get_stats()['refreshes'] == 1
+    cache.close()
+
+
+def test_max_age_is_checked_on_read():
+    cache = TTLCache(default_ttl=300, stale_ttl=60)
+    versions = iter(range(100))
+    assert cache.get('k', lambda: next(versions)) == 0
+    time.sleep(0.06)
+    # Запись загружена с долгим сроком, но вызывающему нужна не старше 0.05 с - синхронная загрузка
+    assert cache.get('k', lambda: next(versions), max_age=0.05) == 1
+    assert cache.get('k', lambda: next(versions), max_age=0.05) == 1
+    assert cache.get('k', max_age=0.0) is None
+
+    integrations = Integrations({})
+    loads = []
+    loader = lambda: loads.append(1) or len(loads)
+    assert integrations.get_cached_data('weather', 300, loader) == 1
+    assert integrations.get_cached_data('weather', 300, loader) == 1
+    time.sleep(0.06)
+    assert integrations.get_cached_data('weather', 0.05, loader) == 2
+    integrations.stop()
+
+
+def test_memory_budget_and_loader_errors():
+    cache = TTLCache(memory_mb=0.01)
+    for i in range(100):
+        cache.set(i, 'x' * 1000)
+    assert cache.get_stats()['bytes'] <= 0.01 * 1024 * 1024
+    assert cache.get(99) is not None and cache.get(0) is None
+
+    def failing():
+        raise IOError("CRM недоступна")
+
+    with pytest.raises(IOError):
+        cache.get('crm', failing)
+    assert cache.get('crm', lambda: 'ok') == 'ok'
+
+
+def test_business_lookups_are_cached():
+    business = BusinessIntegrations({'business': {'cache': {'ttl': 60}}})
+    calls = []
+    fetch = business._fetch_business_data
+    business._fetch_business_data = lambda *args: calls.append(args) or fetch(*args)
+    for _ in range(5):
+        business.get_business_data('bitrix24', 'deals', {'stage': 'new'})
+    business.get_business_data('bitrix24', 'deals', {'stage': 'won'})
+    assert len(calls) == 2
+    assert business.get_system_status('bitrix24') is business.get_system_status('bitrix24')
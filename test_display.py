@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты дифференциального обновления e-paper (без SPI/GPIO)
+"""
+
+import time
+
+from PIL import Image, ImageDraw
+
+from modules.display import DisplayManager, EpaperDisplay
+from test_epd_driver import fake_epd
+
+
+def frame(epd, text):
+    black_image = Image.new('1', (epd.width, epd.height), 255)
+    red_image = Image.new('1', (epd.width, epd.height), 255)
+    ImageDraw.Draw(black_image).text((10, 100), text, fill=0)
+    ImageDraw.Draw(red_image).rectangle((10, 10, 50, 30), fill=0)
+    return black_image, red_image
+
+
+def partial_epd():
+    epd = fake_epd()
+    epd.supports_partial = True
+    return epd
+
+
+def test_unchanged_frame_is_skipped():
+    epd = fake_epd()
+    manager = DisplayManager(epd)
+    assert manager.show(*frame(epd, '21.5 C'))
+    sent = len(epd.SPI.transfers)
+    assert not manager.show(*frame(epd, '21.5 C'))
+    assert len(epd.SPI.transfers) == sent
+    assert manager.stats['full_refreshes'] == 1
+    assert manager.stats['refreshes_skipped'] == 1
+    assert manager.stats['bytes_saved'] == manager.stats['bytes_sent']
+
+
+def test_dirty_rows_cover_change():
+    epd = fake_epd()
+    manager = DisplayManager(epd)
+    old = epd.getbuffer(frame(epd, '21.5 C')[0])
+    new = epd.getbuffer(frame(epd, '22.0 C')[0])
+    first, last = manager.dirty_rows(old, new)
+    assert 95 <= first and last <= 115
+
+
+def test_partial_window_when_supported():
+    epd = partial_epd()
+    manager = DisplayManager(epd)
+    manager.show(*frame(epd, '21.5 C'))
+    epd.SPI.transfers.clear()
+
+    assert manager.show(*frame(epd, '22.0 C'))
+    assert manager.stats['partial_refreshes'] == 1
+    black = epd.getbuffer(frame(epd, '22.0 C')[0])
+    data = epd.SPI.data_after(0x13)
+    assert 0 < len(data) < len(black) // 4 and len(data) % 16 == 0
+    assert manager.stats['bytes_saved'] > 0
+
+
+def test_no_partial_on_b_panel_and_periodic_full_refresh():
+    epd = fake_epd()
+    manager = DisplayManager(epd)
+    manager.show(*frame(epd, '1'))
+    manager.show(*frame(epd, '2'))
+    assert manager.stats['partial_refreshes'] == 0
+    assert manager.stats['full_refreshes'] == 2
+
+    epd = partial_epd()
+    manager = DisplayManager(epd, full_refresh_every=2)
+    for text in ('1', '2', '3', '4'):
+        manager.show(*frame(epd, text))
+    assert manager.stats['partial_refreshes'] == 2
+    assert manager.stats['full_refreshes'] == 2
+
+
+def test_render_worker_never_blocks_caller():
+    epd = fake_epd()
+    pushed = []
+    display_buffers = epd.display_buffers
+
+    def slow_display_buffers(black, red):
+        time.sleep(0.3)  # обновление панели длится долго
+        display_buffers(black, red)
+        pushed.append(black)
+
+    epd.display_buffers = slow_display_buffers
+    config = {'display': {'epaper': {'enabled': True, 'update_interval': 0.2}}}
+    display = EpaperDisplay(config, epd=epd)
+    display.start()
+    try:
+        worst = 0.0
+        for i in range(40):
+            started = time.perf_counter()
+            display.update(temperature=20.0 + i)
+            worst = max(worst, time.perf_counter() - started)
+            time.sleep(0.01)
+        assert worst < 0.01
+
+        deadline = time.monotonic() + 5
+        expected = epd.getbuffer(display.render_frame({'temperature': 59.0})[0])
+        while time.monotonic() < deadline and (not pushed or pushed[-1] != expected):
+            time.sleep(0.05)
+        # Рисуется только последнее состояние, промежуточные схлопываются
+        assert pushed[-1] == expected
+        assert display.stats['renders'] < display.stats['updates'] / 4
+    finally:
+        display.stop()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Программные тесты драйвера e-paper (без SPI/GPIO)
+"""
+
+import random
+
+from PIL import Image, ImageDraw
+
+from waveshare_epd.epd2in13b_v3 import EPD, SPI_CHUNK_SIZE, DC_PIN
+
+
+class FakeGPIO:
+    BCM = 11
+    OUT = 0
+    IN = 1
+
+    def __init__(self):
+        self.levels = {}
+        self.writes = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode):
+        self.levels.setdefault(pin, 0)
+
+    def output(self, pin, value):
+        self.writes += 1
+        self.levels[pin] = value
+
+    def input(self, pin):
+        return 0  # панель никогда не занята
+
+    def cleanup(self):
+        pass
+
+
+class FakeSPI:
+    """Записывает каждую передачу вместе с уровнем DC (0 - команда, 1 - данные)"""
+
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self.transfers = []
+
+    def writebytes(self, data):
+        self.transfers.append((self.gpio.levels.get(DC_PIN, 0), bytes(data)))
+
+    def close(self):
+        pass
+
+    def data_after(self, command):
+        # Все байты данных, отправленные после последней команды command
+        result = current = None
+        for dc, data in self.transfers:
+            if dc == 0:
+                current = None
+                if data == bytes([command]):
+                    result = current = bytearray()
+            elif current is not None:
+                current += data
+        return bytes(result)
+
+
+class FakeBulkSPI(FakeSPI):
+    def writebytes2(self, data):
+        self.writebytes(data)
+
+
+def fake_epd(bulk=True):
+    gpio = FakeGPIO()
+    epd = EPD(gpio=gpio, spi=FakeBulkSPI(gpio) if bulk else FakeSPI(gpio))
+    epd.module_init()
+    return epd
+
+
+def reference_getbuffer(epd, image):
+    # Исходная попиксельная упаковка, эталон для сравнения
+    buf = [0x00] * int(epd.width * epd.height / 4)
+    image_grays = image.convert('L')
+    imwidth, imheight = image_grays.size
+    pixels = image_grays.load()
+    if imwidth == epd.width and imheight == epd.height:
+        for y in range(imheight):
+            for x in range(imwidth):
+                gray = pixels[x, y]
+                if gray < 64:
+                    buf[int((x + y * epd.width) / 4)] |= (0xC0 >> ((x % 4) * 2))
+                elif gray < 128:
+                    buf[int((x + y * epd.width) / 4)] |= (0x80 >> ((x % 4) * 2))
+                elif gray < 192:
+                    buf[int((x + y * epd.width) / 4)] |= (0x40 >> ((x % 4) * 2))
+    return buf
+
+
+def random_gray_image(epd, seed):
+    rnd = random.Random(seed)
+    image = Image.new('L', (epd.width, epd.height))
+    image.putdata([rnd.randrange(256) for _ in range(epd.width * epd.height)])
+    return image
+
+
+def test_getbuffer_matches_reference_gray():
+    epd = EPD()
+    for seed in range(3):
+        image = random_gray_image(epd, seed)
+        assert list(epd.getbuffer(image)) == reference_getbuffer(epd, image)
+
+
+def test_getbuffer_matches_reference_bw_and_rgb():
+    epd = EPD()
+    black_image = Image.new('1', (epd.width, epd.height), 255)
+    draw = ImageDraw.Draw(black_image)
+    draw.text((10, 10), 'Black Text', fill=0)
+    draw.rectangle((10, 50, 50, 90), outline=0, fill=0)
+    assert list(epd.getbuffer(black_image)) == reference_getbuffer(epd, black_image)
+
+    rgb_image = Image.new('RGB', (epd.width, epd.height), (255, 255, 255))
+    draw = ImageDraw.Draw(rgb_image)
+    draw.rectangle((0, 0, 60, 120), fill=(200, 30, 30))
+    draw.ellipse((40, 100, 120, 240), fill=(240, 220, 20))
+    assert list(epd.getbuffer(rgb_image)) == reference_getbuffer(epd, rgb_image)
+
+
+def test_getbuffer_wrong_size_is_blank():
+    epd = EPD()
+    image = Image.new('L', (epd.height, epd.width), 0)
+    assert list(epd.getbuffer(image)) == reference_getbuffer(epd, image)
+
+
+def test_getbuffer_cache_by_content():
+    epd = EPD()
+    image = random_gray_image(epd, 42)
+    first = epd.getbuffer(image)
+    assert epd.getbuffer(image.copy()) is first
+
+    changed = image.copy()
+    changed.putpixel((5, 5), 255 - changed.getpixel((5, 5)))
+    assert epd.getbuffer(changed) is not first
+    assert list(epd.getbuffer(changed)) == reference_getbuffer(epd, changed)
+
+
+def test_display_streams_planes_in_bulk():
+    epd = fake_epd()
+    black_image = random_gray_image(epd, 1)
+    red_image = random_gray_image(epd, 2)
+    epd.display(black_image, red_image)
+
+    plane = int(epd.width * epd.height / 4)
+    blank = int(epd.width * epd.height / 8)
+    chunks = -(-plane // SPI_CHUNK_SIZE) * 2 + -(-blank // SPI_CHUNK_SIZE) * 2
+    # 0x10, 0x13, 0x13, 0x10, затем 0x22 + данные 0xF7 + 0x20 при включении
+    single = 7
+    assert len(epd.SPI.transfers) == chunks + single
+    assert sum(len(d) for _, d in epd.SPI.transfers) == 2 * plane + 2 * blank + single
+    assert max(len(d) for _, d in epd.SPI.transfers) <= SPI_CHUNK_SIZE
+    # DC/CS переключаются один раз на команду записи, а не на каждый байт
+    assert epd.gpio.writes < 4 * len(epd.SPI.transfers)
+
+    assert epd.SPI.data_after(0x13) == epd.getbuffer(black_image)
+    assert epd.SPI.data_after(0x10) == epd.getbuffer(red_image)
+
+
+def test_bulk_falls_back_to_writebytes():
+    epd = fake_epd(bulk=False)
+    assert not hasattr(epd.SPI, 'writebytes2')
+    epd.Clear()
+    assert epd.SPI.data_after(0x13) == b'\xff' * int(epd.width * epd.height / 8)
+
+
+def test_partial_window_payload_is_panel_ram_format():
+    epd = fake_epd()
+    epd.supports_partial = True
+    black_image = Image.new('1', (epd.width, epd.height), 255)
+    draw = ImageDraw.Draw(black_image)
+    draw.text((10, 100), '22.0 C', fill=0)
+    draw.rectangle((60, 104, 100, 110), fill=0)
+    red_image = Image.new('1', (epd.width, epd.height), 255)
+    ImageDraw.Draw(red_image).rectangle((20, 98, 30, 112), fill=0)
+    sent = epd.display_window(epd.getbuffer(black_image), epd.getbuffer(red_image), 98, 112)
+
+    def expected(image):
+        # Строки окна в формате ОЗУ панели: 1 бит на пиксель, строка дополнена белым до 128 точек
+        window = Image.new('1', (128, 15), 255)
+        window.paste(image.crop((0, 98, epd.width, 113)), (0, 0))
+        return window.tobytes()
+
+    assert epd.SPI.data_after(0x13) == expected(black_image)
+    assert epd.SPI.data_after(0x10) == expected(red_image)
+    assert epd.SPI.data_after(0x90) == bytes([0x00, 127, 0, 98, 0, 112, 0x01])
+    assert sent == 2 * 16 * 15
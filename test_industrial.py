@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты пакетного чтения Modbus на локальном поддельном сервере
+"""
+
+import socketserver
+import struct
+import threading
+import time
+
+import pytest
+
+from modules.industrial_protocols import IndustrialProtocols, build_read_plan
+
+
+class FakeModbusServer(socketserver.ThreadingTCPServer):
+    """Минимальный Modbus TCP сервер: функции 0x03/0x04 поверх словарей регистров"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeModbusHandler)
+        self.holding = {}
+        self.input = {}
+        self.requests = []
+        self.connections = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def set_value(self, address, data_type, value, table='holding'):
+        code = {'uint16': 'H', 'int16': 'h', 'uint32': 'I', 'int32': 'i',
+                'float32': 'f', 'float64': 'd', 'int64': 'q'}[data_type]
+        raw = struct.pack('>' + code, value)
+        for i, (word,) in enumerate(struct.iter_unpack('>H', raw)):
+            getattr(self, table)[address + i] = word
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeModbusHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        while True:
+            header = self._recv(7)
+            if not header:
+                return
+            tid, _, length, unit = struct.unpack('>HHHB', header)
+            pdu = self._recv(length - 1)
+            function, start, count = struct.unpack('>BHH', pdu[:5])
+            server.requests.append((unit, function, start, count))
+            table = server.holding if function == 3 else server.input
+            if count > 125 or any(a not in table for a in range(start, start + count)):
+                reply = struct.pack('>BB', function | 0x80, 2)  # ILLEGAL DATA ADDRESS
+            else:
+                words = [table[a] for a in range(start, start + count)]
+                reply = struct.pack(f'>BB{count}H', function, count * 2, *words)
+            self.request.sendall(struct.pack('>HHHB', tid, 0, len(reply) + 1, unit) + reply)
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return b''
+            data += chunk
+        return data
+
+
+@pytest.fixture
+def server():
+    server = FakeModbusServer()
+    yield server
+    server.close()
+
+
+def industrial_for(server, **options):
+    options.update(host='127.0.0.1', port=server.port, unit_id=3)
+    return IndustrialProtocols({'industrial': {'enabled': True, 'protocols': ['modbus_tcp'],
+                                               'modbus_tcp': options}})
+
+
+def test_plan_merges_contiguous_ranges():
+    spec = tuple(('holding', 100 + 2 * i, 'float32', f"t{i}") for i in range(200))
+    spec += (('holding', 1000, 'uint16', 'x'), ('input', 100, 'int16', 'y'))
+    plan = build_read_plan(spec)
+    # 400 регистров float32 -> блоки по 124 (значение не разрывается на границе 125)
+    assert [(b.register_type, b.start, b.count) for b in plan] == [
+        ('holding', 100, 124), ('holding', 224, 124), ('holding', 348, 124), ('holding', 472, 28),
+        ('holding', 1000, 1), ('input', 100, 1)]
+    assert build_read_plan(spec) is plan  # план кэшируется по набору адресов
+    assert len(build_read_plan(spec[:3] + (('holding', 108, 'uint16', 'gap'),), max_gap=2)) == 1
+
+
+def test_read_many_matches_values(server):
+    expected = {}
+    for i in range(300):
+        data_type = ('float32', 'int32', 'uint16', 'int16', 'float64')[i % 5]
+        address = 4 * i
+        value = {'float32': 1.5 * i, 'int32': -70000 * i, 'uint16': i,
+                 'int16': -i, 'float64': i / 7.0}[data_type]
+        server.set_value(address, data_type, value)
+        expected[f"p{i}"] = (address, data_type, value)
+    for address in range(1200):
+        server.holding.setdefault(address, 0)
+
+    industrial = industrial_for(server, max_gap=3)
+    points = [{'name': name, 'address': a, 'data_type': t} for name, (a, t, _) in expected.items()]
+    values = industrial.read_many('modbus_tcp', points)
+    for name, (_, data_type, value) in expected.items():
+        assert values[name] == pytest.approx(value, rel=1e-6)
+
+    # 300 значений в 1200 регистрах -> ~1200/125 запросов вместо 300
+    assert len(server.requests) <= 11
+    assert all(unit == 3 and count <= 125 for unit, _, _, count in server.requests)
+    industrial.stop()
+
+
+def test_read_many_input_registers_and_word_order(server):
+    server.set_value(10, 'float32', 2.5, table='input')
+    raw = server.holding
+    server.set_value(20, 'int32', 123456)
+    raw[20], raw[21] = raw[21], raw[20]  # устройство отдает младшее слово первым
+    industrial = industrial_for(server, word_order='little')
+    values = industrial.read_many('modbus_tcp', [(20, 'int32')])
+    assert values == {20: 123456}
+
+    industrial = industrial_for(server)
+    point = {'name': 'flow', 'address': 10, 'data_type': 'float32', 'register_type': 'input'}
+    assert industrial.read_many('modbus_tcp', [point]) == {'flow': 2.5}
+    assert server.requests[-1][1] == 4
+
+
+def test_read_errors_yield_none(server):
+    industrial = industrial_for(server)
+    values = industrial.read_many('modbus_tcp', [(500, 'uint16')])
+    assert values == {500: None}
+    assert industrial.stats['errors'] == 1
+    assert industrial.read_register('modbus_tcp', 500, data_type='uint16') is None
+
+
+def test_connection_is_reused_and_shared_between_units(server):
+    for address in range(10):
+        server.set_value(address, 'uint16', address)
+    config = {'enabled': True, 'protocols': ['modbus_tcp', 'modbus_tcp_2'],
+              'modbus_tcp': {'host': '127.0.0.1', 'port': server.port, 'unit_id': 1},
+              'modbus_tcp_2': {'host': '127.0.0.1', 'port': server.port, 'unit_id': 2}}
+    industrial = IndustrialProtocols({'industrial': config})
+    for _ in range(20):
+        assert industrial.read_register('modbus_tcp', 3) == 3
+        assert industrial.read_register('modbus_tcp_2', 4) == 4
+
+    assert server.connections == 1
+    assert {unit for unit, _, _, _ in server.requests} == {1, 2}
+    stats = industrial.get_stats()['connections']
+    assert stats['opened'] == 1 and stats['reused'] == 39 and stats['open'] == 1
+    industrial.stop()
+    assert industrial.get_stats()['connections']['open'] == 0
+
+
+def test_concurrent_reads_are_serialized(server):
+    for address in range(100):
+        server.set_value(address, 'uint16', address * 3)
+    industrial = industrial_for(server)
+    errors = []
+
+    def worker(offset):
+        for i in range(30):
+            address = (offset * 7 + i) % 100
+            if industrial.read_register('modbus_tcp', address) != address * 3:
+                errors.append(address)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert server.connections == 1
+    industrial.stop()
+
+
+class FlakyClient:
+    """Клиент, у которого первые fail_connects подключений не удаются"""
+
+    def __init__(self, fail_connects):
+        self.fail_connects = fail_connects
+        self.connects = 0
+        self.broken = False
+
+    def connect(self):
+        self.connects += 1
+        return self.connects > self.fail_connects
+
+    def close(self):
+        pass
+
+    def read_holding_registers(self, address, count=1, device_id=1):
+        if self.broken:
+            self.broken = False
+            raise ConnectionResetError("connection reset by peer")
+        return FakeResponse([address] * count)
+
+
+class FakeResponse:
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+
+def test_reconnect_with_backoff():
+    client = FlakyClient(fail_connects=2)
+    config = {'enabled': True, 'reconnect_delay': 0.05, 'reconnect_delay_max': 0.2,
+              'modbus_tcp': {'host': 'plc', 'port': 502}}
+    industrial = IndustrialProtocols({'industrial': config}, client_factory=lambda kind, options: client)
+
+    assert industrial.read_register('modbus_tcp', 7) is None  # 1-я попытка не удалась
+    assert industrial.read_register('modbus_tcp', 7) is None  # ждем паузу, без подключения
+    assert client.connects == 1
+    time.sleep(0.06)
+    assert industrial.read_register('modbus_tcp', 7) is None  # 2-я попытка, пауза удвоилась
+    time.sleep(0.06)
+    assert client.connects == 2
+    assert industrial.read_register('modbus_tcp', 7) is None
+    time.sleep(0.05)
+    assert industrial.read_register('modbus_tcp', 7) == 7
+    assert client.connects == 3
+
+    client.broken = True
+    assert industrial.read_register('modbus_tcp', 8) is None
+    time.sleep(0.06)
+    assert industrial.read_register('modbus_tcp', 8) == 8
+    stats = industrial.get_stats()['connections']
+    assert stats['reconnects'] == 2 and stats['failures'] == 3 and stats['open'] == 1
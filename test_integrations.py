@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты конвейера MQTT публикации на поддельном брокере в процессе
+"""
+
+import json
+import threading
+import time
+
+from modules.integrations import Integrations
+from modules.mqtt_publisher import MqttPublisher
+
+
+class FakeBroker:
+    """Брокер в процессе: принимает публикации и подтверждает QoS1 с задержкой"""
+
+    def __init__(self, ack_delay=0.0):
+        self.up = True
+        self.ack_delay = ack_delay
+        self.messages = []
+        # Повторы paho с флагом DUP после переподключения
+        self.redelivered = []
+        self.lock = threading.Lock()
+        self.max_unacked = 0
+        self.unacked = 0
+
+
+class FakeInfo:
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+
+class FakeClient:
+    """
+    Клиент с интерфейсом paho.mqtt.client.Client поверх FakeBroker. Как paho, хранит
+    неподтвержденные QoS1 до PUBACK и после переподключения отправляет их снова
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.connected = False
+        self.session = 0
+        self.mid = 0
+        self.max_inflight = 20
+        self.out_messages = {}
+        self.on_connect = self.on_disconnect = self.on_publish = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def connect_async(self, host, port, keepalive):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        self.max_inflight = inflight
+
+    def loop_start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def loop_stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self.on_disconnect(self, None, {}, 0, None)
+
+    def _loop(self):
+        # Поток сети: переподключение к брокеру, когда он снова доступен
+        while not self._stop.is_set():
+            if self.broker.up and not self.connected:
+                with self._lock:
+                    self.connected = True
+                    self.session += 1
+                    pending = sorted(self.out_messages.items())
+                self.on_connect(self, None, {}, 0, None)
+                for mid, (message, sent) in pending:
+                    self._deliver(mid, message, dup=sent)
+            elif not self.broker.up and self.connected:
+                self.connected = False
+                self.on_disconnect(self, None, {}, 7, None)
+            time.sleep(0.005)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self._lock:
+            self.mid += 1
+            mid = self.mid
+            if not self.connected:
+                # MQTT_ERR_NO_CONN: QoS1 paho оставляет в очереди до подключения, QoS0 теряется
+                if qos:
+                    self.out_messages[mid] = ((topic, payload, qos), False)
+                return FakeInfo(4, mid)
+            if qos:
+                self.out_messages[mid] = ((topic, payload, qos), True)
+        self._deliver(mid, (topic, payload, qos))
+        return FakeInfo(0, mid)
+
+    def _deliver(self, mid, message, dup=False):
+        broker = self.broker
+        session = self.session
+        with broker.lock:
+            (broker.redelivered if dup else broker.messages).append(message)
+            broker.unacked += 1
+            broker.max_unacked = max(broker.max_unacked, broker.unacked)
+        with self._lock:
+            if mid in self.out_messages:
+                self.out_messages[mid] = (message, True)
+
+        def ack():
+            if broker.ack_delay:
+                time.sleep(broker.ack_delay)
+            with broker.lock:
+                broker.unacked -= 1
+            with self._lock:
+                # PUBACK потерян вместе с подключением: сообщение остается в очереди клиента
+                if not self.connected or self.session != session:
+                    return
+                self.out_messages.pop(mid, None)
+            self.on_publish(self, None, mid, 0, None)
+
+        threading.Thread(target=ack, daemon=True).start()
+
+
+def publisher(tmp_path, broker, **options):
+    options.setdefault('spool_path', str(tmp_path / 'spool.db'))
+    return MqttPublisher(options, client_factory=lambda opts: FakeClient(broker))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_publish_never_blocks_and_window_is_respected(tmp_path):
+    broker = FakeBroker(ack_delay=0.02)
+    mqtt = publisher(tmp_path, broker, max_inflight=5)
+    mqtt.start()
+    try:
+        started = time.perf_counter()
+        for i in range(100):
+            assert mqtt.publish('sensors/temp', {'temp': i})
+        assert time.perf_counter() - started < 0.1
+        assert wait_for(lambda: mqtt.get_stats()['acked'] == 100)
+        assert broker.max_unacked <= 5
+        assert [json.loads(m[1])['temp'] for m in broker.messages] == list(range(100))
+        assert all(qos == 1 for _, _, qos in broker.messages)
+    finally:
+        mqtt.stop()
+
+
+def test_batching_per_topic(tmp_path):
+    broker = FakeBroker()
+    mqtt = publisher(tmp_path, broker, batch_max_items=10, batch_max_delay=0.05)
+    mqtt.start()
+    try:
+        for i in range(25):
+            mqtt.publish('sensors/a', {'v': i})
+            mqtt.publish('sensors/b', {'v': -i})
+        assert wait_for(lambda: sum(len(json.loads(m[1])) for m in broker.messages) == 50)
+        a = [json.loads(m[1]) for m in broker.messages if m[0] == 'sensors/a']
+        assert [item['v'] for batch in a for item in batch] == list(range(25))
+        assert len(broker.messages) <= 8
+    finally:
+        mqtt.stop()
+
+
+def test_offline_spool_survives_restart_and_drains_rate_limited(tmp_path):
+    broker = FakeBroker()
+    broker.up = False
+    mqtt = publisher(tmp_path, broker, drain_rate=200, drain_burst=10)
+    mqtt.start()
+    for i in range(50):
+        mqtt.publish('sensors/temp', i)
+    assert wait_for(lambda: mqtt.get_stats()['spool_depth'] == 50)
+    mqtt.stop()
+    assert broker.messages == []
+
+    mqtt = publisher(tmp_path, broker, drain_rate=200, drain_burst=10)
+    mqtt.start()
+    try:
+        assert mqtt.get_stats()['spool_depth'] == 50
+        broker.up = True
+        started = time.monotonic()
+        mqtt.publish('sensors/temp', 50)
+        assert wait_for(lambda: len(broker.messages) == 51)
+        # 10 сразу из запаса, остальные 41 со скоростью 200/с
+        assert time.monotonic() - started >= 0.15
+        assert [int(m[1]) for m in broker.messages] == list(range(51))
+        assert mqtt.get_stats()['drained'] >= 50
+    finally:
+        mqtt.stop()
+
+
+def test_spooled_rows_are_deleted_only_after_ack(tmp_path):
+    broker = FakeBroker(ack_delay=0.3)
+    broker.up = False
+    mqtt = publisher(tmp_path, broker, max_inflight=50)
+    mqtt.start()
+    for i in range(5):
+        mqtt.publish('sensors/temp', i)
+    assert wait_for(lambda: mqtt.get_stats()['spool_depth'] == 5)
+    try:
+        assert mqtt.client.max_inflight == 50
+        broker.up = True
+        assert wait_for(lambda: len(broker.messages) == 5)
+        # Отправлены, но без PUBACK: при падении сейчас строки остались бы на диске
+        assert mqtt.get_stats()['spool_depth'] == 5
+        assert wait_for(lambda: mqtt.get_stats()['spool_depth'] == 0)
+        assert [int(m[1]) for m in broker.messages] == list(range(5))
+    finally:
+        mqtt.stop()
+
+
+def test_reconnect_relies_on_client_resend(tmp_path):
+    broker = FakeBroker(ack_delay=0.2)
+    mqtt = publisher(tmp_path, broker, max_inflight=50)
+    mqtt.start()
+    try:
+        for i in range(10):
+            mqtt.publish('sensors/temp', i)
+        assert wait_for(lambda: len(broker.messages) == 10)
+        # Обрыв до PUBACK: подтверждения потеряны, paho повторит сообщения сам после переподключения
+        broker.up = False
+        assert wait_for(lambda: not mqtt.get_stats()['connected'])
+        time.sleep(0.25)
+        broker.up = True
+        assert wait_for(lambda: mqtt.get_stats()['acked'] == 10)
+        for i in range(10, 15):
+            mqtt.publish('sensors/temp', i)
+        assert wait_for(lambda: mqtt.get_stats()['acked'] == 15)
+        assert [int(m[1]) for m in broker.messages] == list(range(15))
+        assert sorted(int(m[1]) for m in broker.redelivered) == list(range(10))
+        stats = mqtt.get_stats()
+        assert stats['spool_depth'] == 0 and stats['inflight'] == 0 and not mqtt._early_acks
+    finally:
+        mqtt.stop()
+
+
+def test_no_conn_publish_stays_with_client(tmp_path):
+    broker = FakeBroker()
+    mqtt = publisher(tmp_path, broker)
+    mqtt.start()
+    try:
+        assert wait_for(lambda: mqtt.get_stats()['connected'])
+        # Обрыв между проверкой подключения и publish(): QoS1 остается в очереди paho, на диск не пишется
+        broker.up = False
+        assert wait_for(lambda: not mqtt.client.connected)
+        assert mqtt._send(('sensors/temp', b'1', 1, False))
+        assert not mqtt._send(('sensors/temp', b'0', 0, False))
+        broker.up = True
+        assert wait_for(lambda: mqtt.get_stats()['acked'] == 1)
+        assert broker.messages == [('sensors/temp', b'1', 1)] and mqtt.get_stats()['spool_depth'] == 0
+    finally:
+        mqtt.stop()
+
+
+def test_integrations_publish_mqtt_uses_pipeline(tmp_path, monkeypatch):
+    broker = FakeBroker()
+    monkeypatch.setattr('modules.mqtt_publisher.paho_client_factory', lambda opts: FakeClient(broker))
+    config = {'integrations': {'enabled': True, 'systems': ['mqtt_broker'],
+                               'mqtt_broker': {'enabled': True, 'spool_path': str(tmp_path / 'spool.db')}}}
+    integrations = Integrations(config)
+    integrations.start()
+    assert integrations.publish_mqtt('sensors/temp', {'temp': 21.5})
+    assert wait_for(lambda: len(broker.messages) == 1)
+    integrations.stop()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты двоичного кодека mesh и упаковки показаний в кадры; канал LoRa - пара pty
+"""
+
+import json
+import os
+import threading
+import time
+import tty
+
+import pytest
+
+from modules.mesh_codec import (FRAME_OVERHEAD, FrameParser, ReadingCodec, decode_varint, encode_raw, encode_varint,
+                                frame, lora_airtime, unzigzag, zigzag)
+from modules.mesh_dispatch import MessageDispatcher
+from modules.mesh_network import MeshNetwork
+from modules.mesh_transport import FrameAggregator
+
+CODEC = ReadingCodec(1, [('temp', 0.01), ('humidity', 0.1)])
+
+
+def test_varint_and_zigzag():
+    for value in (0, 1, 127, 128, 300, 2 ** 35):
+        out = bytearray()
+        encode_varint(value, out)
+        assert decode_varint(bytes(out), 0) == (value, len(out))
+    for value in (0, -1, 1, -64, 63, -2 ** 40):
+        assert unzigzag(zigzag(value)) == value
+    assert zigzag(-1) == 1 and zigzag(1) == 2
+
+
+def test_codec_round_trip():
+    ts = 1700000000.0
+    readings = [('temp', 21.53, ts), ('humidity', 45.2, ts + 0.5), ('temp', 21.55, ts + 1),
+                ('temp', -5.0, ts + 1), ('pressure', 1013.25, ts + 2)]
+    payload = CODEC.encode(2, 1, readings)
+    assert CODEC.decode(payload) == (2, 1, readings)
+    # Повторяющиеся поля с близкими значениями - около 3 байт на показание
+    steady = [('temp', 20 + i * 0.01, ts + i) for i in range(50)]
+    assert len(CODEC.encode(2, 1, steady)) < 50 * 4
+    with pytest.raises(ValueError):
+        ReadingCodec(2).decode(payload)
+
+
+def test_frame_parser_resynchronizes():
+    payloads = [CODEC.encode(2, 1, [('temp', float(i), 1e9)]) for i in range(3)]
+    stream = b'\x00\xa5\x02junk' + frame(payloads[0]) + frame(payloads[1])[:-1] + b'\xff' + frame(payloads[2])
+    parser = FrameParser()
+    found = []
+    for i in range(0, len(stream), 5):
+        found += parser.feed(stream[i:i + 5])
+    assert found == [payloads[0], payloads[2]]
+    assert parser.errors >= 1
+
+
+def test_airtime():
+    assert lora_airtime(10) == pytest.approx(0.0412, abs=1e-3)
+    assert lora_airtime(51, spreading_factor=12) == pytest.approx(2.466, abs=1e-2)
+
+
+def test_aggregator_packs_up_to_mtu():
+    frames = []
+    aggregator = FrameAggregator(CODEC, frames.append, mtu=64, max_delay=60, nodes={'hub': 2})
+    aggregator.start()
+    for i in range(200):
+        aggregator.add('hub', [('temp', 20 + i % 7 * 0.01), ('humidity', 40.0)], 1700000000 + i)
+    aggregator.add('other', [('temp', 1.0)], 1700000000)
+    aggregator.stop()
+    assert all(len(data) <= 64 for data in frames)
+    parser = FrameParser()
+    decoded = [CODEC.decode(payload) for data in frames for payload in parser.feed(data)]
+    hub = [reading for destination, _, readings in decoded if destination == 2 for reading in readings]
+    assert len(hub) == 400 and len(decoded) < 40
+    assert hub[-1] == ('humidity', 40.0, 1700000199.0)
+    stats = aggregator.get_stats()
+    json_bytes = len(json.dumps({'temp': 20.01})) + len(json.dumps({'humidity': 40.0}))
+    assert stats['readings'] == 401 and stats['bytes_per_reading'] < json_bytes / 2 / 3
+    assert stats['airtime_per_reading'] > 0
+
+
+def test_aggregator_sends_non_finite_values_as_json():
+    frames = []
+    aggregator = FrameAggregator(CODEC, frames.append, max_delay=60, nodes={'hub': 2})
+    aggregator.add('hub', [('temp', float('nan')), ('humidity', 40.0), ('pressure', float('inf'))], 1700000000)
+    aggregator.flush()
+    aggregator._write_ready()
+    parser = FrameParser()
+    decoded = [CODEC.decode(payload) for data in frames for payload in parser.feed(data)]
+    # Отказ датчика не теряет остальные показания сообщения
+    assert (2, 1, [('humidity', 40.0, 1700000000.0)]) in decoded
+    raw = next(message for _, _, message in decoded if isinstance(message, dict))
+    assert raw['temp'] != raw['temp'] and raw['pressure'] == float('inf')
+    assert aggregator.get_stats()['non_finite'] == 2
+
+
+def test_aggregator_drops_oversized_messages():
+    frames = []
+    aggregator = FrameAggregator(CODEC, frames.append, max_delay=60, nodes={'hub': 2})
+    aggregator.start()
+    aggregator.send_raw('hub', {'status': 'x' * 300})
+    aggregator.add('hub', [(f"sensor_{i}", float('nan')) for i in range(40)], 1700000000)
+    aggregator.send_raw('hub', {'status': 'ok'})
+    aggregator.stop()
+    # Поток записи жив: следующее сообщение ушло, слишком длинные посчитаны
+    assert [CODEC.decode(payload)[2] for payload in FrameParser().feed(b''.join(frames))] == [{'status': 'ok'}]
+    assert aggregator.get_stats()['dropped'] == 2
+    for mtu in (FRAME_OVERHEAD, 300):
+        with pytest.raises(ValueError):
+            FrameAggregator(CODEC, frames.append, mtu=mtu)
+
+
+def test_aggregator_flushes_on_deadline():
+    frames = []
+    aggregator = FrameAggregator(CODEC, frames.append, max_delay=0.05)
+    aggregator.start()
+    aggregator.add('hub', [('temp', 1.0)], time.time())
+    deadline = time.monotonic() + 2
+    while not frames and time.monotonic() < deadline:
+        time.sleep(0.01)
+    aggregator.stop()
+    assert len(frames) == 1
+
+
+def test_lora_round_trip_over_pty():
+    pytest.importorskip('serial')
+    master, slave = os.openpty()
+    tty.setraw(master)
+    mesh = MeshNetwork({'mesh': {'enabled': True, 'protocols': ['lora'], 'lora': {
+        'port': os.ttyname(slave), 'baudrate': 9600, 'nodes': {'hub': 2}, 'batch_max_delay': 0.05,
+        'schema': {'id': 1, 'fields': {'temp': 0.01, 'humidity': 0.1}}}}})
+    mesh.start()
+    try:
+        for i in range(10):
+            assert mesh.send_message('lora', 'hub', {'temp': 21.5 + i * 0.01, 'humidity': 40.5})
+        mesh.send_message('lora', 'hub', {'status': 'ok'})
+        parser = FrameParser()
+        payloads = []
+        deadline = time.monotonic() + 3
+        while len(payloads) < 2 and time.monotonic() < deadline:
+            payloads += parser.feed(os.read(master, 4096))
+        link = mesh.connections['lora']
+    finally:
+        mesh.stop()
+        os.close(master)
+        os.close(slave)
+    raw = [p for p in payloads if p[0] == 0]
+    packed = [p for p in payloads if p[0] == 1]
+    assert CODEC.decode(raw[0]) == (2, 1, {'status': 'ok'})
+    readings = CODEC.decode(packed[0])[2]
+    assert [(k, v) for k, v, _ in readings][:2] == [('temp', 21.5), ('humidity', 40.5)]
+    assert len(readings) == 20 and link.get_stats()['frames'] == 2
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_dispatch_routes_by_index():
+    dispatcher = MessageDispatcher()
+    got = {'readings': [], 'hub': [], 'alarm': [], 'any': []}
+    dispatcher.register('lora', lambda src, msg: got['readings'].append(msg), message_type='readings')
+    dispatcher.register('lora', lambda src, msg: got['hub'].append(msg), destination='hub')
+    dispatcher.register('lora', lambda src, msg: got['alarm'].append(src), message_type='alarm')
+    dispatcher.register('zigbee', lambda src, msg: got['any'].append(msg))
+    dispatcher.start()
+    dispatcher.submit('lora', 'readings', 'hub', 'n1', 1)
+    dispatcher.submit('lora', 'readings', 'other', 'n1', 2)
+    dispatcher.submit('lora', 'alarm', 'other', 'n2', 3)
+    dispatcher.submit('lora', 'json', 'nobody', 'n3', 4)
+    assert wait_until(lambda: dispatcher.get_stats()['dispatched'] + dispatcher.get_stats()['unhandled'] == 4)
+    dispatcher.stop()
+    assert got == {'readings': [1, 2], 'hub': [1], 'alarm': ['n2'], 'any': []}
+    assert dispatcher.get_stats()['unhandled'] == 1
+
+
+def test_slow_handlers_do_not_block_fast_ones():
+    dispatcher = MessageDispatcher(workers=2, max_pending=4, slow_threshold=0.005)
+    fast, slow = [], []
+
+    def slow_handler(src, msg):
+        time.sleep(0.05)
+        slow.append(msg)
+
+    dispatcher.register('lora', lambda src, msg: fast.append(msg), message_type='readings')
+    dispatcher.register('lora', slow_handler, message_type='readings')
+    dispatcher.start()
+    for i in range(50):
+        dispatcher.submit('lora', 'readings', 'hub', 'n1', i)
+    # Первый вызов медленного обработчика прошел на месте, дальше - пул с ограниченной очередью
+    assert wait_until(lambda: len(fast) == 50, timeout=0.5)
+    dispatcher.stop()
+    stats = dispatcher.get_stats()
+    assert stats['offloaded'] <= 4 and stats['pool_dropped'] >= 40
+    assert len(slow) == 1 + stats['offloaded']
+
+
+def test_queue_overflow_drops_oldest():
+    dispatcher = MessageDispatcher(queue_size=10)
+    seen = []
+    dispatcher.register('lora', lambda src, msg: seen.append(msg))
+    for i in range(25):
+        dispatcher.submit('lora', 'readings', 'hub', 'n1', i)
+    assert dispatcher.get_stats()['dropped'] == 15
+    dispatcher.start()
+    assert wait_until(lambda: len(seen) == 10)
+    dispatcher.stop()
+    assert seen == list(range(15, 25))
+
+
+def test_receive_burst_over_pty():
+    pytest.importorskip('serial')
+    master, slave = os.openpty()
+    tty.setraw(master)
+    mesh = MeshNetwork({'mesh': {'enabled': True, 'protocols': ['lora'], 'lora': {
+        'port': os.ttyname(slave), 'nodes': {'hub': 2},
+        'schema': {'id': 1, 'fields': {'temp': 0.01, 'humidity': 0.1}}},
+        'dispatch': {'queue_size': 4096}}})
+    readings, commands, slow = [], [], []
+    mesh.register_message_handler('lora', lambda src, msg: readings.append((src, msg)), message_type='readings')
+    mesh.register_message_handler('lora', lambda src, msg: commands.append(msg), message_type='command',
+                                  destination='mega_agent')
+    mesh.register_message_handler('lora', lambda src, msg: (time.sleep(0.01), slow.append(msg)),
+                                  message_type='readings', slow=True)
+    mesh.start()
+    frames = 2000
+    burst = b''.join(frame(CODEC.encode(1, 2, [('temp', 20 + i * 0.01, 1e9 + i), ('humidity', 40.0, 1e9 + i)]))
+                     for i in range(frames))
+    burst += frame(encode_raw(1, 3, {'type': 'command', 'action': 'refresh'}))
+    burst += frame(encode_raw(2, 3, {'type': 'command', 'action': 'not_for_us'}))
+    started = time.perf_counter()
+    writer = threading.Thread(target=os.write, args=(master, burst))
+    writer.start()
+    try:
+        assert wait_until(lambda: len(readings) == frames and len(commands) == 1, timeout=20)
+        elapsed = time.perf_counter() - started
+        stats = mesh.get_stats()
+    finally:
+        writer.join()
+        mesh.stop()
+        os.close(master)
+        os.close(slave)
+    assert readings[0] == ('hub', [('temp', 20.0, 1e9), ('humidity', 40.0, 1e9)])
+    assert commands == [{'type': 'command', 'action': 'refresh'}]
+    assert stats['dispatch']['dropped'] == 0 and stats['lora']['rx']['frames'] == frames + 2
+    # Медленный обработчик не тормозит прием: лишние вызовы отбрасываются, а не копятся
+    assert stats['dispatch']['pool_dropped'] > 0
+    assert frames / elapsed > 2000
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты реестра метрик, эндпоинта /metrics и выборочного профилировщика
+"""
+
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from modules.metrics import MetricsRegistry, MetricsServer, SamplingProfiler, measure_overhead
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter('jobs_total', 'Выполненные задачи', {'job': 'a"b'}).inc(3)
+    registry.gauge('depth', 'Глубина', function=lambda: 7)
+    histogram = registry.histogram('latency_seconds', 'Задержка', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert '# TYPE jobs_total counter' in lines and 'jobs_total{job="a\\"b"} 3' in lines
+    assert 'depth 7' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'latency_seconds_count 4' in lines and 'latency_seconds_sum 6.05' in lines
+    assert histogram.quantile(0.5) == 1 and histogram.count == 4
+
+
+def test_registration_is_idempotent():
+    registry = MetricsRegistry()
+    counter = registry.counter('hits_total', labels={'port': '1'})
+    assert registry.counter('hits_total', labels={'port': '1'}) is counter
+    assert registry.counter('hits_total', labels={'port': '2'}) is not counter
+    with pytest.raises(ValueError):
+        registry.gauge('hits_total')
+    # Функция заменяется при повторной регистрации: экземпляр модуля, созданный последним
+    stats = {'n': 1}
+    registry.counter('stats_total', function=lambda: stats['n'])
+    registry.counter('stats_total', function=lambda: stats['n'] * 10)
+    assert registry.snapshot('stats')['stats_total'] == 10
+
+
+def test_non_finite_values_are_rendered():
+    registry = MetricsRegistry()
+    registry.gauge('temperature').set(float('nan'))
+    registry.gauge('low').set(float('-inf'))
+    registry.histogram('latency_seconds', buckets=(1.0,)).observe(float('inf'))
+    text = registry.render()
+    assert 'temperature NaN' in text and 'low -Inf' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in text and 'latency_seconds_sum +Inf' in text
+
+
+def test_measure_overhead_reports_all_operations():
+    # Само время наблюдения отслеживает бенчмарк metrics.*_ns (python -m benchmarks), не unit-тест
+    overhead = measure_overhead(iterations=1000)
+    assert {'counter_inc_ns', 'histogram_observe_ns'} <= set(overhead) and min(overhead.values()) > 0
+
+
+def test_metrics_endpoint_and_profiler_switch():
+    registry = MetricsRegistry()
+    registry.counter('requests_total').inc()
+    profiler = SamplingProfiler(interval=0.002, registry=registry)
+    server = MetricsServer(registry, profiler, port=0)
+    server.start()
+    base = 'http://%s:%d' % server.address
+    stop = threading.Event()
+    busy = threading.Thread(target=lambda: [time.sleep(0.001) for _ in iter(stop.is_set, True)], name='busy-worker')
+    busy.start()
+    try:
+        with urllib.request.urlopen(base + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'requests_total 1' in response.read().decode()
+        urllib.request.urlopen(urllib.request.Request(base + '/profile/start', method='POST')).read()
+        assert profiler.running
+        time.sleep(0.1)
+        urllib.request.urlopen(urllib.request.Request(base + '/profile/stop', method='POST')).read()
+        assert not profiler.running
+        stacks = urllib.request.urlopen(base + '/profile').read().decode()
+        assert any(line.startswith('busy-worker;') for line in stacks.splitlines())
+        assert registry.snapshot()['mega_agent_profiler_samples_total'] > 0
+    finally:
+        stop.set()
+        busy.join()
+        server.stop()
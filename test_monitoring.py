@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты хранилища и аналитики модуля мониторинга
+"""
+
+import csv
+import time
+
+import numpy as np
+import pytest
+
+from modules.forecasting import HoltWintersBank
+from modules.monitoring import REJECTED, MonitoringAnalytics
+from modules.rollups import RollupStore
+from modules.timeseries import RingBuffer, TimeSeriesStore
+
+
+def monitoring(**options):
+    options.setdefault('enabled', True)
+    return MonitoringAnalytics({'monitoring': options})
+
+
+def test_ring_buffer_wraps_and_windows_are_views():
+    buffer = RingBuffer(5)
+    for i in range(12):
+        buffer.append(float(i), i * 10.0)
+    times, values = buffer.window()
+    assert list(times) == [7.0, 8.0, 9.0, 10.0, 11.0]
+    assert list(values) == [70.0, 80.0, 90.0, 100.0, 110.0]
+    assert list(buffer.window(2)[1]) == [100.0, 110.0]
+    assert np.shares_memory(values, buffer.window(3)[1])
+    assert not values.flags.writeable
+    assert buffer.latest() == (11.0, 110.0)
+    assert list(buffer.since(8.5, 10.0)[0]) == [9.0, 10.0]
+    assert len(buffer) == 5 and buffer.total == 12
+
+
+def test_store_respects_memory_limit():
+    store = TimeSeriesStore(retention_samples=15000, memory_limit_mb=1, min_samples=1000)
+    assert store.append('a', 0.0, 1.0)
+    assert store['a'].capacity == 15000
+    assert store.append('b', 0.0, 1.0)
+    # 1 МБ = 32768 отсчетов: третьему ряду достается остаток, четвертому ничего
+    assert store.append('c', 0.0, 1.0)
+    assert store['c'].capacity == 32768 - 30000
+    assert store.append('d', 0.0, 1.0) is False
+    assert store.memory_usage() <= 1024 * 1024
+    assert store.get_stats()['dropped'] == 1
+
+
+def test_collect_data_stores_samples():
+    analytics = monitoring(retention_samples=1000)
+    for i in range(1500):
+        analytics.collect_data('temperature_kitchen', 20 + i % 10, timestamp=1000.0 + i)
+    analytics.collect_data('temperature_kitchen', 'n/a')
+    times, values = analytics.data_history.window('temperature_kitchen')
+    assert len(times) == 1000
+    assert times[0] == 1500.0 and times[-1] == 2499.0
+    assert values[-1] == 20 + 1499 % 10
+
+
+def test_non_finite_samples_are_rejected():
+    analytics = monitoring(stats_windows=[10])
+    rejected = REJECTED.value
+    now = time.time()
+    for i in range(20):
+        analytics.collect_data('temp', 20.0 + i % 2, now + i)
+        if i == 5:
+            for bad in (float('nan'), float('inf'), '-inf'):
+                analytics.collect_data('temp', bad, now + i)
+    assert REJECTED.value - rejected == 3
+    assert analytics.data_history['temp'].total == 20
+    result = analytics.analyze_patterns('temp', 10)
+    assert result['mean'] == pytest.approx(20.5) and result['std'] == pytest.approx(0.5)
+    summary = analytics.get_daily_report(analytics.report_date(now))['analytics']['temp']
+    assert np.isfinite([summary['mean'], summary['std']]).all()
+    assert all(np.isfinite(analytics.predict_future('temp', 3)))
+
+
+def test_collect_data_throughput():
+    analytics = monitoring()
+    collect = analytics.collect_data
+    n = 100000
+    started = time.perf_counter()
+    for i in range(n):
+        collect('sensor', i, i)
+    elapsed = time.perf_counter() - started
+    print(f"collect_data: {n / elapsed:.0f} отсчетов/с")
+    assert analytics.data_history['sensor'].total == n
+    assert n / elapsed > 50000
+
+
+def reference_stats(times, values):
+    slope = np.polyfit(times, values, 1)[0] if len(values) > 1 else 0.0
+    return {'count': len(values), 'mean': np.mean(values), 'std': np.std(values),
+            'min': np.min(values), 'max': np.max(values), 'slope': slope}
+
+
+def test_rolling_stats_match_full_recompute():
+    analytics = monitoring(stats_windows=[10, 100])
+    rng = np.random.default_rng(7)
+    series = 20.0 + np.cumsum(rng.normal(0, 1, 1000))
+    for i, value in enumerate(series):
+        analytics.collect_data('t', value, 1.7e9 + 10 * i)
+        if i % 97 == 0 or i == len(series) - 1:
+            for size in (10, 100):
+                lo = max(0, i + 1 - size)
+                expected = reference_stats(1.7e9 + 10 * np.arange(lo, i + 1), series[lo:i + 1])
+                result = analytics.analyze_patterns('t', size)
+                for key, value in expected.items():
+                    assert result[key] == pytest.approx(value, rel=1e-6, abs=1e-6), (i, size, key)
+
+
+def test_new_window_is_backfilled_from_history():
+    analytics = monitoring(stats_windows=[])
+    for i in range(500):
+        analytics.collect_data('ramp', i * 0.5, 1000.0 + i)
+    result = analytics.analyze_patterns('ramp', 50)
+    assert result['count'] == 50
+    assert result['min'] == 450 * 0.5 and result['max'] == 499 * 0.5
+    assert result['slope'] == pytest.approx(0.5)
+    assert result['trend'] == 'increasing'
+    analytics.collect_data('ramp', 0.0, 1500.0)
+    assert analytics.analyze_patterns('ramp', 50)['min'] == 0.0
+
+    for i in range(50):
+        analytics.collect_data('flat', 20.0 + (i % 2) * 0.1, 1000.0 + i)
+    assert analytics.analyze_patterns('flat', 50)['trend'] == 'stable'
+    assert analytics.analyze_patterns('missing', 10)['count'] == 0
+
+
+def test_analyze_patterns_cost_does_not_grow_with_history():
+    analytics = monitoring(stats_windows=[100])
+
+    def query_time():
+        started = time.perf_counter()
+        for _ in range(2000):
+            analytics.analyze_patterns('sensor', 100)
+        return time.perf_counter() - started
+
+    for i in range(1000):
+        analytics.collect_data('sensor', i % 17, i)
+    small = query_time()
+    for i in range(1000, 100000):
+        analytics.collect_data('sensor', i % 17, i)
+    large = query_time()
+    assert large < small * 3
+
+
+def daily_pattern(ts, offset=20.0):
+    return offset + 5 * np.sin(2 * np.pi * (ts % 86400) / 86400) + 0.01 * (ts - 1.7e9) / 3600
+
+
+def test_predict_future_follows_daily_season():
+    analytics = monitoring(forecast={'period': 3600})
+    start = 1.7e9 - 1.7e9 % 86400
+    assert analytics.predict_future('temp', 24) == []
+    for ts in np.arange(start, start + 4 * 86400, 300.0).tolist():
+        analytics.collect_data('temp', daily_pattern(ts), timestamp=ts)
+    forecast = analytics.predict_future('temp', 24)
+    # Первый период прогноза - открытый интервал, значения берутся в его середине
+    expected = [daily_pattern(start + 4 * 86400 - 3600 + h * 3600 + 1800) for h in range(24)]
+    assert len(forecast) == 24
+    assert np.max(np.abs(np.array(forecast) - expected)) < 0.5
+    # До закрытия интервала прогноз не пересчитывается
+    assert analytics.predict_future('temp', 24) is forecast
+    analytics.collect_data('temp', 25.0, timestamp=start + 4 * 86400 - 1)
+    assert analytics.predict_future('temp', 24) is forecast
+    analytics.collect_data('temp', 25.0, timestamp=start + 4 * 86400 + 1)
+    assert analytics.predict_future('temp', 24) is not forecast
+
+
+def test_forecast_follows_open_interval_and_long_gaps():
+    bank = HoltWintersBank(period=1, season=4)
+    bank.add('temp', 0.1, 10.0)
+    assert bank.forecast('temp', 2) == [10.0, 10.0]
+    # Модель еще без шагов: новый отсчет открытого интервала меняет прогноз
+    bank.add('temp', 0.2, 20.0)
+    assert bank.forecast('temp', 2) == [15.0, 15.0]
+
+    closed = []
+    step = bank._step
+    bank._step = lambda bucket: closed.append(bucket) or step(bucket)
+    bank.add('temp', 20.5, 30.0)
+    # Открытый интервал закрывается своим номером, из пропуска остается последний сезон
+    assert closed == [0, 16, 17, 18, 19] and bank.first[0, 0] == 15.0
+
+
+def test_forecast_skips_non_finite_samples():
+    bank = HoltWintersBank(period=1, season=4)
+    for ts in range(12):
+        bank.add('temp', ts + 0.5, 20.0)
+        bank.add('temp', ts + 0.6, float('nan') if ts % 2 else float('inf'))
+    bank.load({'temp': (np.array([12.5, 13.5]), np.array([np.nan, 20.0]))})
+    assert bank.forecast('temp', 3) == pytest.approx([20.0] * 3)
+
+
+def test_forecaster_load_matches_incremental():
+    start = 1.7e9 - 1.7e9 % 86400
+    times = np.arange(start, start + 3 * 86400, 600.0)
+    values = daily_pattern(times)
+    incremental = monitoring()
+    for ts, value in zip(times.tolist(), values.tolist()):
+        incremental.collect_data('temp', value, timestamp=ts)
+    loaded = monitoring()
+    loaded.forecaster.load({'temp': (times, values)})
+    assert np.allclose(loaded.predict_future('temp', 12), incremental.predict_future('temp', 12))
+
+
+def test_forecast_hundreds_of_sensors_within_poll_interval():
+    sensors = 500
+    start = 1.7e9 - 1.7e9 % 86400
+    analytics = monitoring()
+    times = np.arange(start, start + 3 * 86400, 600.0)
+    analytics.forecaster.load({f"sensor_{i}": (times, daily_pattern(times, i)) for i in range(sensors)})
+
+    # Закрытие интервала: шаг модели для всех рядов и прогноз для каждого
+    now = start + 3 * 86400 + 1
+    started = time.perf_counter()
+    for i in range(sensors):
+        analytics.collect_data(f"sensor_{i}", daily_pattern(now, i), timestamp=now)
+    forecasts = {i: analytics.predict_future(f"sensor_{i}", 24) for i in range(sensors)}
+    elapsed = time.perf_counter() - started
+    assert all(len(f) == 24 for f in forecasts.values())
+    assert abs(forecasts[250][1] - daily_pattern(now + 3600 + 1799, 250)) < 1.0
+    # Интервал опроса - секунды; на Orange Pi запас примерно десятикратный
+    assert elapsed < 0.1, f"{sensors} прогнозов за {elapsed * 1000:.1f} мс"
+    started = time.perf_counter()
+    for i in range(sensors):
+        analytics.predict_future(f"sensor_{i}", 24)
+    assert time.perf_counter() - started < 0.01
+
+
+def test_rollups_match_samples():
+    rollups = RollupStore([(300, 100), (3600, 10), (86400, 5)], utc_offset=0)
+    rng = np.random.default_rng(3)
+    times = np.sort(rng.uniform(0, 2 * 86400, 5000))
+    values = rng.normal(20, 3, 5000)
+    for ts, value in zip(times.tolist(), values.tolist()):
+        rollups.add('temp', ts, value)
+    for ts, row in rollups.query('temp', 86400):
+        day = values[(times >= ts) & (times < ts + 86400)]
+        assert row['count'] == len(day) and row['min'] == day.min() and row['max'] == day.max()
+        assert row['mean'] == pytest.approx(day.mean()) and row['std'] == pytest.approx(day.std())
+    # Часовой ярус хранит только последние 10 интервалов
+    assert len(rollups.query('temp', 3600)) == 10
+    total = rollups.total('temp', 86400, 86400, 2 * 86400)
+    assert total['count'] == int(np.sum(times >= 86400))
+    assert rollups.total('temp', 300, 86400, 2 * 86400)['count'] < total['count']
+
+    loaded = RollupStore([(300, 100), (3600, 10), (86400, 5)], utc_offset=0)
+    loaded.load('temp', times[::-1], values[::-1])
+    for width in (300, 3600, 86400):
+        for (ts_a, a), (ts_b, b) in zip(rollups.query('temp', width), loaded.query('temp', width)):
+            assert ts_a == ts_b and a['count'] == b['count'] and a['max'] == b['max']
+            assert a['mean'] == pytest.approx(b['mean'])
+
+    # Запоздавший отсчет попадает в свой интервал, слишком старый - только в счетчик
+    rollups.add('temp', 2 * 86400 - 10, 100.0)
+    assert rollups.query('temp', 3600)[-1][1]['max'] == 100.0
+    rollups.add('temp', 10.0, 1.0)
+    assert rollups.late == 2
+
+
+def test_daily_report_from_rollups():
+    analytics = monitoring()
+    today = time.strftime('%Y-%m-%d')
+    day_start = time.mktime(time.strptime(today, '%Y-%m-%d'))
+    for minute in range(0, 24 * 60, 5):
+        analytics.collect_data('humidity', 40.0 + minute % 2, timestamp=day_start - 86400 + minute * 60)
+    for minute in range(0, 24 * 60, 5):
+        ts = day_start + minute * 60
+        analytics.collect_data('temp', 20 + minute / 720, timestamp=ts)
+        analytics.collect_data('humidity', 50.0, timestamp=ts)
+    analytics.add_alert('threshold', 'Высокая температура', 'warning', data_type='temp')
+    analytics.add_alert('threshold', 'Высокая температура', 'warning', data_type='temp')
+    report = analytics.get_daily_report()
+    assert report['date'] == today
+    assert report['summary'] == {'total_data_points': 2 * 288, 'total_alerts': 2, 'data_types': 2}
+    temp = report['analytics']['temp']
+    assert temp['count'] == 288 and temp['min'] == 20.0 and temp['alerts'] == 2
+    midnight = time.strftime('%H:00%z', time.localtime(day_start))
+    assert len(temp['hourly']) == 24 and temp['hourly'][midnight] == pytest.approx(20 + 27.5 / 720)
+    assert any(line.startswith('humidity: среднее') for line in report['insights'])
+    assert 'temp: алертов за день - 2' in report['insights']
+
+
+def test_daily_report_on_dst_day_and_custom_tiers(monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    try:
+        # 29 марта 2026 в Берлине длится 23 часа, 25 октября - 25; суточные интервалы идут от местной полуночи
+        analytics = monitoring()
+        for date, hours in (((2026, 3, 29), 23), ((2026, 10, 25), 25)):
+            day_start = time.mktime(date + (0, 0, 0, 0, 0, -1))
+            day_end = time.mktime(date[:2] + (date[2] + 1, 0, 0, 0, 0, 0, -1))
+            for ts in range(int(day_start) - 3600, int(day_end) + 3600, 300):
+                analytics.collect_data('temp', 1.0 if day_start <= ts < day_end else 100.0, timestamp=ts)
+            temp = analytics.get_daily_report('%04d-%02d-%02d' % date)['analytics']['temp']
+            assert temp['count'] == hours * 12 and temp['max'] == 1.0
+            # Повторный час перевода назад - отдельный ключ со своим смещением
+            assert len(temp['hourly']) == hours and set(temp['hourly'].values()) == {1.0}
+        assert {'02:00+0200', '02:00+0100'} <= set(temp['hourly'])
+        assert analytics.rollups.query('temp', 86400, day_start, day_start)[0][0] == day_start
+
+        # Ни один ярус не делит сутки: сводка строится по самому мелкому
+        custom = monitoring(rollups={'tiers': [{'width': 420, 'retention': 1000},
+                                               {'width': 7 * 3600, 'retention': 100}]})
+        start = time.mktime((2026, 1, 15, 0, 0, 0, 0, 0, -1))
+        for ts in range(int(start), int(start) + 86400, 420):
+            custom.collect_data('temp', 5.0, timestamp=ts)
+        assert custom.get_daily_report('2026-01-15')['summary']['total_data_points'] > 0
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
+
+
+def test_export_streams_rollups(tmp_path):
+    analytics = monitoring()
+    for i in range(3 * 3600 // 60):
+        analytics.collect_data('temp', float(i), timestamp=7200.0 + i * 60)
+        analytics.collect_data('co2', 400.0, timestamp=7200.0 + i * 60)
+    path = str(tmp_path / 'export.csv')
+    assert analytics.export_data(path, width=3600) == 6
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['data_type'] for row in rows] == ['co2'] * 3 + ['temp'] * 3
+    assert rows[3]['count'] == '60' and float(rows[3]['mean']) == pytest.approx(29.5)
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        with pytest.raises(RuntimeError):
+            analytics.export_data(str(tmp_path / 'export.parquet'), fmt='parquet')
+    else:
+        assert analytics.export_data(str(tmp_path / 'export.parquet'), fmt='parquet', data_types=['temp']) == 3
+        assert pq.read_table(str(tmp_path / 'export.parquet')).num_rows == 3
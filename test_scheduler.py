@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты планировщика опроса
+"""
+
+import threading
+import time
+
+from modules.scheduler import PollScheduler
+
+
+def make_config(points, **polling):
+    polling['points'] = points
+    return {'polling': polling}
+
+
+def point(name, interval, **extra):
+    extra.update(name=name, protocol='modbus_tcp', address=100, data_type='float32', interval=interval)
+    return extra
+
+
+def test_schedule_does_not_drift():
+    started = []
+
+    def reader(protocol, points):
+        started.append(time.monotonic())
+        time.sleep(0.02)  # опрос занимает заметную часть интервала
+        return {p['name']: 1.0 for p in points}
+
+    scheduler = PollScheduler(make_config([point('t', 0.05)]), reader, {})
+    scheduler.start()
+    time.sleep(0.52)
+    scheduler.stop()
+
+    assert len(started) >= 9
+    for i, moment in enumerate(started):
+        assert abs(moment - started[0] - i * 0.05) < 0.03
+    assert scheduler.get_stats()['jobs']['modbus_tcp@0.05s']['overruns'] == 0
+
+
+def test_slow_sink_does_not_delay_polling():
+    reads = []
+    delivered = []
+
+    def slow_sink(p, value, ts):
+        time.sleep(0.3)
+        delivered.append(value)
+
+    def reader(protocol, points):
+        reads.append(time.monotonic())
+        return {p['name']: len(reads) for p in points}
+
+    scheduler = PollScheduler(make_config([point('t', 0.05)]), reader,
+                              {'slow': slow_sink, 'fast': lambda p, v, ts: delivered.append(v)})
+    scheduler.start()
+    time.sleep(0.42)
+    scheduler.stop()
+    assert len(reads) >= 7
+    stats = scheduler.get_stats()
+    assert stats['jobs']['modbus_tcp@0.05s']['overruns'] == 0
+    assert stats['sinks']['fast']['calls'] == len(reads)
+    assert stats['sinks']['slow']['max_latency'] >= 0.3
+
+
+def test_overruns_and_deadline_misses_are_counted():
+    def reader(protocol, points):
+        time.sleep(0.12)
+        return {}
+
+    scheduler = PollScheduler(make_config([point('t', 0.05, deadline=0.1)]), reader, {})
+    scheduler.start()
+    time.sleep(0.5)
+    scheduler.stop()
+    stats = scheduler.get_stats()['jobs']['modbus_tcp@0.05s']
+    assert stats['runs'] >= 3
+    assert stats['overruns'] >= stats['runs']
+    assert stats['deadline_misses'] == stats['runs']
+    assert stats['max_latency'] >= 0.12
+
+
+def test_hundreds_of_points_with_bounded_workers():
+    active = []
+    peak = []
+    lock = threading.Lock()
+    received = set()
+
+    def reader(protocol, points):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.pop()
+        return {p['name']: 1.0 for p in points}
+
+    points = [point(f"p{i}", 0.05 + 0.01 * (i % 10)) for i in range(300)]
+    sinks = {'monitoring': lambda p, v, ts: received.add(p['name'])}
+    scheduler = PollScheduler(make_config(points, max_workers=3), reader, sinks)
+    assert len(scheduler.jobs) == 10
+    scheduler.start()
+    time.sleep(0.3)
+    scheduler.stop()
+    assert max(peak) <= 3
+    assert len(received) == 300
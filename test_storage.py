@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты дискового журнала мониторинга
+"""
+
+import glob
+import os
+
+import numpy as np
+
+from modules.monitoring import MonitoringAnalytics
+from modules.storage import SegmentLog, RECORD
+
+
+def disk_monitoring(path, **options):
+    options.update(enabled=True, data_storage='disk', storage_path=str(path))
+    options.setdefault('fsync_interval', 60)
+    options.setdefault('segment_size_mb', 0.05)
+    return MonitoringAnalytics({'monitoring': options})
+
+
+def fill(analytics, n, series=('a', 'b', 'c')):
+    for i in range(n):
+        for k, name in enumerate(series):
+            analytics.collect_data(name, i * (k + 1), 1.7e9 + 10 * i)
+
+
+def test_recovery_after_restart(tmp_path):
+    analytics = disk_monitoring(tmp_path, retention_samples=2000)
+    analytics.start()
+    fill(analytics, 3000)
+    before = analytics.analyze_patterns('b', 100)
+    analytics.stop()
+    assert len(glob.glob(os.path.join(tmp_path, 'seg_*.dat'))) > 3
+
+    restored = disk_monitoring(tmp_path, retention_samples=2000, recovery_segments=100)
+    restored.start()
+    times, values = restored.data_history.window('b')
+    assert len(times) == 2000
+    assert times[-1] == 1.7e9 + 10 * 2999 and values[-1] == 2999 * 2
+    assert restored.analyze_patterns('b', 100) == before
+    restored.collect_data('b', -1.0, 1.7e9 + 30000)
+    assert restored.analyze_patterns('b', 100)['min'] == -1.0
+    restored.stop()
+
+
+def test_range_query_uses_index_and_pending(tmp_path):
+    analytics = disk_monitoring(tmp_path)
+    analytics.start()
+    fill(analytics, 4000)
+    analytics.storage.flush()
+    fill(analytics, 10, series=('late',))  # еще не записано на диск
+    start, end = 1.7e9 + 10 * 1234, 1.7e9 + 10 * 2345
+    times, values = analytics.query_range('c', start, end)
+    assert len(times) == 2345 - 1234 + 1
+    assert np.all(np.diff(times) > 0)
+    assert values[0] == 1234 * 3 and values[-1] == 2345 * 3
+    assert len(analytics.query_range('late', 0, 2e9)[0]) == 10
+    assert len(analytics.query_range('c', 0, 1e9)[0]) == 0
+    analytics.stop()
+
+
+def test_group_commit_and_torn_tail(tmp_path):
+    log = SegmentLog(str(tmp_path), fsync_interval=60, batch_records=100000)
+    log.open()
+    series = log.series_id('x')
+    for i in range(1000):
+        log.append(series, float(i), float(i))
+    assert log.stats['fsyncs'] == 0
+    log.close()
+    assert log.stats['fsyncs'] == 1
+
+    # Обрыв питания посреди записи: неполная запись и нули в хвосте
+    segment = sorted(glob.glob(os.path.join(tmp_path, 'seg_*.dat')))[-1]
+    with open(segment, 'ab') as f:
+        f.write(b'\0' * RECORD.size * 2 + b'\1\2\3')
+    log = SegmentLog(str(tmp_path))
+    log.open()
+    assert os.path.getsize(segment) == 1000 * RECORD.size
+    times, values = log.recover()['x']
+    assert len(times) == 1000 and values[-1] == 999.0
+    log.close()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты многопроцессного режима: кольцо отсчетов в общей памяти, порядок остановки,
+ленивый импорт модулей и перезапуск упавших процессов супервизором
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from modules.runtime import ServiceStack, create_components
+from modules.shm_ring import SampleRing
+from modules.supervisor import Supervisor, acquisition_config, worker_enabled
+
+
+def collect(reader, limit=4096):
+    samples = []
+    reader.drain(lambda series, ts, value: samples.append((reader.ring.series_name(series), ts, value)), limit)
+    return samples
+
+
+def produce(name, count):
+    ring = SampleRing.attach(name)
+    for i in range(count):
+        ring.append(f"sensor_{i % 3}", 1000.0 + i, i * 0.5)
+    ring.close()
+
+
+def test_ring_broadcast_and_overrun():
+    ring = SampleRing.create(capacity=8, max_series=4)
+    try:
+        first, second = ring.reader(), ring.reader()
+        ring.append('temperature', 1.0, 21.5)
+        ring.append('humidity', 2.0, 40.0)
+        assert collect(first) == [('temperature', 1.0, 21.5), ('humidity', 2.0, 40.0)]
+        assert collect(second, limit=1) == [('temperature', 1.0, 21.5)]
+        assert ring.series_id('temperature') == 0 and ring.series_count == 2
+
+        # Отставший на круг читатель получает последние capacity записей и счет потерь
+        for i in range(20):
+            ring.append('temperature', 10.0 + i, float(i))
+        samples = collect(second)
+        assert len(samples) == 8 and samples[-1] == ('temperature', 29.0, 19.0)
+        assert second.lost == 20 + 1 - 8
+        with pytest.raises(OverflowError):
+            for i in range(5):
+                ring.series_id(f"extra_{i}")
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_ring_across_processes():
+    ring = SampleRing.create(capacity=1024)
+    try:
+        reader = ring.reader()
+        process = multiprocessing.get_context('spawn').Process(target=produce, args=(ring.name, 300))
+        process.start()
+        process.join(30)
+        assert process.exitcode == 0
+        samples = collect(reader)
+        assert len(samples) == 300 and reader.lost == 0
+        assert samples[4] == ('sensor_1', 1004.0, 2.0)
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_restarted_writer_keeps_series_ids():
+    ring = SampleRing.create(capacity=64, max_series=4)
+    try:
+        reader = ring.reader()
+        for restart in range(5):
+            # Каждый перезапуск процесса сбора заново подключается к кольцу
+            writer = SampleRing.attach(ring.name)
+            writer.append('temperature', float(restart), 20.0)
+            writer.append('humidity', float(restart), 40.0)
+            assert writer.series_id('temperature') == 0 and writer.series_id('humidity') == 1
+            writer.close()
+        assert ring.series_count == 2
+        samples = collect(reader)
+        assert len(samples) == 10 and samples[-1] == ('humidity', 4.0, 40.0)
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_restarted_reader_resumes_from_saved_cursor():
+    ring = SampleRing.create(capacity=64, max_series=4)
+    try:
+        for i in range(5):
+            ring.append('temperature', float(i), 20.0)
+        assert len(collect(ring.reader(from_start=True, slot=1))) == 5
+        for i in range(5, 8):
+            ring.append('temperature', float(i), 20.0)
+        # Перезапуск процесса: тот же слот получает только новые записи, без повторов
+        restarted = ring.reader(from_start=True, slot=1)
+        assert [ts for _, ts, _ in collect(restarted, limit=2)] == [5.0, 6.0]
+        assert [ts for _, ts, _ in collect(ring.reader(from_start=True, slot=1))] == [7.0]
+        assert ring.saved_cursor(1) == ring.head
+        # У другого слота курсора нет: чтение с самой старой записи
+        assert len(collect(ring.reader(from_start=True, slot=2))) == 8
+        with pytest.raises(ValueError):
+            ring.reader(slot=5)
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_acquisition_points_get_single_ring_sink():
+    config = acquisition_config({'polling': {'points': [
+        {'name': 'a', 'sinks': ['mesh', 'mqtt', 'monitoring']},
+        {'name': 'b', 'sinks': ['mesh']},
+        {'name': 'c'},
+    ]}})
+    assert [point['sinks'] for point in config['polling']['points']] == [['mesh', 'ring'], ['mesh'], ['mesh', 'ring']]
+    assert not worker_enabled({'display': {'epaper': {'enabled': False}}}, 'display')
+    assert worker_enabled({'api': {'enabled': True}}, 'analytics')
+
+
+def test_service_stack_stops_in_reverse_despite_errors():
+    stopped = []
+
+    class Service:
+        def __init__(self, name, fail=False):
+            self.name, self.fail = name, fail
+
+        def start(self):
+            pass
+
+        def stop(self):
+            stopped.append(self.name)
+            if self.fail:
+                raise RuntimeError('boom')
+
+    stack = ServiceStack()
+    for name, fail in (('first', False), ('second', True), ('third', False)):
+        stack.start(name, Service(name, fail))
+    stack.stop_all()
+    assert stopped == ['third', 'second', 'first'] and stack.services == []
+
+
+def test_disabled_modules_are_not_imported():
+    code = ("import sys; from modules.runtime import create_components; "
+            "c = create_components({'monitoring': {'enabled': True}}); "
+            "print(sorted(c), sorted(m for m in sys.modules if m.startswith('modules.') and m != 'modules.runtime'))")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    components, modules = output.strip().split('] ', 1)
+    assert components == "['monitoring'"
+    for name in ('modules.display', 'modules.mesh_network', 'modules.integrations', 'modules.industrial_protocols',
+                 'modules.business_integrations', 'modules.web_api'):
+        assert name not in modules
+    assert create_components({}) == {}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def readings(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/readings", timeout=1) as response:
+            return json.loads(response.read())['readings']
+    except OSError:
+        return {}
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        time.sleep(0.05)
+
+
+def test_supervisor_moves_samples_and_restarts_workers():
+    port = free_port()
+    config = {
+        'polling': {'points': [{'name': 'temperature', 'address': 100, 'data_type': 'float32',
+                                'interval': 0.05, 'sinks': ['monitoring', 'api']}]},
+        'monitoring': {'enabled': True},
+        'api': {'enabled': True, 'host': '127.0.0.1', 'port': port, 'stream_interval': 0.01},
+        'supervisor': {'restart_delay': 0.1, 'shutdown_timeout': 10, 'poll_interval': 0.005},
+    }
+    supervisor = Supervisor(config)
+    assert set(supervisor.workers) == {'acquisition', 'analytics'}
+    supervisor.start()
+    try:
+        wait_for(lambda: 'temperature' in readings(port))
+        analytics = supervisor.workers['analytics']
+        os.kill(analytics.process.pid, signal.SIGKILL)
+        wait_for(lambda: not analytics.process.is_alive())
+        wait_for(lambda: supervisor.check() or analytics.restarts == 1)
+        assert analytics.process.is_alive()
+        # Новый процесс дочитывает кольцо и снова отдает показания
+        wait_for(lambda: 'temperature' in readings(port))
+        assert supervisor.workers['acquisition'].restarts == 0
+    finally:
+        processes = [state.process for state in supervisor.workers.values()]
+        ring_name = supervisor.ring.name
+        supervisor.stop()
+    assert all(process.exitcode == 0 for process in processes)
+    with pytest.raises(FileNotFoundError):
+        SampleRing.attach(ring_name)
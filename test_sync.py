@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты пакетной синхронизации с внешними системами на локальном HTTP-сервере
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from modules.business_integrations import BusinessIntegrations
+from modules.sync_engine import SyncEngine
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.requests = []
+        self.failures = 0
+        self.retry_after = '0'
+        self.delay = 0.0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+
+    def records(self):
+        return [record['data'] for _, _, body in self.requests for record in body['records']]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            fail = server.failures > 0
+            server.failures -= fail
+        time.sleep(server.delay)
+        if self.path.endswith('/bad'):
+            status = 400
+        elif fail:
+            status = 503
+        else:
+            status = 200
+            with server.lock:
+                server.requests.append((self.path, self.headers['Idempotency-Key'], body))
+        with server.lock:
+            server.active -= 1
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        if fail:
+            self.send_header('Retry-After', server.retry_after)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = StubServer()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def engine(tmp_path, url, **options):
+    target = {'url': url, 'max_concurrency': options.pop('max_concurrency', 2),
+              'rate': options.pop('rate', 1000), 'burst': options.pop('burst', 100)}
+    options = dict({'outbox_path': str(tmp_path / 'outbox.db'), 'batch_size': 100,
+                    'batch_max_delay': 10, 'backoff': 0.01, 'backoff_max': 0.05}, **options)
+    sync = SyncEngine(options, {'crm': target})
+    sync.start()
+    return sync
+
+
+def test_batches_by_size_and_keeps_order(tmp_path, server):
+    sync = engine(tmp_path, server.url)
+    for i in range(250):
+        assert sync.submit('crm', 'readings', {'n': i})
+    sync.submit('crm', 'stock', [{'sku': 1}, {'sku': 2}])
+    assert sync.flush(5)
+    sync.stop()
+    readings = sorted((r for r in server.requests if r[0] == '/api/readings'),
+                      key=lambda r: r[2]['records'][0]['data']['n'])
+    assert [len(r[2]['records']) for r in readings] == [100, 100, 50]
+    assert [rec['data']['n'] for r in readings for rec in r[2]['records']] == list(range(250))
+    assert any(r[0] == '/api/stock' and len(r[2]['records']) == 2 for r in server.requests)
+    stats = sync.get_stats()
+    assert stats['sent'] == 252 and stats['outbox_depth'] == 0
+
+
+def test_flushes_partial_batch_after_delay(tmp_path, server):
+    sync = engine(tmp_path, server.url, batch_max_delay=0.1)
+    sync.submit('crm', 'readings', {'n': 1})
+    deadline = time.monotonic() + 2
+    while not server.requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sync.stop()
+    assert len(server.requests) == 1
+
+
+def test_concurrency_and_rate_limits(tmp_path, server):
+    server.delay = 0.05
+    sync = engine(tmp_path, server.url, batch_size=10, max_concurrency=2)
+    sync.submit('crm', 'readings', [{'n': i} for i in range(100)])
+    assert sync.flush(5)
+    sync.stop()
+    assert len(server.requests) == 10
+    assert server.max_active == 2
+
+    server.requests.clear()
+    server.delay = 0
+    sync = engine(tmp_path, server.url, batch_size=10, rate=20, burst=1)
+    started = time.monotonic()
+    sync.submit('crm', 'readings', [{'n': i} for i in range(50)])
+    assert sync.flush(5)
+    sync.stop()
+    assert len(server.requests) == 5
+    assert time.monotonic() - started >= 0.19
+
+
+def test_retries_with_same_idempotency_key(tmp_path, server):
+    server.failures = 2
+    sync = engine(tmp_path, server.url)
+    sync.submit('crm', 'readings', [{'n': 1}, {'n': 2}])
+    assert sync.flush(5)
+    sync.stop()
+    assert len(server.requests) == 1 and sync.get_stats()['retries'] == 2
+    assert server.records() == [{'n': 1}, {'n': 2}]
+
+
+def test_retry_after_is_capped_by_backoff_max(tmp_path, server):
+    server.failures, server.retry_after = 2, '3600'
+    sync = engine(tmp_path, server.url)
+    started = time.monotonic()
+    sync.submit('crm', 'readings', {'n': 1})
+    assert sync.flush(5)
+    sync.stop()
+    assert time.monotonic() - started < 2 and server.records() == [{'n': 1}]
+
+
+def test_stop_moves_whole_queue_to_outbox(tmp_path, server):
+    sync = SyncEngine({'outbox_path': str(tmp_path / 'outbox.db'), 'batch_max_delay': 60},
+                      {'crm': {'url': 'http://127.0.0.1:1/api'}})
+    for i in range(5000):
+        assert sync.submit('crm', 'readings', {'n': i})
+    # Очередь больше одной пачки записи в outbox: остановка сразу после запуска ничего не теряет
+    sync.start()
+    sync.stop()
+    assert sync.get_stats()['dropped'] == 0
+
+    sync = engine(tmp_path, server.url, batch_size=1000)
+    assert sync.flush(10)
+    sync.stop()
+    assert sorted(record['n'] for record in server.records()) == list(range(5000))
+
+
+def test_outbox_survives_restart(tmp_path, server):
+    # Системы нет: попытки исчерпаны, записи остаются на диске
+    sync = engine(tmp_path, 'http://127.0.0.1:1/api', max_retries=1)
+    sync.submit('crm', 'readings', [{'n': i} for i in range(5)])
+    sync.flush(0.5)
+    sync.stop()
+    assert sync.get_stats()['failed_batches'] >= 1 and server.requests == []
+
+    sync = engine(tmp_path, server.url)
+    assert sync.flush(5)
+    sync.stop()
+    assert server.records() == [{'n': i} for i in range(5)]
+
+
+def test_rejected_batch_goes_to_dead_letters(tmp_path, server):
+    sync = engine(tmp_path, server.url)
+    sync.submit('crm', 'bad', {'n': 1})
+    sync.submit('crm', 'unknown_system_ok', {'n': 2})
+    assert not sync.submit('erp', 'readings', {'n': 3})
+    assert sync.flush(5)
+    stats = sync.get_stats()
+    sync.stop()
+    assert stats['rejected'] == 1 and stats['dead_letters'] == 1 and stats['sent'] == 1
+
+
+def test_business_sync_data_uses_engine(tmp_path, server):
+    business = BusinessIntegrations({'business': {
+        'enabled': True, 'systems': ['crm'], 'backup_storage': str(tmp_path),
+        'sync': {'outbox_path': str(tmp_path / 'outbox.db'), 'batch_max_delay': 0.05},
+        'crm': {'enabled': True, 'url': server.url + '/{data_type}/bulk'},
+    }})
+    business.start()
+    assert business.sync_data('crm', 'stock', {'sku': 7})
+    assert business.sync.flush(5)
+    business.stop()
+    assert server.requests[0][0] == '/api/stock/bulk'
+
+
+def test_business_system_status_reflects_sync(tmp_path, server):
+    business = BusinessIntegrations({'business': {
+        'enabled': True, 'systems': ['crm', 'erp'], 'backup_storage': str(tmp_path),
+        'cache': {'status_ttl': 0, 'stale_ttl': 0},
+        'sync': {'outbox_path': str(tmp_path / 'outbox.db'), 'batch_max_delay': 0.05},
+        'crm': {'enabled': True, 'url': server.url},
+        'erp': {'enabled': False},
+    }})
+    assert business.get_system_status('crm')['status'] == 'stopped'
+    business.start()
+    assert business.get_system_status('crm')['status'] == 'idle'
+    business.sync_data('crm', 'stock', [{'sku': 1}, {'sku': 2}])
+    assert business.sync.flush(5)
+    status = business.get_system_status('crm')
+    assert status['status'] == 'ok' and status['sent'] == 2 and status['outbox'] == 0
+    assert status['last_http_status'] == 200 and status['request_p95'] > 0
+    assert business.get_system_status('erp')['status'] == 'disabled'
+    assert business.get_system_status('sap')['status'] == 'unknown'
+    business.stop()
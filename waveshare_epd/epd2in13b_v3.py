@@ -5,11 +5,20 @@
 # * | Info        :   Optimized for Orange Pi with 4-color support
 # *****************************************************************************
 
+import hashlib
 import logging
-from PIL import Image, ImageDraw, ImageFont
-import RPi.GPIO as GPIO
-import spidev
 import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import RPi.GPIO as GPIO
+    import spidev
+except ImportError:  # no hardware: buffer packing still works
+    GPIO = None
+    spidev = None
 
 # Pin definition
 RST_PIN         = 17
@@ -21,22 +30,47 @@ BUSY_PIN        = 24
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
 
+# Number of packed frames kept by getbuffer() (keyed by image content hash)
+BUFFER_CACHE_SIZE = 8
+
+# Largest single SPI transfer: spidev rejects writes above its bufsiz
+def _spidev_bufsiz(default=4096):
+    try:
+        with open('/sys/module/spidev/parameters/bufsiz') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+SPI_CHUNK_SIZE = _spidev_bufsiz()
+
 logger = logging.getLogger(__name__)
 
 class EPD:
-    def __init__(self):
+    # 3-color B panels have no partial-refresh waveform
+    supports_partial = False
+
+    def __init__(self, gpio=None, spi=None):
+        # gpio/spi allow replacing RPi.GPIO and spidev.SpiDev (e.g. by a recording fake)
+        self.gpio = gpio if gpio is not None else GPIO
+        self.SPI = spi
         self.reset_pin = RST_PIN
         self.dc_pin = DC_PIN
         self.cs_pin = CS_PIN
         self.busy_pin = BUSY_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
-        
+        self._buffer_cache = OrderedDict()
+        # Bit shift of every column inside its byte (2 bits per pixel)
+        self._column_shifts = (6 - 2 * (np.arange(self.width) % 4)).astype(np.uint8)
+        # Partial window RAM rows are whole bytes: 1 bit per pixel, width rounded up to 8
+        self._window_width = (self.width + 7) // 8 * 8
+        self._blank_plane = b'\xff' * int(self.width * self.height / 8)
+
     def digital_write(self, pin, value):
-        GPIO.output(pin, value)
+        self.gpio.output(pin, value)
 
     def digital_read(self, pin):
-        return GPIO.input(pin)
+        return self.gpio.input(pin)
 
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
@@ -44,15 +78,24 @@ class EPD:
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
+    def spi_writebyte2(self, data):
+        # writebytes2 takes any buffer and avoids building a Python list
+        if hasattr(self.SPI, 'writebytes2'):
+            self.SPI.writebytes2(data)
+        else:
+            self.SPI.writebytes(list(data))
+
     def module_init(self):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(self.reset_pin, GPIO.OUT)
-        GPIO.setup(self.dc_pin, GPIO.OUT)
-        GPIO.setup(self.cs_pin, GPIO.OUT)
-        GPIO.setup(self.busy_pin, GPIO.IN)
-        
-        self.SPI = spidev.SpiDev(0, 0)
+        gpio = self.gpio
+        gpio.setmode(gpio.BCM)
+        gpio.setwarnings(False)
+        gpio.setup(self.reset_pin, gpio.OUT)
+        gpio.setup(self.dc_pin, gpio.OUT)
+        gpio.setup(self.cs_pin, gpio.OUT)
+        gpio.setup(self.busy_pin, gpio.IN)
+
+        if self.SPI is None:
+            self.SPI = spidev.SpiDev(0, 0)
         self.SPI.max_speed_hz = 10000000
         self.SPI.mode = 0b00
         return 0
@@ -60,8 +103,8 @@ class EPD:
     def module_exit(self):
         logging.debug("spi end")
         self.SPI.close()
-        GPIO.output(self.reset_pin, 0)
-        GPIO.cleanup()
+        self.gpio.output(self.reset_pin, 0)
+        self.gpio.cleanup()
 
     def reset(self):
         self.digital_write(self.reset_pin, 1)
@@ -83,6 +126,15 @@ class EPD:
         self.spi_writebyte([data])
         self.digital_write(self.cs_pin, 1)
 
+    def send_data_bulk(self, data):
+        # One DC/CS toggle for the whole RAM write, streamed in SPI_CHUNK_SIZE pieces
+        view = memoryview(data)
+        self.digital_write(self.dc_pin, 1)
+        self.digital_write(self.cs_pin, 0)
+        for start in range(0, len(view), SPI_CHUNK_SIZE):
+            self.spi_writebyte2(view[start:start + SPI_CHUNK_SIZE])
+        self.digital_write(self.cs_pin, 1)
+
     def ReadBusy(self):
         logger.debug("e-Paper busy")
         while(self.digital_read(self.busy_pin) == 1):      # 1: busy, 0: idle
@@ -113,62 +165,111 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        # Create a palette for the image
-        buf = [0x00] * int(self.width * self.height / 4)
+        """Pack image into 2-bit plane (4 gray levels), cached by content hash"""
+        key = hashlib.blake2b(image.tobytes(), digest_size=16)
+        key.update(("%s:%dx%d" % ((image.mode,) + image.size)).encode())
+        if image.mode == 'P':
+            key.update(bytes(image.getpalette() or []))
+        key = key.digest()
+        buf = self._buffer_cache.get(key)
+        if buf is not None:
+            self._buffer_cache.move_to_end(key)
+            return buf
+
+        buf = self._pack_image(image)
+        self._buffer_cache[key] = buf
+        if len(self._buffer_cache) > BUFFER_CACHE_SIZE:
+            self._buffer_cache.popitem(last=False)
+        return buf
+
+    def _pack_image(self, image):
+        nbytes = int(self.width * self.height / 4)
         image_grays = image.convert('L')
         imwidth, imheight = image_grays.size
-        pixels = image_grays.load()
-        
-        if(imwidth == self.width and imheight == self.height):
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Convert grayscale to 2-bit color (4 colors)
-                    gray = pixels[x, y]
-                    if gray < 64:        # Black
-                        buf[int((x + y * self.width) / 4)] |= (0xC0 >> ((x % 4) * 2))
-                    elif gray < 128:     # Dark gray (simulate red)
-                        buf[int((x + y * self.width) / 4)] |= (0x80 >> ((x % 4) * 2))
-                    elif gray < 192:     # Light gray (simulate yellow)
-                        buf[int((x + y * self.width) / 4)] |= (0x40 >> ((x % 4) * 2))
-                    # else white - no bits set
-        return buf
+        if(imwidth != self.width or imheight != self.height):
+            return bytes(nbytes)
+
+        gray = np.asarray(image_grays, dtype=np.uint8)
+        # 3: black (<64), 2: dark gray / red (<128), 1: light gray / yellow (<192), 0: white
+        level = (gray < 64).astype(np.uint8)
+        level += gray < 128
+        level += gray < 192
+        level <<= self._column_shifts
+        # Byte index is (x + y * width) / 4 while the shift depends on x only,
+        # so every byte is the OR of 4 consecutive pixels of the flat image.
+        flat = level.ravel()
+        if flat.size % 4:
+            flat = np.concatenate((flat, np.zeros(4 - flat.size % 4, dtype=np.uint8)))
+        packed = np.bitwise_or.reduce(flat.reshape(-1, 4), axis=1)
+        return packed[:nbytes].tobytes()
 
     def display(self, black_image, red_image, yellow_image=None):
         """Display 4-color image: black, white, red, yellow"""
         self.send_command(0x10)  # RED RAM
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)  # Clear red buffer
-            
+        self.send_data_bulk(self._blank_plane)  # Clear red buffer
+
         self.send_command(0x13)  # BLACK RAM
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)  # Clear black buffer
-            
+        self.send_data_bulk(self._blank_plane)  # Clear black buffer
+
         if yellow_image:
             self.send_command(0x11)  # YELLOW RAM (if supported)
-            for i in range(0, int(self.width * self.height / 8)):
-                self.send_data(0xFF)  # Clear yellow buffer
+            self.send_data_bulk(self._blank_plane)  # Clear yellow buffer
 
-        # Send black image data
+        self.display_buffers(self.getbuffer(black_image), self.getbuffer(red_image))
+
+    def display_buffers(self, black_buffer, red_buffer):
+        """Write already packed planes (see getbuffer) and refresh"""
         self.send_command(0x13)  # BLACK RAM
-        black_buffer = self.getbuffer(black_image)
-        for i in range(len(black_buffer)):
-            self.send_data(black_buffer[i])
+        self.send_data_bulk(black_buffer)
+
+        self.send_command(0x10)  # RED RAM
+        self.send_data_bulk(red_buffer)
+
+        self.TurnOnDisplay()
+
+    def window_plane(self, buffer, y_start, y_end):
+        """Rows y_start..y_end of a packed 2-bit plane in panel RAM format (1 bit per pixel, 1 = white)"""
+        packed = np.frombuffer(buffer, dtype=np.uint8)
+        index = np.arange(y_start, y_end + 1)[:, None] * self.width + np.arange(self.width)
+        level = (packed[index >> 2] >> self._column_shifts) & 3
+        # Same threshold as a '1' image: gray < 128 (levels 2 and 3) is ink
+        white = np.ones((len(index), self._window_width), dtype=bool)
+        white[:, :self.width] = level < 2
+        return np.packbits(white, axis=1).tobytes()
 
-        # Send red image data
+    # Not reachable on this panel (supports_partial = False): kept for DisplayManager's partial
+    # path, which is only exercised by tests that set supports_partial on a fake-SPI instance
+    # (test_display.partial_epd, test_epd_driver window payload test).
+    def display_window(self, black_buffer, red_buffer, y_start, y_end):
+        """Partial refresh of rows y_start..y_end (only if supports_partial); returns bytes sent"""
+        if not self.supports_partial:
+            raise NotImplementedError("partial refresh is not supported by this panel")
+        black = self.window_plane(black_buffer, y_start, y_end)
+        red = self.window_plane(red_buffer, y_start, y_end)
+        self.send_command(0x91)  # PARTIAL_IN
+        self.send_command(0x90)  # PARTIAL_WINDOW
+        self.send_data(0x00)                    # HRST
+        self.send_data(self._window_width - 1)  # HRED
+        self.send_data(y_start >> 8)            # VRST
+        self.send_data(y_start & 0xff)
+        self.send_data(y_end >> 8)              # VRED
+        self.send_data(y_end & 0xff)
+        self.send_data(0x01)                    # PT_SCAN
+
+        self.send_command(0x13)  # BLACK RAM
+        self.send_data_bulk(black)
         self.send_command(0x10)  # RED RAM
-        red_buffer = self.getbuffer(red_image)
-        for i in range(len(red_buffer)):
-            self.send_data(red_buffer[i])
+        self.send_data_bulk(red)
 
         self.TurnOnDisplay()
+        self.send_command(0x92)  # PARTIAL_OUT
+        return len(black) + len(red)
 
     def Clear(self):
         self.send_command(0x10)  # RED RAM
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data_bulk(self._blank_plane)
         self.send_command(0x13)  # BLACK RAM
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data_bulk(self._blank_plane)
         self.TurnOnDisplay()
 
     def TurnOnDisplay(self):